@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Error, Feed, UserProfile, UserParcel
+from .models import Error, Feed, ImportCheckpoint, StationWatermark, UserProfile, UserParcel
 
 # Register your models here.
 
@@ -22,6 +22,24 @@ class FeedAdmin(admin.ModelAdmin):
 admin.site.register(Feed, FeedAdmin)
 
 
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    # define which columns displayed in changelist
+    list_display = ('url', 'member', 'offset', 'finished', 'update_date', )
+    # add filtering by finished
+    list_filter = ('finished',)
+
+admin.site.register(ImportCheckpoint, ImportCheckpointAdmin)
+
+
+class StationWatermarkAdmin(admin.ModelAdmin):
+    # define which columns displayed in changelist
+    list_display = ('province_id', 'station_id', 'last_date', 'update_date', 'date_checked', )
+    # add filtering by province
+    list_filter = ('province_id',)
+
+admin.site.register(StationWatermark, StationWatermarkAdmin)
+
+
 class UserProfileAdmin(admin.ModelAdmin):
     # define which columns displayed in changelist
     list_display = ('user', )
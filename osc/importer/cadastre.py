@@ -1,22 +1,35 @@
+from collections import defaultdict
 import feedparser
-import requests
-import StringIO
+import itertools
+import multiprocessing
+import Queue
+import threading
 import zipfile
 
 
 from datetime import datetime
 from osc.exceptions import CadastreException
+from osc.services import advance_import_checkpoint
+from osc.services import clear_import_checkpoints
 from osc.services import finish_feed_read
+from osc.services import finish_import_checkpoint
+from osc.services import get_feed_validators
+from osc.services import get_import_checkpoints
 from osc.services import get_last_successful_update_date
 from osc.services.parcels import scan_parcels
 from osc.services.parcels import update_parcel_by_cadastral_code
+from osc.services import save_feed_validators
 from osc.services import start_feed_read
-from osc.services import store_parcels
+from osc.services import start_import_checkpoints
+from osc.services import store_changed_parcels
+from osc.util import cached_download
 from osc.util import error_managed
 
-from osc.services.cadastre import parse_inspire_response
+from osc.services.cadastre import iterparse_inspire
+from osc.services.cadastre import iterparse_inspire_positions
 
 from django.conf import settings
+from django.db import connections
 import logging
 import pytz
 
@@ -24,105 +37,380 @@ import pytz
 logger = logging.getLogger(__name__)
 
 url_atom_inspire = settings.CADASTRE['url_atom_inspire']
+download_workers = settings.CADASTRE['import.download_workers']
+parse_workers = settings.CADASTRE['import.parse_workers']
+queue_size = settings.CADASTRE['import.queue_size']
+
+# Messages sent to the indexer by the other stages of the import pipeline
+PIPELINE_DOWNLOADED = 'downloaded'  # (CachedDownload, GML members, number to parse)
+PIPELINE_UNCHANGED = 'unchanged'    # CachedDownload of a zip already imported
+PIPELINE_PARCELS = 'parcels'        # (member, offset after the chunk, chunk of parcels)
+PIPELINE_PARSED = 'parsed'          # a GML member is finished: (member, error or None)
+PIPELINE_ERROR = 'error'            # the zip could not be downloaded
+PIPELINE_FINISHED = 'finished'      # a parser process has finished
+PIPELINE_DOWNLOADS_FINISHED = 'downloads finished'  # after every downloader message
+
+# Seconds to wait for a message before checking that the parsers are alive
+PIPELINE_POLL_SECONDS = 10
+
+
+def chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, chunk_size))
+
+
+def store_parcels_from_gml(xml_file, chunk_size):
+    for parcels in chunks(iterparse_inspire(xml_file), chunk_size):
+        if store_changed_parcels(parcels) is None:
+            raise CadastreException('Error storing parcels')
+
+
+def download_zip(zipfile_url, etag=None, last_modified=None, content_hash=None):
+    """
+    Downloads the zip to the cache dir, unless the cached copy is still valid
+    for the validators of the previous import. Returns a CachedDownload
+    """
+    return cached_download(zipfile_url,
+                           'CADASTRE',
+                           etag=etag,
+                           last_modified=last_modified,
+                           content_hash=content_hash,
+                           suffix='.zip')
+
+
+def gml_members(zip_path):
+    with zipfile.ZipFile(zip_path) as z:
+        return [x for x in z.namelist() if 'cadastralparcel' in x]
+
+
+def download_stage(urls, tasks, results, validators, checkpoints, force=False):
+    """
+    Downloads the zips and queues every GML member to be parsed from its
+    checkpoint. Zips with the same content as the last import are not parsed
+    again unless forced or their import was interrupted
+    """
+    while True:
+        try:
+            url = urls.get_nowait()
+        except Queue.Empty:
+            return
 
+        try:
+            download = download_zip(url, *validators[url])
 
-def partition_inspire_xml_file(xml_file, chunk_size):
-    parcel_start = '<gml:featureMember>'
-    parcel_end = '</gml:featureMember>'
-
-    header = ''
-    footer = '</gml:FeatureCollection>'
-    chunk = []
-
-    header_read = False
-
-    parcels = 0
+            # Checkpoints are only valid for the same content of the zip
+            resumed = dict((member, checkpoint)
+                           for member, checkpoint in checkpoints.get(url, {}).items()
+                           if checkpoint.content_hash == download.content_hash)
 
-    for line in xml_file:
-        # capture parcel start
-        if parcel_start in line:
-            header_read = True
+            if not download.modified and not resumed and not force:
+                results.put((PIPELINE_UNCHANGED, url, download))
+                continue
 
-        # Consider finding the footer
-        if footer in line:
-            xml_chunk = join(chunk, footer, header)
-            chunk = []
-            yield xml_chunk
+            members = gml_members(download.path)
+        except Exception as e:
+            logger.exception('Error downloading %s', url)
+            results.put((PIPELINE_ERROR, url, str(e)))
+            continue
+
+        pending = [(member, resumed[member].offset if member in resumed else 0)
+                   for member in members
+                   if member not in resumed or not resumed[member].finished]
+        if resumed:
+            logger.info('Resuming %s: %d of %d members pending',
+                        url, len(pending), len(members))
+
+        results.put((PIPELINE_DOWNLOADED, url, (download, members, len(pending))))
+        for member, offset in pending:
+            tasks.put((url, download.path, member, offset))
+
+
+def parse_stage(tasks, results, chunk_size):
+    """Process target: parses and projects GML members in chunks of parcels"""
+    while True:
+        task = tasks.get()
+        if task is None:
+            results.put((PIPELINE_FINISHED, None, None))
+            return
+
+        url, zip_path, member, offset = task
+        try:
+            with zipfile.ZipFile(zip_path) as z:
+                xml_file = z.open(member)
+                try:
+                    for chunk in chunks(iterparse_inspire_positions(xml_file, offset),
+                                        chunk_size):
+                        parcels = [parcel for position, parcel in chunk]
+                        results.put((PIPELINE_PARCELS, url,
+                                     (member, chunk[-1][0] + 1, parcels)))
+                finally:
+                    xml_file.close()
+
+            results.put((PIPELINE_PARSED, url, (member, None)))
+        except Exception as e:
+            results.put((PIPELINE_PARSED, url, (member, '{}: {}'.format(member, e))))
+
+
+def import_zip_urls(urls,
+                    download_workers=download_workers,
+                    parse_workers=parse_workers,
+                    queue_size=queue_size,
+                    chunk_size=1000,
+                    force=False):
+    """
+    Imports the parcels of the zip urls through a staged pipeline: a pool of
+    downloader threads, a pool of parser processes and the indexer in this
+    process, with bounded queues between them.
+
+    Zips are downloaded with conditional requests, so the ones not modified
+    since their last import are skipped unless force is True. The offset of
+    every GML member is checkpointed after its parcels are stored, so an
+    interrupted import is resumed from the last chunk stored.
+
+    Returns a dict with the error of every url that failed, or None
+    """
+    urls = list(urls)
+    parse_workers = parse_workers or multiprocessing.cpu_count()
+
+    # Read here: the downloader threads must not use the database
+    validators = dict((url, get_feed_validators(url)) for url in urls)
+    checkpoints = get_import_checkpoints(urls)
+
+    pending_urls = Queue.Queue()
+    for url in urls:
+        pending_urls.put(url)
+
+    tasks = multiprocessing.Queue(queue_size)
+    results = multiprocessing.Queue(queue_size)
+
+    # Parsers must not share the database connections of this process
+    connections.close_all()
+    parsers = [multiprocessing.Process(target=parse_stage,
+                                       args=(tasks, results, chunk_size))
+               for _ in range(parse_workers)]
+    for parser in parsers:
+        parser.daemon = True
+        parser.start()
+
+    downloaders = [threading.Thread(target=download_stage,
+                                    args=(pending_urls,
+                                          tasks,
+                                          results,
+                                          validators,
+                                          checkpoints,
+                                          force))
+                   for _ in range(min(download_workers, len(urls)) or 1)]
+    for downloader in downloaders:
+        downloader.daemon = True
+        downloader.start()
+
+    def finish_downloads():
+        for downloader in downloaders:
+            downloader.join()
+        # Sent through the same feeder, so the downloader messages arrive first
+        results.put((PIPELINE_DOWNLOADS_FINISHED, None, None))
+        for _ in parsers:
+            tasks.put(None)
+
+    finisher = threading.Thread(target=finish_downloads)
+    finisher.daemon = True
+    finisher.start()
+
+    errors = dict((url, None) for url in urls)
+    downloads = {}
+    expected = {}
+    parsed = defaultdict(int)
+    failed_members = set()
+
+    def url_finished(url):
+        if url in expected and parsed[url] == expected[url]:
+            logger.info('Imported parcels from %s', url)
+
+    def handle(kind, url, value):
+        if kind == PIPELINE_DOWNLOADED:
+            download, members, expected[url] = value
+            downloads[url] = download
+            # Checkpoints first: the validators make the zip look unchanged
+            start_import_checkpoints(url, download.content_hash, members)
+            save_feed_validators(url,
+                                 download.etag,
+                                 download.last_modified,
+                                 download.content_hash)
+            url_finished(url)
+        elif kind == PIPELINE_UNCHANGED:
+            logger.info('Parcels from %s not modified since last import', url)
+            downloads[url] = value
+        elif kind == PIPELINE_PARCELS:
+            member, offset, parcels = value
+            if store_changed_parcels(parcels) is None:
+                errors[url] = 'Error storing parcels'
+                failed_members.add((url, member))
+            elif (url, member) not in failed_members:
+                advance_import_checkpoint(url, member, offset)
+        elif kind == PIPELINE_PARSED:
+            member, error = value
+            if error is not None:
+                logger.error('Error parsing parcels from %s: %s', url, error)
+                errors[url] = error
+            elif (url, member) not in failed_members:
+                finish_import_checkpoint(url, member)
+            parsed[url] += 1
+            url_finished(url)
+        elif kind == PIPELINE_ERROR:
+            errors[url] = value
+
+    # Parsers send their messages through their own queue feeders, so they
+    # may arrive before the downloaded message that creates the checkpoints
+    early = defaultdict(list)
+
+    running = len(parsers)
+    crashed = set()
+    downloading = True
+    # Downloaders blocked by dead parsers never finish
+    while running or (downloading and not crashed):
+        try:
+            kind, url, value = results.get(timeout=PIPELINE_POLL_SECONDS)
+        except Queue.Empty:
+            # A parser killed (OOM, segfault...) never sends its message
+            for parser in parsers:
+                if parser not in crashed and not parser.is_alive() and parser.exitcode:
+                    logger.error('Parser process %s died with exit code %s',
+                                 parser.pid, parser.exitcode)
+                    crashed.add(parser)
+                    running -= 1
+            continue
+
+        if kind == PIPELINE_FINISHED:
+            running -= 1
+        elif kind == PIPELINE_DOWNLOADS_FINISHED:
+            downloading = False
+        elif kind in (PIPELINE_PARCELS, PIPELINE_PARSED) and url not in downloads:
+            early[url].append((kind, url, value))
         else:
-            # distinguish between header and chunk
-            if header_read:
-                chunk.append(line)
-            else:
-                header += line
+            handle(kind, url, value)
+            for message in early.pop(url, []):
+                handle(*message)
+
+    for parser in parsers:
+        parser.join()
 
-            # check wether parcel has ended
-            if parcel_end in line:
-                parcels += 1
-                if parcels >= chunk_size:
-                    xml_chunk = join(chunk, footer, header)
-                    chunk = []
-                    parcels = 0
-                    yield xml_chunk
+    # The members being parsed by a dead parser never finish
+    for url in urls:
+        if errors[url] is None and \
+                (url not in downloads or parsed[url] < expected.get(url, 0)):
+            errors[url] = 'Import interrupted: a parser process died'
 
+    # Zips are kept in the cache dir, to be validated or resumed next time
+    for url in downloads:
+        if errors[url] is None:
+            clear_import_checkpoints(url)
 
-def join(chunk, footer, header):
-    xml_list = [header] + chunk + [footer]
-    xml_chunk = ''.join(xml_list)
-    return xml_chunk
+    return errors
 
 
 @error_managed(default_answer=[])
-def store_parcels_from_url(zipfile_url, chunk_size=1000):
+def store_parcels_from_url(zipfile_url,
+                           chunk_size=1000,
+                           download_workers=download_workers,
+                           parse_workers=parse_workers):
     logger.info('Importing parcels from %s', zipfile_url)
-    r = requests.get(zipfile_url, stream=True)
-    if r.ok:
-        z = zipfile.ZipFile(StringIO.StringIO(r.content))
 
-        files_to_parse = [x for x in z.namelist() if 'cadastralparcel' in x]
+    errors = import_zip_urls([zipfile_url],
+                             download_workers=download_workers,
+                             parse_workers=parse_workers,
+                             chunk_size=chunk_size,
+                             force=True)
 
-        for gml_file in files_to_parse:
-            xml_file = z.open(gml_file)
-            for xml_chunk in partition_inspire_xml_file(xml_file, chunk_size):
-                parcels = parse_inspire_response(xml_chunk)
-                store_parcels(parcels)
-    else:
-        raise CadastreException('Error connecting to ' + zipfile_url +
-                                '. Status code: ' + r.status_code)
+    if errors[zipfile_url] is not None:
+        raise CadastreException('Error importing ' + zipfile_url,
+                                cause=errors[zipfile_url])
 
     logger.debug('        ... Finished!!')
 
 
-@error_managed()
-def update_catastral_municipality(municipality, force_update=False):
-    logger.info("Updating Municipality: %s", municipality.title)
+def needs_update(municipality, force_update=False):
     last_update_date = get_last_successful_update_date(municipality.link)
 
-    if force_update or last_update_date is None \
-            or last_update_date < get_update_date(municipality):
-        feed_id = start_feed_read(municipality.link,
-                                  get_update_date(municipality))
+    return force_update or last_update_date is None \
+        or last_update_date < get_update_date(municipality)
 
-        try:
-            store_parcels_from_url(municipality.link)
 
-            finish_feed_read(feed_id, True)
-        except Exception as e:
-            finish_feed_read(feed_id, False, e.message)
-            raise
+@error_managed()
+def update_catastral_municipalities(municipalities,
+                                    download_workers=download_workers,
+                                    parse_workers=parse_workers):
+    feed_ids = {}
+    for municipality in municipalities:
+        logger.info("Updating Municipality: %s", municipality.title)
+        feed_ids[municipality.link] = \
+            start_feed_read(municipality.link, get_update_date(municipality))
+
+    errors = import_zip_urls(feed_ids.keys(),
+                             download_workers=download_workers,
+                             parse_workers=parse_workers)
+
+    for url, feed_id in feed_ids.items():
+        finish_feed_read(feed_id, errors[url] is None, errors[url])
 
     logger.debug('        ... Finished!!')
 
+    return all(error is None for error in errors.values())
+
+
+def parse_feed(feed_url, force_update=False):
+    """
+    Parses the ATOM feed conditionally on the validators of its last
+    complete update. Returns None if the feed is not modified since then
+    """
+    etag, last_modified = None, None
+    if not force_update:
+        etag, last_modified, _ = get_feed_validators(feed_url)
+
+    feed = feedparser.parse(feed_url, etag=etag, modified=last_modified)
+
+    if getattr(feed, 'status', None) == 304:
+        logger.info('Feed %s not modified', feed_url)
+        return None
+
+    return feed
+
+
+def save_parsed_feed_validators(feed_url, feed):
+    save_feed_validators(feed_url,
+                         getattr(feed, 'etag', None),
+                         getattr(feed, 'modified', None))
+
 
 @error_managed()
-def update_cadastral_province(province, force_update=False):
+def update_cadastral_province(province,
+                              force_update=False,
+                              download_workers=download_workers,
+                              parse_workers=parse_workers):
     logger.info('Updating Province: %s', province.title)
-    feed = feedparser.parse(province.link)
+    feed = parse_feed(province.link, force_update)
+    if feed is None:
+        return True
+
+    municipalities = [municipality for municipality in feed.entries
+                      if needs_update(municipality, force_update)]
 
-    for municipality in feed.entries:
-        update_catastral_municipality(municipality, force_update)
+    success = True
+    if municipalities:
+        success = update_catastral_municipalities(municipalities,
+                                                  download_workers=download_workers,
+                                                  parse_workers=parse_workers)
+
+    # Only a complete update allows to skip the feed when it is not modified
+    if success:
+        save_parsed_feed_validators(province.link, feed)
 
     logger.debug('        ... Finished!!')
 
+    return success
+
 
 def get_update_date(feed):
     updated_parsed = feed.updated_parsed
@@ -138,11 +426,21 @@ def get_update_date(feed):
 
 
 @error_managed()
-def update_cadastral_information(force_update=False):
-    feed = feedparser.parse(url_atom_inspire)
-
-    for province in feed.entries:
-        update_cadastral_province(province, force_update)
+def update_cadastral_information(force_update=False,
+                                 download_workers=download_workers,
+                                 parse_workers=parse_workers):
+    feed = parse_feed(url_atom_inspire, force_update)
+    if feed is None:
+        return []
+
+    results = [update_cadastral_province(province,
+                                         force_update,
+                                         download_workers=download_workers,
+                                         parse_workers=parse_workers)
+               for province in feed.entries]
+
+    if all(results):
+        save_parsed_feed_validators(url_atom_inspire, feed)
 
     return feed.entries
 
@@ -5,17 +5,29 @@ Created on Sat Jul 02 18:27:40 2016
 @author: jlafuente
 """
 
+from collections import namedtuple
 import logging
+import Queue
 import requests
 import calendar
+from datetime import datetime, timedelta
+import threading
 
-import osc.util as util
-from osc.util import error_managed, es
-from osc.exceptions import ElasticException
+from django.utils import timezone
+
+from osc.exceptions import ConnectionError
+from osc.services import advance_station_watermark
+from osc.services import get_station_watermarks
+from osc.services import rollup_climate_measures
+from osc.util import elastic_bulk, error_managed, es
+from osc.util import make_session
+from osc.util import timer
+from osc.util import TokenBucket
 
 from django.conf import settings
 
 __all__ = ['insert_all_stations_inforiego_daily',
+           'update_all_stations_inforiego_daily',
            'insert_all_stations_inforiego_hourly',
            'get_stations_from_elastic']
 
@@ -27,6 +39,15 @@ password = settings.INFORIEGO['passwd']
 es_index = settings.INFORIEGO['index']
 es_daily_mapping = settings.INFORIEGO['daily.mapping']
 es_station_mapping = settings.INFORIEGO['station.mapping']
+concurrency = settings.INFORIEGO['concurrency']
+requests_per_second = settings.INFORIEGO['requests_per_second']
+queue_size = settings.INFORIEGO['queue_size']
+min_check_hours = settings.INFORIEGO['watermark.min_check_hours']
+
+# A station-year (or the recent data of a station, when year is None) to be
+# downloaded from inforiego
+StationYear = namedtuple('StationYear',
+                         ['station', 'year', 'fecha_ultima_modificacion'])
 
 
 def get_stations_from_elastic(index=es_index,
@@ -50,7 +71,8 @@ def get_inforiego_daily_year(provincia,
                              fecha_ultima_modificacion=None,
                              url=daily_url,
                              user=user,
-                             passwd=password):
+                             passwd=password,
+                             session=None):
     assert fecha_ultima_modificacion is not None or anno is not None
 
     if fecha_ultima_modificacion is None:
@@ -66,43 +88,74 @@ def get_inforiego_daily_year(provincia,
         params['fecha_ini'] = '01/01/' + str(anno)
         params['fecha_fin'] = '31/12/' + str(anno)
 
-    response = requests.get(url, params=params)
+    response = (session or requests).get(url, params=params)
 
     return response.json()
 
 
-@error_managed()
-def store_daily_document(document,
-                         lat_lon,
-                         altitud,
-                         index=es_index,
-                         mapping=es_daily_mapping):
-    document['lat_lon'] = lat_lon
-    document['altitud'] = altitud
-    try:
-        if document['HORMINHUMMAX'] is not None:
-            document['HORMINHUMMAX'] = document['HORMINHUMMAX'].zfill(4).replace('2400', '0000')
+HORMIN_FIELDS = ('HORMINHUMMAX',
+                 'HORMINHUMMIN',
+                 'HORMINTEMPMAX',
+                 'HORMINTEMPMIN',
+                 'HORMINVELMAX')
 
-        if document['HORMINHUMMIN'] is not None:
-            document['HORMINHUMMIN'] = document['HORMINHUMMIN'].zfill(4).replace('2400', '0000')
 
-        if document['HORMINTEMPMAX'] is not None:
-            document['HORMINTEMPMAX'] = document['HORMINTEMPMAX'].zfill(4).replace('2400', '0000')
+def normalize_hormin(value):
+    return value.zfill(4).replace('2400', '0000') if value is not None else None
 
-        if document['HORMINTEMPMIN'] is not None:
-            document['HORMINTEMPMIN'] = document['HORMINTEMPMIN'].zfill(4).replace('2400', '0000')
 
-        if document['HORMINVELMAX'] is not None:
-            document['HORMINVELMAX'] = document['HORMINVELMAX'].zfill(4).replace('2400', '0000')
+def daily_actions(documents,
+                  lat_lon,
+                  altitud,
+                  index=es_index,
+                  mapping=es_daily_mapping):
+    for document in documents:
+        document['lat_lon'] = lat_lon
+        document['altitud'] = altitud
+
+        for field in HORMIN_FIELDS:
+            if field in document:
+                document[field] = normalize_hormin(document[field])
 
         id = document[u'FECHA'].replace('/', '_') + '_' + \
-             document[u'IDPROVINCIA'] + '_' + \
-             document[u'IDESTACION']
+            document[u'IDPROVINCIA'] + '_' + \
+            document[u'IDESTACION']
+
+        yield {'_index': index,
+               '_type': mapping,
+               '_id': id,
+               '_source': document}
+
+
+@error_managed()
+def store_station_documents(process_name, estacion, actions):
+    with timer.elapsed_timer() as elapsed:
+        stats = elastic_bulk(process_name, actions)
+
+    logger.info('Station %s: %d documents stored in %.2f s (%.1f docs/s)',
+                estacion,
+                stats.success,
+                elapsed(),
+                stats.success / elapsed() if elapsed() else 0)
+
+    return stats
+
+
+def store_daily_documents(documents,
+                          lat_lon,
+                          altitud,
+                          index=es_index,
+                          mapping=es_daily_mapping):
+    if not documents:
+        return None
 
-        util.wait_for_yellow_cluster_status('STORE_INFORIEGO_DAILY')
-        es.index(index=index, doc_type=mapping, id=id, body=document)
-    except Exception as e:
-        raise ElasticException('INFORIEGO', 'Error saving to Elastic', actionable_info=str(document))
+    return store_station_documents('STORE_INFORIEGO_DAILY',
+                                   documents[0][u'IDESTACION'],
+                                   daily_actions(documents,
+                                                 lat_lon,
+                                                 altitud,
+                                                 index,
+                                                 mapping))
 
 
 def insert_inforiego_daily_years(provincia,
@@ -126,8 +179,7 @@ def insert_inforiego_daily_years(provincia,
                                             user=user,
                                             passwd=passwd)
 
-        for document in response:
-            store_daily_document(document, lat_lon, altitud, index, mapping)
+        store_daily_documents(response, lat_lon, altitud, index, mapping)
 
         logger.debug('        ... Finished!!')
 
@@ -150,8 +202,79 @@ def insert_inforiego_daily_recent(provincia,
                                         user=user,
                                         passwd=passwd)
 
-    for document in response:
-        store_daily_document(document, lat_lon, altitud, index, mapping)
+    store_daily_documents(response, lat_lon, altitud, index, mapping)
+
+
+def fetch_inforiego_daily(tasks,
+                          concurrency=concurrency,
+                          requests_per_second=requests_per_second,
+                          queue_size=queue_size):
+    """Download station-years from inforiego in parallel.
+
+    `concurrency` threads share a keep-alive session and a token bucket
+    that caps the requests per second sent to inforiego. Downloads are
+    yielded as `(task, documents, error)` in the order they finish,
+    through a queue of at most `queue_size` pending results, so the
+    downloaders wait whenever the indexer falls behind.
+    """
+    pending = Queue.Queue()
+    for task in tasks:
+        pending.put(task)
+
+    session = make_session(concurrency)
+    bucket = TokenBucket(requests_per_second, capacity=concurrency)
+    results = Queue.Queue(maxsize=queue_size)
+    finished = object()
+
+    def download():
+        while True:
+            try:
+                task = pending.get_nowait()
+            except Queue.Empty:
+                break
+
+            bucket.consume()
+            try:
+                documents = get_inforiego_daily_year(
+                    task.station['IDPROVINCIA'],
+                    task.station['IDESTACION'],
+                    anno=task.year,
+                    fecha_ultima_modificacion=task.fecha_ultima_modificacion,
+                    session=session)
+                results.put((task, documents, None))
+            except Exception as e:
+                results.put((task, None, e))
+
+        results.put(finished)
+
+    workers = [threading.Thread(target=download) for _ in range(concurrency)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    running = len(workers)
+    while running:
+        result = results.get()
+        if result is finished:
+            running -= 1
+        else:
+            yield result
+
+
+@error_managed(default_answer=False, inhibit_exception=True)
+def store_station_year(task, documents, error):
+    station = task.station
+    if error is not None:
+        raise ConnectionError('INFORIEGO',
+                              'Error downloading station {} ({}), year {}'
+                              .format(station['IDESTACION'],
+                                      station['IDPROVINCIA'],
+                                      task.year),
+                              cause=str(error))
+
+    store_daily_documents(documents, station['lat_lon'], station['ALTITUD'])
+
+    return True
 
 
 def insert_all_stations_inforiego_daily(years=None, fecha_ultima_modificacion=None):
@@ -159,20 +282,84 @@ def insert_all_stations_inforiego_daily(years=None, fecha_ultima_modificacion=No
 
     stations = get_stations_from_elastic()
 
-    for station in stations:
-        provincia = station['IDPROVINCIA']
-        estacion = station['IDESTACION']
-        lat_lon = station['lat_lon']
-        altitud = station['ALTITUD']
+    tasks = [StationYear(station, year, fecha_ultima_modificacion)
+             for station in stations
+             for year in (years if years is not None else [None])]
 
-        logger.info('Processing Inforiego Daily Station: %s', station)
-        if years is None:
-            insert_inforiego_daily_recent(provincia, estacion, lat_lon, altitud, fecha_ultima_modificacion)
+    logger.info('Processing Inforiego Daily: %d stations, %d downloads',
+                len(stations), len(tasks))
+
+    touched = set()
+    for task, documents, error in fetch_inforiego_daily(tasks):
+        logger.info('Processing Inforiego Daily Station: %s, year %s',
+                    task.station['IDESTACION'], task.year)
+        if store_station_year(task, documents, error):
+            touched |= station_years(documents)
+
+    if touched:
+        rollup_climate_measures(touched)
+
+    logger.debug('         ...finished!!')
+
+
+def station_years(documents):
+    return {(document[u'IDPROVINCIA'],
+             document[u'IDESTACION'],
+             int(document[u'FECHA'][-4:]))
+            for document in documents}
+
+
+def last_fecha(documents):
+    fechas = [datetime.strptime(document[u'FECHA'], '%d/%m/%Y').date()
+              for document in documents if document.get(u'FECHA')]
+
+    return max(fechas) if fechas else None
+
+
+def update_all_stations_inforiego_daily(default_update_date, min_check_hours=min_check_hours):
+    """
+    Downloads, for every station, only the data modified since its own
+    watermark (or since default_update_date for stations never imported).
+    Stations checked less than min_check_hours ago are skipped, and the
+    watermark of a station only advances when its data has been stored.
+    """
+    watermarks = get_station_watermarks()
+    started = timezone.now()
+    recently_checked = started - timedelta(hours=min_check_hours)
+
+    tasks = []
+    for station in get_stations_from_elastic():
+        watermark = watermarks.get((station['IDPROVINCIA'], station['IDESTACION']))
+
+        if watermark is None:
+            fecha_ultima_modificacion = default_update_date
+        elif watermark.date_checked > recently_checked:
+            logger.debug('Skipping Inforiego Daily Station %s: checked at %s',
+                         station['IDESTACION'], watermark.date_checked)
+            continue
         else:
-            insert_inforiego_daily_years(provincia, estacion, years, lat_lon, altitud, fecha_ultima_modificacion)
+            fecha_ultima_modificacion = \
+                (watermark.update_date - timedelta(days=1)).strftime('%d/%m/%Y')
+
+        tasks.append(StationYear(station, None, fecha_ultima_modificacion))
+
+    logger.info('Updating Inforiego Daily: %d stations to check', len(tasks))
+
+    updated = 0
+    touched = set()
+    for task, documents, error in fetch_inforiego_daily(tasks):
+        if store_station_year(task, documents, error):
+            advance_station_watermark(task.station['IDPROVINCIA'],
+                                      task.station['IDESTACION'],
+                                      started,
+                                      last_fecha(documents))
+            touched |= station_years(documents)
+            updated += 1
 
-        logger.debug('         ...finished!!')
+    if touched:
+        rollup_climate_measures(touched)
 
+    logger.info('Updated Inforiego Daily: %d of %d stations', updated, len(tasks))
 
 
 ###############################################################
@@ -213,27 +400,44 @@ def get_inforiego_hourly_month(provincia,
     return response.json()
 
 
-@error_managed()
-def store_hourly_document(document,
-                          lat_lon,
-                          altitud,
-                          index=es_index,
-                          mapping=es_daily_mapping):
-    document['lat_lon'] = lat_lon
-    document['altitud'] = altitud
-    try:
-        if document['HORAMIN'] is not None:
-            document['HORAMIN'] = document['HORAMIN'].zfill(4).replace('2400', '0000')
+def hourly_actions(documents,
+                   lat_lon,
+                   altitud,
+                   index=es_index,
+                   mapping=es_daily_mapping):
+    for document in documents:
+        document['lat_lon'] = lat_lon
+        document['altitud'] = altitud
+
+        if 'HORAMIN' in document:
+            document['HORAMIN'] = normalize_hormin(document['HORAMIN'])
 
         id = document[u'FECHA'].replace('/', '_') + '_' + \
-             document[u'HORAMIN'] + '_' + \
-             document[u'IDPROVINCIA'] + '_' + \
-             document[u'IDESTACION']
+            document[u'HORAMIN'] + '_' + \
+            document[u'IDPROVINCIA'] + '_' + \
+            document[u'IDESTACION']
+
+        yield {'_index': index,
+               '_type': mapping,
+               '_id': id,
+               '_source': document}
+
+
+def store_hourly_documents(documents,
+                           lat_lon,
+                           altitud,
+                           index=es_index,
+                           mapping=es_daily_mapping):
+    if not documents:
+        return None
 
-        util.wait_for_yellow_cluster_status('STORE_INFORIEGO_HOURLY')
-        es.index(index=index, doc_type=mapping, id=id, body=document)
-    except Exception as e:
-        raise ElasticException('INFORIEGO', 'Error saving to Elastic', actionable_info=str(document))
+    return store_station_documents('STORE_INFORIEGO_HOURLY',
+                                   documents[0][u'IDESTACION'],
+                                   hourly_actions(documents,
+                                                  lat_lon,
+                                                  altitud,
+                                                  index,
+                                                  mapping))
 
 
 def insert_inforiego_hourly_years(provincia,
@@ -258,8 +462,7 @@ def insert_inforiego_hourly_years(provincia,
                                                 user=user,
                                                 passwd=passwd)
 
-            for document in response:
-                store_daily_document(document, lat_lon, altitud, index, mapping)
+            store_hourly_documents(response, lat_lon, altitud, index, mapping)
 
             logger.debug('    ...Finished!!')
 
@@ -282,8 +485,7 @@ def insert_inforiego_hourly_recent(provincia,
                                         user=user,
                                         passwd=passwd)
 
-    for document in response:
-        store_daily_document(document, lat_lon, altitud, index, mapping)
+    store_hourly_documents(response, lat_lon, altitud, index, mapping)
 
 
 def insert_all_stations_inforiego_hourly(years=None, fecha_ultima_modificacion=None):
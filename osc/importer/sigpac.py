@@ -1,18 +1,29 @@
 # coding=utf-8
 
-from ftplib import FTP
+from collections import defaultdict, namedtuple
+import itertools
 import logging
+import numpy as np
+import os
+import posixpath
+import Queue
 import re
 import shapefile
-from StringIO import StringIO
-from urllib import urlopen
+import shutil
+import tempfile
+import threading
 from zipfile import ZipFile
 
 from django.conf import settings
 
 from osc.exceptions import ItacylException
-from osc.services.cadastre import update_parcel
+from osc.services.cadastre import update_parcels
+from osc.services.cadastre import utm_2_lonlat_array
+from osc.util import download_to_file
 from osc.util import error_managed
+from osc.util import ForwardReader
+from osc.util import FTPPool
+from osc.util import make_session
 
 logger = logging.getLogger(__name__)
 
@@ -20,18 +31,40 @@ ITACYL_PROTOCOL = settings.ITACYL['ITACYL_PROTOCOL']
 ITACYL_FTP = settings.ITACYL['ITACYL_FTP']
 SIGPAC_PATH = settings.ITACYL['SIGPAC_PATH']
 SIGPAC_FILE_DBF = settings.ITACYL['SIGPAC_FILE_DBF']
+SIGPAC_FILE_SHP = settings.ITACYL['SIGPAC_FILE_SHP']
+SIGPAC_ZONE = settings.ITACYL['SIGPAC_ZONE']
+workers = settings.ITACYL['import.workers']
+queue_size = settings.ITACYL['import.queue_size']
+ftp_pool_size = settings.ITACYL['ftp.pool_size']
+tmp_dir = settings.AUX_DIRS['tmp_dir']
 
-parcels = []
+# Fields of the RECFE records, in the order createParcelDocument reads them
+SIGPAC_FIELDS = ['DN_OID',
+                 'SUPERFICIE',
+                 'PERIMETRO',
+                 'PROVINCIA',
+                 'MUNICIPIO',
+                 'AGREGADO',
+                 'ZONA',
+                 'POLIGONO',
+                 'PARCELA',
+                 'RECINTO',
+                 'COEF_REGAD',
+                 'USO_SIGPAC']
+
+# A RECFE record with the GeoJSON geometry of its recinto, when available
+SigpacRecord = namedtuple('SigpacRecord', SIGPAC_FIELDS + ['geometry'])
+
+# Sessions are only opened when a listing is requested
+ftp_pool = FTPPool(ITACYL_FTP, ftp_pool_size)
 
 
 def getDemarcations(demarcation=''):
     logger.info('Obtaining %s demarcations', demarcation)
-    ftp = FTP(ITACYL_FTP)
-    ftp.login()
-    ftp.cwd('{}/{}'.format(SIGPAC_PATH, demarcation))
-    demarcations = []
-    ftp.retrlines('NLST', demarcations.append)
-    ftp.quit()
+    with ftp_pool.session() as ftp:
+        ftp.cwd(posixpath.join(ftp_pool.home, SIGPAC_PATH, demarcation))
+        demarcations = []
+        ftp.retrlines('NLST', demarcations.append)
     return demarcations
 
 
@@ -45,56 +78,240 @@ def getMunicipalities(province):
     return getDemarcations(province)
 
 
-def updateMunicipality(province, municipality):
-    logger.info('Updating municipality: %s (%s)', municipality, province)
-    url = '{}{}/{}/{}/{}'.format(ITACYL_PROTOCOL,
-                                 ITACYL_FTP,
-                                 SIGPAC_PATH,
-                                 province,
-                                 municipality)
-    conn = urlopen(url)
-    zipfile = ZipFile(StringIO(conn.read()))
-    conn.close()
+def municipalityUrl(province, municipality):
+    return '{}{}/{}/{}/{}'.format(ITACYL_PROTOCOL,
+                                  ITACYL_FTP,
+                                  SIGPAC_PATH,
+                                  province,
+                                  municipality)
+
+
+def downloadMunicipality(province, municipality, session=None):
+    """Downloads the zip of the municipality to a temporary file"""
+    return download_to_file(municipalityUrl(province, municipality),
+                            'ITACYL',
+                            suffix='.zip',
+                            session=session)
+
+
+def is_clockwise(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]) < 0
+
+
+def shapeGeometry(shape, zone_number=SIGPAC_ZONE):
+    """
+    GeoJSON geometry of a polygon shape. Shapefile outer rings are clockwise
+    and the counterclockwise rings are the holes of the previous outer ring
+    """
+    if shape.shapeType == shapefile.NULL or not shape.points:
+        return None
+
+    points = np.asarray(shape.points, dtype=float)[:, :2]
+    lon_lats = utm_2_lonlat_array(points, zone_number)
+
+    polygons = []
+    bounds = list(shape.parts) + [len(points)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if is_clockwise(points[start:end]) or not polygons:
+            polygons.append([])
+        polygons[-1].append(lon_lats[start:end])
+
+    if len(polygons) == 1:
+        return {'type': 'Polygon', 'coordinates': polygons[0]}
+
+    return {'type': 'MultiPolygon', 'coordinates': polygons}
 
+
+def openMember(zipfile, municipality, name):
+    """Opens a member of the zip, in the folder of the municipality if any"""
     path = re.match(r'(\d{2})_?(\d{3})(?:_|\.)', municipality)
     dirPath = '{}_{}/'.format(path.group(1), path.group(2))
 
-    if dirPath in zipfile.namelist():
-        dbf = zipfile.open(dirPath + SIGPAC_FILE_DBF, 'r')
-    else:
-        dbf = zipfile.open(SIGPAC_FILE_DBF, 'r')
+    names = zipfile.namelist()
+    if dirPath + name in names:
+        name = dirPath + name
+    elif name not in names:
+        return None
+
+    return zipfile.open(name, 'r')
+
+
+def iterShapes(zipfile, municipality):
+    """
+    Yields the recinto geometries of the RECFE shapefile in the zip, or
+    None forever when it has only the DBF
+    """
+    shp = openMember(zipfile, municipality, SIGPAC_FILE_SHP)
+    if shp is None:
+        while True:
+            yield None
+
+    # pyshp needs to seek the .shp, so it is read from a temporary file
+    with tempfile.TemporaryFile(dir=tmp_dir) as shp_file:
+        shutil.copyfileobj(shp, shp_file)
+        shp.close()
+
+        for shape in shapefile.Reader(shp=shp_file).iterShapes():
+            yield shapeGeometry(shape)
+
+
+def iterDbfRecords(sf):
+    """
+    Yields the values of every record of the DBF, None for the deleted ones.
+    pyshp iterRecords skips them, while the shapes of the deleted records
+    are still in the SHP, so the records would be paired with wrong shapes
+    """
+    # Private readers of pyshp 1.2.11, its public record(i) seeks backwards
+    sf.dbf.seek(sf._Reader__dbfHdrLength)
+    for _ in xrange(sf.numRecords):
+        yield sf._Reader__record()
+
+
+def iterRecords(zip_path, municipality):
+    """
+    Yields the RECFE records of a municipality zip as SigpacRecords, read
+    one by one from the compressed DBF along with their geometries
+    """
+    with ZipFile(zip_path) as zipfile:
+        dbf = openMember(zipfile, municipality, SIGPAC_FILE_DBF)
+        if dbf is None:
+            raise ItacylException('No {} in {}'.format(SIGPAC_FILE_DBF, municipality))
+        shapes = iterShapes(zipfile, municipality)
+
+        try:
+            sf = shapefile.Reader(dbf=ForwardReader(dbf))
+
+            # Fields are not in the same order in every municipality
+            names = [field[0] for field in sf.fields[1:]]
+            positions = [names.index(name) if name in names else None
+                         for name in SIGPAC_FIELDS]
 
-    sf = shapefile.Reader(dbf=StringIO(dbf.read()))
-    records = sf.records()
-    for record in records:
-        updateParcel(createParcelDocument(record))
+            for values, geometry in itertools.izip(iterDbfRecords(sf), shapes):
+                if values is None:
+                    continue
+                yield SigpacRecord._make([values[position] if position is not None else None
+                                          for position in positions] + [geometry])
+        finally:
+            shapes.close()
+            dbf.close()
 
 
-@error_managed(inhibit_exception=True)
-def updateParcel(parcel):
-    update_parcel(parcel)
+def fetchMunicipalities(tasks, workers=workers, queue_size=queue_size):
+    """Download (province, municipality) tasks in parallel.
 
+    `workers` threads share a keep-alive session to download the zips of
+    the municipalities to temporary files. Zips are yielded as
+    `(task, zip_path, error)` in the order they finish, through a queue of
+    at most `queue_size` municipalities, so the workers wait whenever the
+    indexer falls behind. The zips must be removed once read.
+    """
+    pending = Queue.Queue()
+    for task in tasks:
+        pending.put(task)
 
-def createParcelDocument(record):
+    session = make_session(workers)
+    results = Queue.Queue(maxsize=queue_size)
+    finished = object()
+
+    def download():
+        while True:
+            try:
+                task = pending.get_nowait()
+            except Queue.Empty:
+                break
+
+            try:
+                results.put((task, downloadMunicipality(*task, session=session), None))
+            except Exception as e:
+                results.put((task, None, e))
+
+        results.put(finished)
+
+    threads = [threading.Thread(target=download) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    running = len(threads)
+    while running:
+        result = results.get()
+        if result is finished:
+            running -= 1
+        else:
+            yield result
+
+
+@error_managed(default_answer=False, inhibit_exception=True)
+def storeMunicipality(task, zip_path, error):
+    province, municipality = task
+    if error is not None:
+        raise ItacylException('Error reading municipality {} ({})'
+                              .format(municipality, province),
+                              cause=str(error))
+
+    logger.info('Updating municipality: %s (%s)', municipality, province)
+    try:
+        updateParcels(createParcelDocuments(iterRecords(zip_path, municipality)))
+    finally:
+        os.remove(zip_path)
+
+    return True
+
+
+def createParcelDocuments(records):
+    """
+    Yields one partial parcel document per cadastral reference, with all the
+    recintos of the parcel. sigpacData keeps the data of the last one.
+    RECFE records are sorted by parcel, so every parcel is yielded as soon as
+    its last recinto is read
+    """
+    for _, recintos in itertools.groupby(records, getCadastralReference):
+        recintos = list(recintos)
+        yield createParcelDocument(recintos[-1], recintos)
+
+
+@error_managed()
+def updateParcels(parcels):
+    # Parcels not indexed yet cannot be updated, the rest are stored anyway
+    stats = update_parcels(parcels, raise_on_error=False)
+    if stats.failed:
+        logger.warning('%d of %d parcels not updated with SIGPAC data: %s',
+                       stats.failed, stats.success + stats.failed, stats.errors)
+
+
+def recintoDocument(record):
+    recinto = dict(zip(SIGPAC_FIELDS, record))
+    geometry = getattr(record, 'geometry', None)
+    if geometry is not None:
+        recinto['geometry'] = geometry
+    return recinto
+
+
+def sigpacUses(recintos):
+    """Area and number of recintos of every SIGPAC use, largest area first"""
+    areas = defaultdict(float)
+    counts = defaultdict(int)
+    for recinto in recintos:
+        areas[recinto['USO_SIGPAC']] += recinto['SUPERFICIE'] or 0
+        counts[recinto['USO_SIGPAC']] += 1
+
+    return [{'USO_SIGPAC': use,
+             'SUPERFICIE': areas[use],
+             'numRecintos': counts[use]}
+            for use in sorted(areas, key=lambda use: -areas[use])]
+
+
+def createParcelDocument(record, recintos=None):
     nationalCadastralReference = getCadastralReference(record)
     logger.debug('Updating cadastral parcel: %s - %s',
                  nationalCadastralReference, record[11])
     properties = {}
     properties['nationalCadastralReference'] = nationalCadastralReference
-    sigpacData = {}
-    sigpacData['DN_OID'] = record[0]
-    sigpacData['SUPERFICIE'] = record[1]
-    sigpacData['PERIMETRO'] = record[2]
-    sigpacData['PROVINCIA'] = record[3]
-    sigpacData['MUNICIPIO'] = record[4]
-    sigpacData['AGREGADO'] = record[5]
-    sigpacData['ZONA'] = record[6]
-    sigpacData['POLIGONO'] = record[7]
-    sigpacData['PARCELA'] = record[8]
-    sigpacData['RECINTO'] = record[9]
-    sigpacData['COEF_REGAD'] = record[10]
-    sigpacData['USO_SIGPAC'] = record[11]
-    properties['sigpacData'] = sigpacData
+    properties['sigpacData'] = dict(zip(SIGPAC_FIELDS, record))
+    if recintos is not None:
+        properties['sigpacRecintos'] = [recintoDocument(recinto) for recinto in recintos]
+        properties['sigpacUses'] = sigpacUses(properties['sigpacRecintos'])
     doc = {}
     doc['properties'] = properties
     parcel = {}
@@ -123,10 +340,17 @@ def getCadastralReference(record):
             record)
 
 
-def import_sigpac_data(provinces=[]):
+def import_sigpac_data(provinces=[], workers=workers):
     available_provinces = getProvinces()
+    tasks = []
     for province in available_provinces:
         if province in provinces or len(provinces) == 0:
             municipalities = getMunicipalities(province)
-            for municipality in municipalities:
-                updateMunicipality(province, municipality)
+            tasks += [(province, municipality) for municipality in municipalities]
+
+    updated = 0
+    for task, zip_path, error in fetchMunicipalities(tasks, workers):
+        if storeMunicipality(task, zip_path, error):
+            updated += 1
+
+    logger.info('Updated SIGPAC data: %d of %d municipalities', updated, len(tasks))
@@ -2,7 +2,7 @@
 
 import xml.etree.ElementTree as ET
 from django.conf import settings
-from osc.util import elastic_bulk_save, es
+from osc.util import elastic_bulk, error_managed, es
 
 from osc.services import obtain_elevation_from_google
 
@@ -69,15 +69,14 @@ def create_stations_mapping():
     idx_client.put_mapping(doc_type=stations_mapping, index=[stations_index], body=mapping)
 
 
+@error_managed(inhibit_exception=True)
 def store_stations(stations):
-    chunk_size = settings.ELASTICSEARCH['chunk_size']
+    actions = ({'_index': stations_index,
+                '_type': stations_mapping,
+                '_id': r['name'] + '_' + str(r['coordinates']['lat']) + '_' + str(r['coordinates']['lon']),
+                '_source': r} for r in stations)
 
-    for i in range(0, len(stations), chunk_size):
-        records = stations[i:i+chunk_size]
-
-        ids = [r['name'] + '_' + str(r['coordinates']['lat']) + '_' + str(r['coordinates']['lon']) for r in records]
-
-        elastic_bulk_save('STORE_STATIONS', stations_index, stations_mapping, records, ids=ids)
+    return elastic_bulk('STORE_STATIONS', actions)
 
 
 def import_stations(file_name):
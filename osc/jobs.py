@@ -15,17 +15,21 @@ class UpdateInforiegoDaily(CronJobBase):
     code = 'jobs.update_inforiego_daily'
 
     def do(self, last_update_date=None):
-        if last_update_date is None:
-            last_date_launched = CronJobLog.objects.filter(code=UpdateInforiegoDaily.code,
-                                                           is_success=True).aggregate(max=Max('end_time'))['max']
-            if last_date_launched is not None:
-                last_update_date = (last_date_launched - timedelta(days=1)).strftime('%d/%m/%Y')
-
-        if last_update_date is None:
+        if last_update_date is not None:
+            # An explicit date re-downloads every station since that date
+            inforiego.insert_all_stations_inforiego_daily(fecha_ultima_modificacion=last_update_date)
+            return
+
+        # Stations without watermark are downloaded since the last successful run
+        last_date_launched = CronJobLog.objects.filter(code=UpdateInforiegoDaily.code,
+                                                       is_success=True).aggregate(max=Max('end_time'))['max']
+        if last_date_launched is not None:
+            default_update_date = (last_date_launched - timedelta(days=1)).strftime('%d/%m/%Y')
+        else:
             default_date = datetime.now() - timedelta(weeks=2)
-            last_update_date = default_date.strftime('%d/%m/%Y')
+            default_update_date = default_date.strftime('%d/%m/%Y')
 
-        inforiego.insert_all_stations_inforiego_daily(fecha_ultima_modificacion=last_update_date)
+        inforiego.update_all_stations_inforiego_daily(default_update_date)
 
 
 class UpdateCadastreParcels(CronJobBase):
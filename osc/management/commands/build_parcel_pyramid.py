@@ -0,0 +1,30 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from osc.services.pyramid import build_parcel_pyramid
+from osc.services.pyramid import create_parcel_pyramid_mapping
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the parcel counts and areas of every geohash cell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max_precision',
+                            dest='max_precision',
+                            type=int,
+                            default=settings.CADASTRE['pyramid.max_precision'],
+                            help='precision of the smallest geohash cells')
+
+    def handle(self, *args, **options):
+        max_precision = options['max_precision']
+
+        logger.info('Building parcel pyramid up to precision %s', max_precision)
+
+        create_parcel_pyramid_mapping()
+        build_parcel_pyramid(max_precision=max_precision)
+
+        logger.info('Finished building parcel pyramid')
@@ -1,8 +1,11 @@
 import logging
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from osc.importer import cadastre
+from osc.services.pyramid import build_parcel_pyramid
+from osc.services.pyramid import create_parcel_pyramid_mapping
 
 logger = logging.getLogger(__name__)
 
@@ -20,16 +23,46 @@ class Command(BaseCommand):
                             dest='import_zip_url',
                             help='imports just a particular zip file pointed by the zip url')
 
+        parser.add_argument('--download_workers',
+                            dest='download_workers',
+                            type=int,
+                            default=settings.CADASTRE['import.download_workers'],
+                            help='number of threads downloading zip files')
+
+        parser.add_argument('--parse_workers',
+                            dest='parse_workers',
+                            type=int,
+                            default=settings.CADASTRE['import.parse_workers'],
+                            help='number of processes parsing the parcels, every core by default')
+
+        parser.add_argument('--skip_pyramid',
+                            action='store_true',
+                            dest='skip_pyramid',
+                            help='do not rebuild the parcel pyramid after the import')
+
     def handle(self, *args, **options):
         force_update = options['force_update']
         import_zip_url = options['import_zip_url']
+        download_workers = options['download_workers']
+        parse_workers = options['parse_workers']
 
-        logger.info('Importing parcels: force_update = %s, import_zip_url = %s',
+        logger.info('Importing parcels: force_update = %s, import_zip_url = %s, '
+                    'download_workers = %s, parse_workers = %s',
                     force_update,
-                    import_zip_url)
+                    import_zip_url,
+                    download_workers,
+                    parse_workers)
 
         if import_zip_url:
-            cadastre.store_parcels_from_url(import_zip_url)
+            cadastre.store_parcels_from_url(import_zip_url,
+                                            download_workers=download_workers,
+                                            parse_workers=parse_workers)
         else:
-            cadastre.update_cadastral_information(force_update=force_update)
+            cadastre.update_cadastral_information(force_update=force_update,
+                                                  download_workers=download_workers,
+                                                  parse_workers=parse_workers)
+
+        if not options['skip_pyramid']:
+            create_parcel_pyramid_mapping()
+            build_parcel_pyramid()
         logger.info('    ... Finished!!!')
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
 
 from osc.importer.sigpac import import_sigpac_data
+from osc.services.pyramid import build_parcel_pyramid
+from osc.services.pyramid import create_parcel_pyramid_mapping
 
 
 class Command(BaseCommand):
@@ -13,12 +16,28 @@ class Command(BaseCommand):
             help='Province for updating (as many as you need)'
         )
 
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.ITACYL['import.workers'],
+            help='number of threads downloading municipalities'
+        )
+
+        parser.add_argument(
+            '--skip_pyramid',
+            action='store_true',
+            help='do not rebuild the parcel pyramid after the import'
+        )
+
     def handle(self, *args, **options):
         try:
             provinces = []
             if options['provinces']:
                 provinces = options['provinces'].split(',')
-            import_sigpac_data(provinces)
+            import_sigpac_data(provinces, workers=options['workers'])
+            if not options['skip_pyramid']:
+                create_parcel_pyramid_mapping()
+                build_parcel_pyramid()
         except Exception as e:
             raise CommandError('Error importing SIGPAC data: {}'.format(e))
 
@@ -0,0 +1,29 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from osc.importer import get_stations_from_elastic
+from osc.services.climate import create_climate_rollup_mapping
+from osc.services.climate import rollup_climate_measures
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the climate rollup of every station for the specified years'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', nargs='+', type=int, required=True)
+
+    def handle(self, *args, **options):
+        years = options['years']
+
+        logger.info('Rolling up climate measures for years %s', years)
+
+        create_climate_rollup_mapping()
+
+        rollup_climate_measures([(station['IDPROVINCIA'], station['IDESTACION'], year)
+                                 for station in get_stations_from_elastic()
+                                 for year in years])
+
+        logger.info('Finished rolling up climate measures')
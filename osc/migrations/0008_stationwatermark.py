@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2017-07-09 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osc', '0007_error_cause'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StationWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('province_id', models.CharField(max_length=10)),
+                ('station_id', models.CharField(max_length=10)),
+                ('last_date', models.DateField(null=True)),
+                ('update_date', models.DateTimeField()),
+                ('date_checked', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='stationwatermark',
+            unique_together=set([('province_id', 'station_id')]),
+        ),
+    ]
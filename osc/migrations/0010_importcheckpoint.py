@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.3 on 2017-07-23 18:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osc', '0009_feed_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('member', models.CharField(max_length=255)),
+                ('offset', models.IntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('update_date', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='importcheckpoint',
+            unique_together=set([('url', 'member')]),
+        ),
+    ]
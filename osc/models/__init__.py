@@ -1,5 +1,7 @@
 from osc.models.models import Error
 from osc.models.models import Feed
+from osc.models.models import ImportCheckpoint
+from osc.models.models import StationWatermark
 from osc.models.models import UserParcel
 from osc.models.models import UserProfile
 from osc.models.parcel import Parcel
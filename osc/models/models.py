@@ -39,6 +39,32 @@ class Feed(models.Model):
     update_date = models.DateTimeField()
     success = models.BooleanField()
     info = models.TextField(null=True)
+    etag = models.CharField(max_length=255, null=True)
+    last_modified = models.CharField(max_length=255, null=True)
+    content_hash = models.CharField(max_length=64, null=True)
+
+
+class StationWatermark(models.Model):
+    province_id = models.CharField(max_length=10)
+    station_id = models.CharField(max_length=10)
+    last_date = models.DateField(null=True)
+    update_date = models.DateTimeField()
+    date_checked = models.DateTimeField()
+
+    class Meta(object):
+        unique_together = ('province_id', 'station_id')
+
+
+class ImportCheckpoint(models.Model):
+    url = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+    member = models.CharField(max_length=255)
+    offset = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    update_date = models.DateTimeField()
+
+    class Meta(object):
+        unique_together = ('url', 'member')
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -1,5 +1,6 @@
 # coding=utf-8
 
+import copy
 import logging
 
 
@@ -10,7 +11,14 @@ import geojson
 
 from rest_framework.reverse import reverse
 
+from osc.util import decode_page_token
+from osc.util import encode_page_token
 from osc.util import es
+from osc.util import get_cached_parcel_buckets
+from osc.util import get_cached_parcel_documents
+from osc.util import PARCEL_LIST_PROFILE
+from osc.util import parcel_projection
+from osc.util import projected_source
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +28,9 @@ MAX_ELASTIC_QUERY_SIZE = settings.CADASTRE['max.query.size']
 CLUSTER_AGG = settings.ELASTICSEARCH['cluster_agg']
 PARCEL_SEARCH = settings.ELASTICSEARCH['parcel_search']
 PARCEL_SEARCH_BY_BBOX = settings.ELASTICSEARCH['parcel_search_by_bbox']
+# Precisions of the geohash_grid aggregation of elastic
+MIN_GEOHASH_PRECISION = 1
+MAX_GEOHASH_PRECISION = 12
 
 
 class Parcel(geojson.Feature):
@@ -43,7 +54,9 @@ class Parcel(geojson.Feature):
 
         __properties = self.__properties(__parcel_document['properties'], request=__request)
 
-        geojson.Feature.__init__(self, geometry=geojson.Polygon(__parcel_document['geometry']['coordinates']), properties=__properties)
+        # Projections without geometry, as the summary one, have a null geometry
+        __geometry = geojson.Polygon(__parcel_document['geometry']['coordinates']) if 'geometry' in __parcel_document else None
+        geojson.Feature.__init__(self, geometry=__geometry, properties=__properties)
 
     def __address(self, properties):
         try:
@@ -70,10 +83,16 @@ class Parcel(geojson.Feature):
     def __sigpacUse(self, properties):
         return properties['sigpacData']['USO_SIGPAC'] if 'sigpacData' in properties else None
 
+    def __sigpacUses(self, properties):
+        return [{'use': use['USO_SIGPAC'],
+                 'area': use['SUPERFICIE'],
+                 'recintos': use['numRecintos']}
+                for use in properties['sigpacUses']]
+
     def __properties(self, properties, request=None):
         __properties = {}
         __properties['elevation'] = properties['elevation'] if 'elevation' in properties else None
-        __properties['areaValue'] = properties['areaValue']
+        __properties['areaValue'] = properties['areaValue'] if 'areaValue' in properties else None
         __properties['nationalCadastralReference'] = \
             properties['nationalCadastralReference']
         if request is not None:
@@ -92,6 +111,8 @@ class Parcel(geojson.Feature):
     def __sigpacData(self, properties):
         __sigpacData = {}
         __sigpacData['use'] = self.__sigpacUse(properties)
+        if 'sigpacUses' in properties:
+            __sigpacData['uses'] = self.__sigpacUses(properties)
         return __sigpacData
 
 
@@ -118,60 +139,116 @@ class ParcelBucket(geojson.Feature):
         return [__bbox['w'],__bbox['s'],__bbox['e'],__bbox['n']]
 
 
-def getParcelByNationalCadastralReference(nationalCadastralReference):
-    query = {
-        "query": {
-            "match": {
-                "properties.nationalCadastralReference": nationalCadastralReference
-            }
+def getParcelByNationalCadastralReference(nationalCadastralReference, profile='full'):
+    query = parcel_projection(profile)
+    query["query"] = {
+        "match": {
+            "properties.nationalCadastralReference": nationalCadastralReference
         }
     }
 
-    parcelDocument = es.search(
+    parcelDocument = projected_source(es.search(
         index=PARCEL_INDEX,
         doc_type=PARCEL_MAPPING,
-        body=query)['hits']['hits'][0]['_source']
+        body=query)['hits']['hits'][0])
 
     return Parcel(parcelDocument=parcelDocument)
 
 
-def getParcels(request=None, bbox=None, precision=None):
-    logger.debug('getParcels(%s, %s, %s)', request, bbox, precision)
+def getParcels(request=None, bbox=None, precision=None, page_size=None, page_token=None, profile=PARCEL_LIST_PROFILE):
+    logger.debug('getParcels(%s, %s, %s, %s, %s, %s)', request, bbox, precision, page_size, page_token, profile)
+
+    if bbox is not None and precision is not None:
+        precision = min(max(int(precision), MIN_GEOHASH_PRECISION), MAX_GEOHASH_PRECISION)
+        __west, __south, __east, __north = map(float, bbox.split(','))
+        __parcelsBucketsDocuments = get_cached_parcel_buckets(__west, __south, __east, __north, precision)
+        if __parcelsBucketsDocuments is None:
+            __parcelsBucketsDocuments = searchParcelsBucketsDocuments(bbox, precision)
+        return parcelsCollection([], __parcelsBucketsDocuments, request)
 
-    __max_elastic_query_size = 20 if bbox is None else MAX_ELASTIC_QUERY_SIZE
-    __query = PARCEL_SEARCH
+    # Unknown profiles fail even when the parcels are cached
+    parcel_projection(profile)
+    __search_after = decode_page_token(page_token) if page_token is not None else None
+    if page_size is None:
+        page_size = 20 if bbox is None else MAX_ELASTIC_QUERY_SIZE
+    page_size = min(max(page_size, 1), MAX_ELASTIC_QUERY_SIZE)
 
+    # One parcel more tells whether there is a next page
+    __parcelsDocuments = None
     if bbox is not None:
-        __query = dict(PARCEL_SEARCH_BY_BBOX)
-        west, south, east, north = bbox.split(',')
-        __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['top'] = north
-        __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['left'] = west
-        __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['bottom'] = south
-        __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['right'] = east
-        if precision is not None:
-            __agg = dict(CLUSTER_AGG)
-            __agg['2']['geohash_grid']['precision']=precision
-            __query['aggs']=__agg
-            __query['size']=0
-            __max_elastic_query_size=0
+        __west, __south, __east, __north = map(float, bbox.split(','))
+        __parcelsDocuments = get_cached_parcel_documents(__west, __south, __east, __north,
+                                                         size=page_size + 1,
+                                                         search_after=__search_after,
+                                                         profile=profile)
+    if __parcelsDocuments is None:
+        __parcelsDocuments = searchParcelsDocuments(bbox, page_size + 1, __search_after, profile)
+
+    __parcels = parcelsCollection(__parcelsDocuments[:page_size], [], request)
+    __parcels['next_page_token'] = encode_page_token(
+        [__parcelsDocuments[page_size - 1]['properties']['nationalCadastralReference']]) \
+        if len(__parcelsDocuments) > page_size else None
+    return __parcels
+
+
+def parcelsQuery(bbox):
+    if bbox is None:
+        return copy.deepcopy(PARCEL_SEARCH)
+
+    __query = copy.deepcopy(PARCEL_SEARCH_BY_BBOX)
+    west, south, east, north = bbox.split(',')
+    __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['top'] = north
+    __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['left'] = west
+    __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['bottom'] = south
+    __query['query']['bool']['filter']['geo_bounding_box']['properties.reference_point']['right'] = east
+    return __query
+
+
+def searchParcelsDocuments(bbox, size, search_after=None, profile='full'):
+    """
+    Up to size parcels documents sorted by cadastral reference after
+    search_after, with the fields of the projection profile
+    """
+    __query = parcelsQuery(bbox)
+    __query.update(parcel_projection(profile))
+    __query['sort'] = [{'properties.nationalCadastralReference': 'asc'}]
+    if search_after is not None:
+        __query['search_after'] = search_after
+
+    __result = es.search(
+        index=PARCEL_INDEX,
+        doc_type=PARCEL_MAPPING,
+        body=__query,
+        size=size)
+
+    return [projected_source(__hit) for __hit in __result['hits']['hits']]
+
+
+def searchParcelsBucketsDocuments(bbox, precision):
+    __query = parcelsQuery(bbox)
+    __agg = copy.deepcopy(CLUSTER_AGG)
+    __agg['2']['geohash_grid']['precision'] = precision
+    __query['aggs'] = __agg
+    __query['size'] = 0
 
     __result = es.search(
         index=PARCEL_INDEX,
         doc_type=PARCEL_MAPPING,
         body=__query,
-        size=__max_elastic_query_size)
+        size=0)
+
+    return __result['aggregations']['2']['buckets']
 
-    __parcelsDocuments = __result['hits']['hits']
-    __parcelsBucketsDocuments = __result['aggregations']['2']['buckets'] if 'aggregations' in __result else []
 
+def parcelsCollection(parcelsDocuments, parcelsBucketsDocuments, request=None):
     __parcels = []
 
-    for __parcelDocument in __parcelsDocuments:
-        __parcels.append(Parcel(parcelDocument=__parcelDocument['_source'], request=request))
+    for __parcelDocument in parcelsDocuments:
+        __parcels.append(Parcel(parcelDocument=__parcelDocument, request=request))
 
     __parcels_buckets = []
     max = min = 0
-    for __parcelBucketDocument in __parcelsBucketsDocuments:
+    for __parcelBucketDocument in parcelsBucketsDocuments:
         __parcels_buckets.append(ParcelBucket(parcelBucketDocument=__parcelBucketDocument, request=request))
         if __parcelBucketDocument['doc_count'] > max:
             max = __parcelBucketDocument['doc_count']
@@ -3,3 +3,6 @@ from .climate import *
 from .cadastre import *
 from .feed import *
 from .crop import *
+from .watermark import *
+from .checkpoint import *
+from .pyramid import *
@@ -1,8 +1,13 @@
+from collections import OrderedDict
 from bs4 import BeautifulSoup
 import geohash
+import hashlib
 import json
 import logging
+import numpy as np
+from multiprocessing.pool import ThreadPool
 import requests
+import xml.etree.cElementTree as cET
 import xml.etree.ElementTree as ET
 
 from django.conf import settings
@@ -11,11 +16,22 @@ from osc.exceptions import CadastreException
 from osc.exceptions import ElasticException
 
 from osc.services.google import obtain_elevation_from_google
-from osc.util import elastic_bulk_save
-from osc.util import elastic_bulk_update
+from osc.util import elastic_bulk
+from osc.util import elastic_search_after
+from osc.util import clip_ring
 from osc.util import elastic_update
+from osc.util import encode_page_token
+from osc.util import encode_tile
 from osc.util import error_managed
 from osc.util import es
+from osc.util import get_cached_parcel_buckets
+from osc.util import invalidate_parcel_cells
+from osc.util import lon_lat_to_tile
+from osc.util import parcel_projection
+from osc.util import projected_source
+from osc.util import ring_area
+from osc.util import simplify_ring
+from osc.util import tile_bounds
 from osc.util import xml_to_json
 
 from elasticsearch.client import IndicesClient
@@ -26,7 +42,10 @@ from pyproj import Proj
 __all__ = ['get_parcels_by_bbox',
            'get_public_cadastre_info',
            'store_parcels',
-           'get_parcels_by_cadastral_code']
+           'store_changed_parcels',
+           'get_parcels_by_cadastral_code',
+           'get_parcels_by_cadastral_codes',
+           'get_parcels_tile']
 
 logger = logging.getLogger(__name__)
 
@@ -44,9 +63,17 @@ parcel_mapping = settings.CADASTRE['mapping']
 
 zone_for_queries = settings.CADASTRE['zone.for.queries']
 max_elastic_query_size = settings.CADASTRE['max.query.size']
+public_info_concurrency = settings.CADASTRE['public_info.concurrency']
 
 query_cadastre_when_bbox = settings.CADASTRE['query.cadastre.when.bbox']
 
+tiles_min_zoom = settings.CADASTRE['tiles.min_zoom']
+tiles_extent = settings.CADASTRE['tiles.extent']
+tiles_buffer = settings.CADASTRE['tiles.buffer']
+tiles_simplify_tolerance = settings.CADASTRE['tiles.simplify_tolerance']
+
+TILES_LAYER = 'parcels'
+
 ns = {'gml': 'http://www.opengis.net/gml/3.2',
       'gmd': 'http://www.isotc211.org/2005/gmd',
       'ogc': 'http://www.opengis.net/ogc',
@@ -56,6 +83,17 @@ ns = {'gml': 'http://www.opengis.net/gml/3.2',
       'ct': 'http://www.catastro.meh.es/'
       }
 
+cadastral_parcel_tag = '{%s}CadastralParcel' % ns['cp']
+
+# Properties read from INSPIRE. The rest are added to the indexed parcels
+# later (public cadastral info, elevation, SIGPAC...)
+inspire_properties = ['areaValue',
+                      'beginLifespanVersion',
+                      'endLifespanVersion',
+                      'label',
+                      'nationalCadastralReference',
+                      'reference_point']
+
 
 class Parcel(object):
     def __init__(self):
@@ -152,17 +190,45 @@ def create_parcel_mapping():
                                body=mapping)
 
 
+# Projections are expensive to build, so one is kept per zone
+projections = {}
+
+
+def get_projection(zone_number):
+    projection = projections.get(zone_number)
+    if projection is None:
+        projection = projections.setdefault(zone_number, Proj(init=zone_number))
+
+    return projection
+
+
 def latlon_2_utm(lat, lon, zone_number):
-    p = Proj(init=zone_number)
+    p = get_projection(zone_number)
     return p(lon, lat)
 
 
 def utm_2_latlon(x, y, zone_number):
-    p = Proj(init=zone_number)
+    p = get_projection(zone_number)
     lon, lat = p(x, y, inverse=True)
     return lat, lon
 
 
+def parse_pos_list(text):
+    """Parses a GML posList (x1 y1 x2 y2 ...) into an array of (x, y) rows"""
+    return np.array(text.split(), dtype=float).reshape(-1, 2)
+
+
+def utm_2_lonlat_array(coords, zone_number):
+    """Converts an array of (x, y) rows into [[lon, lat], ...]"""
+    if not len(coords):
+        return []
+
+    lon, lat = get_projection(zone_number)(coords[:, 0],
+                                           coords[:, 1],
+                                           inverse=True)
+    return np.column_stack((lon, lat)).tolist()
+
+
 def get_gml_linear_ring(linear_ring_elem, zone_number):
     linear_ring = []
 
@@ -172,13 +238,8 @@ def get_gml_linear_ring(linear_ring_elem, zone_number):
         linear_ring_text = pos_list.text
 
         if linear_ring_text is not None:
-            linear_ring_coords = linear_ring_text.split()
-            for c in range(0, len(linear_ring_coords), 2):
-                lat, lon = utm_2_latlon(*map(lambda x: float(x),
-                                        linear_ring_coords[c:(c+2)]),
-                                        zone_number=zone_number)
-
-                linear_ring.append([lon, lat])
+            linear_ring = utm_2_lonlat_array(parse_pos_list(linear_ring_text),
+                                             zone_number=zone_number)
 
     return linear_ring
 
@@ -239,19 +300,13 @@ def get_gml_bbox(cadastral_parcel):
     lower_corner_txt = envelope.find('gml:lowerCorner', ns).text
     upper_corner_txt = envelope.find('gml:upperCorner', ns).text
 
-    lower_corner = []
-    if lower_corner_txt is not None:
-        lat, lon = utm_2_latlon(*map(lambda x: float(x),
-                                lower_corner_txt.split()),
-                                zone_number=zone_number)
-        lower_corner = [lon, lat]
+    corners_txt = [corner_txt for corner_txt in (lower_corner_txt, upper_corner_txt)
+                   if corner_txt is not None]
+    corners = utm_2_lonlat_array(parse_pos_list(' '.join(corners_txt)),
+                                 zone_number=zone_number)
 
-    upper_corner = []
-    if upper_corner_txt is not None:
-        lat, lon = utm_2_latlon(
-            *map(lambda x: float(x), upper_corner_txt.split()),
-            zone_number=zone_number)
-        upper_corner = [lon, lat]
+    lower_corner = corners.pop(0) if lower_corner_txt is not None else []
+    upper_corner = corners.pop(0) if upper_corner_txt is not None else []
 
     return {'type': 'envelope',
             'coordinates': [lower_corner, upper_corner]}
@@ -294,6 +349,41 @@ def parse_cadastral_parcel(cadastral_parcel_elem):
     return parcel
 
 
+def iterparse_inspire_positions(xml_file, skip=0):
+    """
+    Yields (position, parcel) of the parcels of an INSPIRE GML file object in
+    a single pass, clearing every parcel once parsed so memory does not grow
+    with the file. The position counts the parcels that cannot be parsed too,
+    and the first skip parcels are not parsed at all
+    """
+    context = cET.iterparse(xml_file, events=('start', 'end'))
+    event, root = next(context)
+
+    if 'ExceptionReport' in root.tag:
+        for event, elem in context:
+            pass
+        raise CadastreException(parse_inspire_exception(root))
+
+    position = 0
+    for event, elem in context:
+        if event == 'end' and elem.tag == cadastral_parcel_tag:
+            parcel = parse_cadastral_parcel(elem) if position >= skip else None
+
+            if parcel is not None:
+                yield position, parcel
+
+            position += 1
+
+            # Drop the feature members already parsed
+            root.clear()
+
+
+def iterparse_inspire(xml_file, skip=0):
+    """Yields the parcels of an INSPIRE GML file object in a single pass"""
+    for position, parcel in iterparse_inspire_positions(xml_file, skip):
+        yield parcel
+
+
 @error_managed(default_answer=[])
 def parse_inspire_response(xml_text):
     logger.debug('parse_inspire_response(%s)', xml_text)
@@ -420,32 +510,138 @@ def get_public_cadastre_info(code):
                                                  'RC': code})
 
 
+@error_managed(inhibit_exception=True)
 def store_parcels(parcels):
-    chunk_size = settings.ELASTICSEARCH['chunk_size']
+    reference_points = []
+    actions = ({'_index': parcel_index,
+                '_type': parcel_mapping,
+                '_id': Parcel.get_cadastral_reference(parcel),
+                '_source': parcel}
+               for parcel in collect_reference_points(parcels, reference_points))
+
+    stats = elastic_bulk('STORE_PARCELS', actions)
+    invalidate_cached_cells(reference_points)
+    return stats
+
+
+def collect_reference_points(parcels, reference_points):
+    """
+    Yields the parcels, appending their reference points to
+    reference_points, so they are not kept in memory to invalidate the cache
+    """
+    for parcel in parcels:
+        reference_point = parcel['properties'].get('reference_point')
+        if reference_point:
+            reference_points.append(reference_point)
+        yield parcel
+
+
+@error_managed(inhibit_exception=True)
+def invalidate_cached_cells(reference_points):
+    """Removes from the bbox cache the cells of the reference points"""
+    invalidate_parcel_cells(reference_points)
+
+
+@error_managed(inhibit_exception=True)
+def invalidate_cached_parcels(parcels):
+    """
+    Removes from the bbox cache the cells of the parcels, reading the
+    reference points of the partial documents from elastic. Full documents
+    without reference point are in no cell
+    """
+    reference_points = []
+    codes = []
+    for parcel in parcels:
+        if 'doc' in parcel:
+            codes.append(Parcel.get_cadastral_reference(parcel))
+        elif parcel['properties'].get('reference_point'):
+            reference_points.append(parcel['properties']['reference_point'])
+
+    if codes:
+        try:
+            result = es.mget(index=parcel_index,
+                             doc_type=parcel_mapping,
+                             body={'ids': codes},
+                             _source_include='properties.reference_point')
+        except ElasticsearchException as e:
+            raise ElasticException('PARCEL', e.message, e)
+
+        reference_points += [doc['_source']['properties']['reference_point']
+                             for doc in result['docs']
+                             if doc.get('found') and
+                             doc['_source'].get('properties', {}).get('reference_point')]
+
+    invalidate_parcel_cells(reference_points)
+
+
+def parcel_content_hash(parcel):
+    """SHA-1 of the geometry, bbox and INSPIRE properties of a parcel"""
+    content = {'bbox': parcel.get('bbox'),
+               'geometry': parcel.get('geometry'),
+               'properties': dict((name, parcel['properties'].get(name))
+                                  for name in inspire_properties)}
+
+    return hashlib.sha1(json.dumps(content,
+                                   sort_keys=True,
+                                   separators=(',', ':'))).hexdigest()
+
+
+def get_parcel_content_hashes(cadastral_codes):
+    """Returns {cadastral code: content hash} of the indexed parcels"""
+    try:
+        result = es.mget(index=parcel_index,
+                         doc_type=parcel_mapping,
+                         body={'ids': cadastral_codes},
+                         _source_include='properties.contentHash')
+    except ElasticsearchException as e:
+        raise ElasticException('STORE_PARCELS', e.message, e)
+
+    return dict((doc['_id'], doc['_source'].get('properties', {}).get('contentHash'))
+                for doc in result['docs'] if doc.get('found'))
 
-    for i in range(0, len(parcels), chunk_size):
-        records = parcels[i:i+chunk_size]
-        ids = [Parcel.get_cadastral_reference(r) for r in records]
 
-        elastic_bulk_save('STORE_PARCELS',
-                          parcel_index,
-                          parcel_mapping,
-                          records,
-                          ids)
+@error_managed(inhibit_exception=True)
+def store_changed_parcels(parcels):
+    """
+    Stores the parcels that are not indexed yet or whose content hash
+    changed, as partial updates so the information added to the indexed
+    parcels is kept. Returns the BulkStats of the parcels written, or None
+    when any of them could not be stored
+    """
+    parcels = list(parcels)
+    for parcel in parcels:
+        parcel['properties']['contentHash'] = parcel_content_hash(parcel)
 
+    codes = [Parcel.get_cadastral_reference(parcel) for parcel in parcels]
+    stored_hashes = get_parcel_content_hashes(codes) if codes else {}
 
-def update_parcels(parcels):
-    chunk_size = settings.ELASTICSEARCH['chunk_size']
+    changed = [parcel for code, parcel in zip(codes, parcels)
+               if stored_hashes.get(code) != parcel['properties']['contentHash']]
+    logger.debug('%d of %d parcels changed', len(changed), len(parcels))
 
-    for i in range(0, len(parcels), chunk_size):
-        records = parcels[i:i+chunk_size]
-        ids = [Parcel.get_cadastral_reference(r) for r in records]
+    actions = ({'_op_type': 'update',
+                '_index': parcel_index,
+                '_type': parcel_mapping,
+                '_id': Parcel.get_cadastral_reference(parcel),
+                '_source': {'doc': parcel,
+                            'doc_as_upsert': True}} for parcel in changed)
 
-        elastic_bulk_update('STORE_PARCELS',
-                            parcel_index,
-                            parcel_mapping,
-                            records,
-                            ids)
+    stats = elastic_bulk('STORE_PARCELS', actions)
+    invalidate_cached_parcels(changed)
+    return stats
+
+
+def update_parcels(parcels, raise_on_error=True):
+    parcels = list(parcels)
+    actions = ({'_op_type': 'update',
+                '_index': parcel_index,
+                '_type': parcel_mapping,
+                '_id': Parcel.get_cadastral_reference(parcel),
+                '_source': parcel} for parcel in parcels)
+
+    stats = elastic_bulk('STORE_PARCELS', actions, raise_on_error=raise_on_error)
+    invalidate_cached_parcels(parcels)
+    return stats
 
 
 def update_parcel(parcel):
@@ -455,45 +651,60 @@ def update_parcel(parcel):
                    parcel_mapping,
                    parcel,
                    Parcel.get_cadastral_reference(parcel))
+    invalidate_cached_parcels([parcel])
 
 
 @error_managed(default_answer=[])
 def get_parcels_by_cadastral_code(cadastral_code,
                                   include_public_info=False,
                                   include_google_info=False):
-    logger.debug('get_parcels_by_cadastral_code(%s,%s)',
-                 cadastral_code,
+    return get_parcels_by_cadastral_codes([cadastral_code],
+                                          include_public_info,
+                                          include_google_info)
+
+
+@error_managed(default_answer=[])
+def get_parcels_by_cadastral_codes(cadastral_codes,
+                                   include_public_info=False,
+                                   include_google_info=False):
+    """
+    Obtains the parcels of all the cadastral codes with a single request to
+    elastic, in the same order. Codes not yet indexed are read from INSPIRE
+    """
+    logger.debug('get_parcels_by_cadastral_codes(%s,%s)',
+                 cadastral_codes,
                  include_public_info)
-    try:
-        query = {
-            "query": {
-                "match": {
-                    "properties.nationalCadastralReference": cadastral_code
-                }
-            }
-        }
+    cadastral_codes = list(OrderedDict.fromkeys(cadastral_codes))
+    if not cadastral_codes:
+        return []
 
-        result = es.search(index=parcel_index,
-                           doc_type=parcel_mapping,
-                           body=query)
+    try:
+        result = es.mget(index=parcel_index,
+                         doc_type=parcel_mapping,
+                         body={'ids': cadastral_codes})
+    except ElasticsearchException as e:
+        raise ElasticException('PARCEL', e.message, e)
 
-        parcels = [hits['_source'] for hits in result['hits']['hits']]
+    found = {doc['_id']: doc['_source']
+             for doc in result['docs'] if doc.get('found')}
 
-        if not parcels:
-            parcels = get_inspire_data_by_code(cadastral_code)
+    parcels = []
+    for cadastral_code in cadastral_codes:
+        if cadastral_code in found:
+            parcels.append(found[cadastral_code])
+        else:
+            parcels += get_inspire_data_by_code(cadastral_code)
 
-        if include_public_info:
-            add_public_cadastral_info(parcels)
+    if include_public_info:
+        add_public_cadastral_info(parcels)
 
-        # Convert into geojson
-        for parcel in parcels:
-            parcel['type'] = 'Feature'
-        if include_google_info:
-            add_elevation_from_google(parcels)
+    # Convert into geojson
+    for parcel in parcels:
+        parcel['type'] = 'Feature'
+    if include_google_info:
+        add_elevation_from_google(parcels)
 
-        return parcels
-    except ElasticsearchException as e:
-        raise ElasticException('PARCEL', e.message, e)
+    return parcels
 
 
 @error_managed(inhibit_exception=True)
@@ -509,24 +720,36 @@ def index_parcel(parcel):
                                cause=e,
                                actionable_info=parcel)
 
+    invalidate_cached_parcels([parcel])
+
 
 @error_managed()
 def add_public_cadastral_info(parcels):
     logger.debug('add_public_cadastral_info(%s)', parcels)
     to_update = []
 
-    for parcel in parcels:
-        if 'cadastralData' not in parcel['properties'] \
-                or not parcel['properties']['cadastralData']:
+    pending = [parcel for parcel in parcels
+               if 'cadastralData' not in parcel['properties']
+               or not parcel['properties']['cadastralData']]
+    if not pending:
+        return to_update
 
-            public_info = get_public_cadastre_info(
-                Parcel.get_cadastral_reference(parcel))
+    codes = [Parcel.get_cadastral_reference(parcel) for parcel in pending]
+    if len(codes) == 1:
+        public_infos = [get_public_cadastre_info(codes[0])]
+    else:
+        pool = ThreadPool(min(public_info_concurrency, len(codes)))
+        try:
+            public_infos = pool.map(get_public_cadastre_info, codes)
+        finally:
+            pool.close()
 
-            if public_info:
-                parcel['properties']['cadastralData'] = public_info
+    for parcel, public_info in zip(pending, public_infos):
+        if public_info:
+            parcel['properties']['cadastralData'] = public_info
 
-                # add to elastic
-                to_update.append(Parcel.get_cadastral_reference(parcel))
+            # add to elastic
+            to_update.append(Parcel.get_cadastral_reference(parcel))
 
     return to_update
 
@@ -559,9 +782,20 @@ def add_elevation_from_google(parcels):
 
 
 @error_managed(default_answer={})
-def get_parcels_by_bbox(min_lat, min_lon, max_lat, max_lon):
+def get_parcels_by_bbox(min_lat, min_lon, max_lat, max_lon,
+                        page_size=max_elastic_query_size,
+                        search_after=None,
+                        profile='full'):
+    """
+    A page of the parcels of the bbox sorted by cadastral reference, after
+    the sort values of search_after, with the fields of the projection
+    profile. next_page_token is None in the last page
+    """
     try:
-        query = {
+        page_size = min(max(page_size, 1), max_elastic_query_size)
+        query = parcel_projection(profile)
+        query.update({
+            "sort": [{"properties.nationalCadastralReference": "asc"}],
             "query": {
                 "bool": {
                     "must": {
@@ -581,16 +815,24 @@ def get_parcels_by_bbox(min_lat, min_lon, max_lat, max_lon):
                     }
                 }
             }
-        }
+        })
 
+        if search_after is not None:
+            query['search_after'] = search_after
+
+        # One parcel more tells whether there is a next page
         result = es.search(index=parcel_index,
                            doc_type=parcel_mapping,
                            body=query,
-                           size=max_elastic_query_size)
+                           size=page_size + 1)
 
-        parcels = [hits['_source'] for hits in result['hits']['hits']]
+        parcels = [projected_source(hits) for hits in result['hits']['hits']]
+        next_page_token = encode_page_token([Parcel.get_cadastral_reference(parcels[page_size - 1])]) \
+            if len(parcels) > page_size else None
+        parcels = parcels[:page_size]
 
-        if query_cadastre_when_bbox:
+        # Parcels are stored again whole, so only full projections are updated
+        if query_cadastre_when_bbox and profile == 'full':
             to_update = list()
             to_update += add_public_cadastral_info(parcels)
             to_update += add_elevation_from_google(parcels)
@@ -607,64 +849,77 @@ def get_parcels_by_bbox(min_lat, min_lon, max_lat, max_lon):
             parcel['type'] = 'Feature'
 
         parcels_geojson = {'type': 'FeatureCollection',
-                           'features': parcels}
+                           'features': parcels,
+                           'next_page_token': next_page_token}
 
         return parcels_geojson
     except ElasticsearchException as e:
         raise ElasticException('PARCEL', e.message, e)
 
 
-@error_managed(default_answer={})
-def get_bucket_of_parcels_by_bbox_and_precision(
-        min_lat, min_lon, max_lat, max_lon, precision):
-    try:
-        query = {
-            "size": 0,
-            "query": {
-                "bool": {
-                    "must": {
-                        "match_all": {}
-                    },
-                    "filter": {
-                        "geo_shape": {
-                            "bbox": {
-                                "shape": {
-                                    "type": "envelope",
-                                    "coordinates": [
-                                        [min_lon, min_lat],
-                                        [max_lon, max_lat]]
-                                }
+def search_bucket_of_parcels(min_lat, min_lon, max_lat, max_lon, precision):
+    """(geohash_grid buckets, number of parcels) of the bbox"""
+    query = {
+        "size": 0,
+        "query": {
+            "bool": {
+                "must": {
+                    "match_all": {}
+                },
+                "filter": {
+                    "geo_shape": {
+                        "bbox": {
+                            "shape": {
+                                "type": "envelope",
+                                "coordinates": [
+                                    [min_lon, min_lat],
+                                    [max_lon, max_lat]]
                             }
                         }
                     }
                 }
-            },
-            "aggs": {
-                "2": {
-                    "geohash_grid": {
-                        "field": "properties.reference_point",
-                        "precision": precision
-                    },
-                    "aggs": {
-                        "area": {
-                            "sum": {
-                                "field": "properties.areaValue"
-                            }
+            }
+        },
+        "aggs": {
+            "2": {
+                "geohash_grid": {
+                    "field": "properties.reference_point",
+                    "precision": precision
+                },
+                "aggs": {
+                    "area": {
+                        "sum": {
+                            "field": "properties.areaValue"
                         }
                     }
                 }
             }
         }
+    }
+
+    result = es.search(
+        index=parcel_index,
+        doc_type=parcel_mapping,
+        body=query,
+        request_timeout=30)
+
+    return result['aggregations']['2']['buckets'], result['hits']['total']
+
 
-        result = es.search(
-            index=parcel_index,
-            doc_type=parcel_mapping,
-            body=query,
-            request_timeout=30)
+@error_managed(default_answer={})
+def get_bucket_of_parcels_by_bbox_and_precision(
+        min_lat, min_lon, max_lat, max_lon, precision):
+    try:
+        buckets = get_cached_parcel_buckets(min_lon, min_lat, max_lon, max_lat, int(precision))
+        if buckets is not None:
+            total = sum(bucket['doc_count'] for bucket in buckets)
+        else:
+            buckets, total = search_bucket_of_parcels(
+                min_lat, min_lon, max_lat, max_lon, precision)
 
         parcels_buckets = []
         max = min = 0
-        for bucket in result['aggregations']['2']['buckets']:
+        for bucket in buckets:
             (lat, lng, lat_err, lng_err) = geohash.decode_exactly(
                 bucket['key'])
             parcels_buckets.append(
@@ -688,7 +943,7 @@ def get_bucket_of_parcels_by_bbox_and_precision(
         parcels_geojson = {'type': 'FeatureCollection',
                            'features': parcels_buckets,
                            'properties': {
-                               'total': result['hits']['total'],
+                               'total': total,
                                'num_buckets': len(parcels_buckets),
                                'max': max,
                                'min': min
@@ -700,6 +955,126 @@ def get_bucket_of_parcels_by_bbox_and_precision(
         raise ElasticException('PARCEL', e.message, e)
 
 
+def tile_rings(geometry, z, x, y):
+    """
+    Rings of a parcel geometry in integer coordinates of the tile, simplified
+    in pixel space and clipped to the tile and its buffer. Exterior rings
+    have positive area and interior ones negative, as MVT expects
+    """
+    if geometry['type'].lower() == 'polygon':
+        polygons = [geometry['coordinates']]
+    else:
+        polygons = geometry['coordinates']
+
+    rings = []
+    for polygon in polygons:
+        for position, coordinates in enumerate(polygon):
+            points = tile_ring(coordinates, z, x, y)
+            if points is None:
+                if position == 0:
+                    # Holes of a polygon without exterior ring are not valid
+                    break
+                continue
+
+            if (ring_area(points) > 0) != (position == 0):
+                points = points[::-1]
+
+            rings.append([(int(px), int(py)) for px, py in points])
+
+    return rings
+
+
+def tile_ring(coordinates, z, x, y):
+    """
+    Integer tile coordinates of a ring, not closed, or None when nothing of
+    it is left in the tile
+    """
+    if len(coordinates) < 4:
+        return None
+
+    points = simplify_ring(lon_lat_to_tile(coordinates, z, x, y, tiles_extent),
+                           tiles_simplify_tolerance)
+    points = clip_ring(points[:-1], -tiles_buffer, tiles_extent + tiles_buffer)
+    if len(points) < 3:
+        return None
+
+    points = np.rint(points).astype(int)
+    points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+    if len(points) < 3 or ring_area(points) == 0:
+        return None
+
+    return points
+
+
+@error_managed()
+def get_parcels_tile(z, x, y):
+    """
+    Mapbox Vector Tile of the parcels of the tile z/x/y, empty below
+    tiles.min_zoom
+    """
+    if z < tiles_min_zoom:
+        return encode_tile({}, tiles_extent)
+
+    try:
+        west, south, east, north = tile_bounds(z, x, y)
+        # Parcels in the buffer around the tile are drawn too
+        margin_lon = (east - west) * tiles_buffer / tiles_extent
+        margin_lat = (north - south) * tiles_buffer / tiles_extent
+
+        query = {
+            "_source": ["geometry",
+                        "properties.nationalCadastralReference",
+                        "properties.areaValue",
+                        "properties.sigpacData.USO_SIGPAC"],
+            "query": {
+                "bool": {
+                    "filter": {
+                        "geo_shape": {
+                            "bbox": {
+                                "shape": {
+                                    "type": "envelope",
+                                    "coordinates": [
+                                        [west - margin_lon, north + margin_lat],
+                                        [east + margin_lon, south - margin_lat]]
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        hits = elastic_search_after(parcel_index,
+                                    parcel_mapping,
+                                    query,
+                                    [{'properties.nationalCadastralReference': 'asc'}],
+                                    max_elastic_query_size)
+
+        features = []
+        for hit in hits:
+            source = hit['_source']
+            if 'geometry' not in source:
+                continue
+
+            rings = tile_rings(source['geometry'], z, x, y)
+            if not rings:
+                continue
+
+            properties = source.get('properties', {})
+            features.append({
+                'rings': rings,
+                'properties': {
+                    'nationalCadastralReference':
+                        properties.get('nationalCadastralReference'),
+                    'areaValue': properties.get('areaValue'),
+                    'use': properties.get('sigpacData', {}).get('USO_SIGPAC')
+                }})
+
+        return encode_tile({TILES_LAYER: features}, tiles_extent)
+    except ElasticsearchException as e:
+        raise ElasticException('PARCEL', e.message, e)
+
+
 def scan_parcels(update):
     # TODO(teanocrata) must update all parcels but we need to have cadastre
     # info as soon as possible, remove query then.
@@ -0,0 +1,37 @@
+from collections import defaultdict
+from osc.models import ImportCheckpoint
+from django.utils import timezone
+
+
+def get_import_checkpoints(urls):
+    checkpoints = defaultdict(dict)
+    for checkpoint in ImportCheckpoint.objects.filter(url__in=urls):
+        checkpoints[checkpoint.url][checkpoint.member] = checkpoint
+
+    return checkpoints
+
+
+def start_import_checkpoints(url, content_hash, members):
+    # Offsets of a previous content of the url are not valid anymore
+    ImportCheckpoint.objects.filter(url=url).exclude(content_hash=content_hash).delete()
+
+    started = set(ImportCheckpoint.objects.filter(url=url).values_list('member', flat=True))
+    ImportCheckpoint.objects.bulk_create([ImportCheckpoint(url=url,
+                                                           content_hash=content_hash,
+                                                           member=member,
+                                                           update_date=timezone.now())
+                                          for member in members if member not in started])
+
+
+def advance_import_checkpoint(url, member, offset):
+    ImportCheckpoint.objects.filter(url=url, member=member).update(offset=offset,
+                                                                   update_date=timezone.now())
+
+
+def finish_import_checkpoint(url, member):
+    ImportCheckpoint.objects.filter(url=url, member=member).update(finished=True,
+                                                                   update_date=timezone.now())
+
+
+def clear_import_checkpoints(url):
+    ImportCheckpoint.objects.filter(url=url).delete()
@@ -1,61 +1,76 @@
 # coding=utf-8
 
+from datetime import date
+import json
+import logging
+
 from elasticsearch import ElasticsearchException
+from elasticsearch.client import IndicesClient
 from osc.exceptions import ElasticException
 from geopy.distance import great_circle
-from osc.util import error_managed, es
+from osc.util import elastic_bulk, error_managed, es
+from osc.util import CachedSpatialIndex, SpatialIndex, geo_point_lat_lon
 
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
 es_index = settings.INFORIEGO['index']
 es_daily_mapping = settings.INFORIEGO['daily.mapping']
 es_station_mapping = settings.INFORIEGO['station.mapping']
+es_rollup_index = settings.INFORIEGO['rollup.index']
+es_rollup_mapping = settings.INFORIEGO['rollup.mapping']
+rollup_batch_size = settings.INFORIEGO['rollup.batch_size']
+nearest_ttl = settings.INFORIEGO['nearest.ttl']
 
 
-@error_managed(default_answer={})
-def get_closest_station(lat, lon):
-    try:
-        query = {"size": 1,
-                 "sort": [
-                     {
-                         "_geo_distance": {
-                             "lat_lon": {
-                                 "lat": lat,
-                                 "lon": lon
-                             },
-                             "order": "asc",
-                             "unit": "km",
-                             "mode": "min",
-                             "distance_type": "sloppy_arc"
-                         }
-                     }
-                 ]
-                 }
+def load_station_index():
+    result = es.search(index=es_index,
+                       doc_type=es_station_mapping,
+                       size=10000)
+    stations = [hits['_source'] for hits in result['hits']['hits']]
+
+    return SpatialIndex(stations,
+                        [geo_point_lat_lon(station['lat_lon'])
+                         for station in stations])
 
-        result = es.search(index=es_index,
-                           doc_type=es_station_mapping,
-                           body=query)
-        stations = [hits['_source'] for hits in result['hits']['hits']]
 
-        closest_station = {}
+station_index = CachedSpatialIndex('STATIONS', load_station_index, nearest_ttl)
 
-        if len(stations) == 1:
-            closest_station = stations[0]
 
-            this_loc = (lat, lon)
-            station_loc = (closest_station['lat_lon']['lat'],
-                           closest_station['lat_lon']['lon'])
+def with_distance_to_parcel(lat, lon, station):
+    closest_station = dict(station)
 
-            closest_station['distance_to_parcel'] = \
-                great_circle(this_loc, station_loc).kilometers
+    this_loc = (lat, lon)
+    station_loc = geo_point_lat_lon(closest_station['lat_lon'])
 
-        return closest_station
+    closest_station['distance_to_parcel'] = \
+        great_circle(this_loc, station_loc).kilometers
 
+    return closest_station
+
+
+@error_managed(default_answer=[])
+def get_closest_stations(lat_lons):
+    lat_lons = list(lat_lons)
+
+    try:
+        neighbours = station_index.query_many(lat_lons)
     except ElasticsearchException as e:
         raise ElasticException('CLIMATE',
-                               'ElasticSearch Error getting closest station',
+                               'ElasticSearch Error loading stations',
                                e)
 
+    return [with_distance_to_parcel(lat, lon, closest[0][0]) if closest else {}
+            for (lat, lon), closest in zip(lat_lons, neighbours)]
+
+
+@error_managed(default_answer={})
+def get_closest_station(lat, lon):
+    closest_stations = get_closest_stations([(lat, lon)])
+
+    return closest_stations[0] if closest_stations else {}
+
 
 def parse_by_month(bymonth):
     result = []
@@ -122,172 +137,174 @@ def parse_last_year(last_year):
     return result
 
 
-@error_managed(default_answer={})
-def get_aggregated_climate_measures(station_id, province_id, num_years_back):
-    try:
-        query = {
-            "size": 0,
-            "query": {
-                "constant_score": {
-                    "filter": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "term": {
-                                        "IDESTACION": station_id
-                                    }
-                                },
-                                {
-                                    "term": {
-                                        "IDPROVINCIA": province_id
-                                    }
-                                }
-                            ]
-                        }
+def climate_measures_query(station_id, province_id, num_years_back, year=None):
+    must = [
+        {
+            "term": {
+                "IDESTACION": station_id
+            }
+        },
+        {
+            "term": {
+                "IDPROVINCIA": province_id
+            }
+        }
+    ]
+
+    if year is not None:
+        must.append({"term": {u'AÑO': year}})
+
+    return {
+        "size": 0,
+        "query": {
+            "constant_score": {
+                "filter": {
+                    "bool": {
+                        "must": must
                     }
                 }
-            },
-            "aggs": {
-                "last_year": {
-                    "terms": {
-                        "field": u'AÑO',
-                        "order": {
-                            "_term": "desc"
-                        },
-                        "size": 1
+            }
+        },
+        "aggs": {
+            "last_year": {
+                "terms": {
+                    "field": u'AÑO',
+                    "order": {
+                        "_term": "desc"
                     },
-                    "aggs": {
-                        "sum_rainfall": {
-                            "sum": {
-                                "field": "PRECIPITACION"
-                            }
-                        },
-                        "max_temperature": {
-                            "max": {
-                                "field": "TEMPMAX"
-                            }
-                        },
-                        "min_temperature": {
-                            "min": {
-                                "field": "TEMPMIN"
-                            }
-                        },
-                        "avg_temperature": {
-                            "avg": {
-                                "field": "TEMPMEDIA"
-                            }
-                        },
-                        "avg_sun_hours": {
-                            "avg": {
-                                "field": "N"
-                            }
-                        },
-                        "max_sun_hours": {
-                            "max": {
-                                "field": "N"
-                            }
-                        },
-                        "sum_sun_hours": {
-                            "sum": {
-                                "field": "N"
-                            }
-                        },
-                        "avg_radiation": {
-                            "avg": {
-                                "field": "RADIACION"
-                            }
-                        },
-                        "max_radiation": {
-                            "max": {
-                                "field": "RADIACION"
-                            }
-                        },
-                        "sum_radiation": {
-                            "sum": {
-                                "field": "RADIACION"
-                            }
-                        },
-                        "rainy_days": {
-                            "filter": {
-                                "range": {
-                                    "PRECIPITACION": {
-                                        "gt": 0
-                                    }
+                    "size": 1
+                },
+                "aggs": {
+                    "sum_rainfall": {
+                        "sum": {
+                            "field": "PRECIPITACION"
+                        }
+                    },
+                    "max_temperature": {
+                        "max": {
+                            "field": "TEMPMAX"
+                        }
+                    },
+                    "min_temperature": {
+                        "min": {
+                            "field": "TEMPMIN"
+                        }
+                    },
+                    "avg_temperature": {
+                        "avg": {
+                            "field": "TEMPMEDIA"
+                        }
+                    },
+                    "avg_sun_hours": {
+                        "avg": {
+                            "field": "N"
+                        }
+                    },
+                    "max_sun_hours": {
+                        "max": {
+                            "field": "N"
+                        }
+                    },
+                    "sum_sun_hours": {
+                        "sum": {
+                            "field": "N"
+                        }
+                    },
+                    "avg_radiation": {
+                        "avg": {
+                            "field": "RADIACION"
+                        }
+                    },
+                    "max_radiation": {
+                        "max": {
+                            "field": "RADIACION"
+                        }
+                    },
+                    "sum_radiation": {
+                        "sum": {
+                            "field": "RADIACION"
+                        }
+                    },
+                    "rainy_days": {
+                        "filter": {
+                            "range": {
+                                "PRECIPITACION": {
+                                    "gt": 0
                                 }
                             }
                         }
                     }
+                }
+            },
+            "by_month": {
+                "terms": {
+                    "field": u'AÑO',
+                    "order": {
+                        "_term": "desc"
+                    },
+                    "size": num_years_back
                 },
-                "by_month": {
-                    "terms": {
-                        "field": u'AÑO',
-                        "order": {
-                            "_term": "desc"
+                "aggs": {
+                    "measure": {
+                        "date_histogram": {
+                            "field": "FECHA",
+                            "interval": "month",
+                            "format": "M"
                         },
-                        "size": num_years_back
-                    },
-                    "aggs": {
-                        "measure": {
-                            "date_histogram": {
-                                "field": "FECHA",
-                                "interval": "month",
-                                "format": "M"
+                        "aggs": {
+                            "rainfall": {
+                                "sum": {
+                                    "field": "PRECIPITACION"
+                                }
                             },
-                            "aggs": {
-                                "rainfall": {
-                                    "sum": {
-                                        "field": "PRECIPITACION"
-                                    }
-                                },
-                                "avg_temperature": {
-                                    "avg": {
-                                        "field": "TEMPMEDIA"
-                                    }
-                                },
-                                "sun_hours": {
-                                    "sum": {
-                                        "field": "N"
-                                    }
-                                },
-                                "radiation": {
-                                    "sum": {
-                                        "field": "RADIACION"
-                                    }
+                            "avg_temperature": {
+                                "avg": {
+                                    "field": "TEMPMEDIA"
+                                }
+                            },
+                            "sun_hours": {
+                                "sum": {
+                                    "field": "N"
+                                }
+                            },
+                            "radiation": {
+                                "sum": {
+                                    "field": "RADIACION"
                                 }
                             }
                         }
                     }
+                }
+            },
+            "by_day": {
+                "terms": {
+                    "field": u'AÑO',
+                    "order": {
+                        "_term": "desc"
+                    },
+                    "size": num_years_back
                 },
-                "by_day": {
-                    "terms": {
-                        "field": u'AÑO',
-                        "order": {
-                            "_term": "desc"
+                "aggs": {
+                    "measure": {
+                        "date_histogram": {
+                            "field": "FECHA",
+                            "interval": "day",
+                            "format": "dd-MM-yyyy"
                         },
-                        "size": num_years_back
-                    },
-                    "aggs": {
-                        "measure": {
-                            "date_histogram": {
-                                "field": "FECHA",
-                                "interval": "day",
-                                "format": "dd-MM-yyyy"
+                        "aggs": {
+                            "avg_temperature": {
+                                "avg": {
+                                    "field": "TEMPMEDIA"
+                                }
+                            },
+                            "sun_hours": {
+                                "sum": {
+                                    "field": "N"
+                                }
                             },
-                            "aggs": {
-                                "avg_temperature": {
-                                    "avg": {
-                                        "field": "TEMPMEDIA"
-                                    }
-                                },
-                                "sun_hours": {
-                                    "sum": {
-                                        "field": "N"
-                                    }
-                                },
-                                "radiation": {
-                                    "sum": {
-                                        "field": "RADIACION"
-                                    }
+                            "radiation": {
+                                "sum": {
+                                    "field": "RADIACION"
                                 }
                             }
                         }
@@ -295,20 +312,152 @@ def get_aggregated_climate_measures(station_id, province_id, num_years_back):
                 }
             }
         }
+    }
+
+
+def parse_climate_measures(aggregations):
+    return {'by_month': parse_by_month(aggregations['by_month']['buckets']),
+            'by_day': parse_by_day(aggregations['by_day']['buckets']),
+            'last_year': parse_last_year(aggregations['last_year']['buckets'])}
+
+
+def get_live_aggregated_climate_measures(station_id, province_id, num_years_back):
+    try:
+        query = climate_measures_query(station_id, province_id, num_years_back)
 
         result = es.search(index=es_index,
                            doc_type=es_daily_mapping,
                            body=query)
-        hit = result['aggregations']
-
-        by_month = parse_by_month(hit['by_month']['buckets'])
-        by_day = parse_by_day(hit['by_day']['buckets'])
-        last_year = parse_last_year(hit['last_year']['buckets'])
 
-        return {'by_month': by_month,
-                'by_day': by_day,
-                'last_year': last_year}
+        return parse_climate_measures(result['aggregations'])
     except ElasticsearchException as e:
         raise ElasticException('CLIMATE',
                                'ElasticSearch error getting climate aggrs',
                                e)
+
+
+def rollup_id(province_id, station_id, year):
+    return '{}_{}_{}'.format(province_id, station_id, year)
+
+
+def get_rollup_climate_measures(station_id, province_id, num_years_back):
+    # The current year may have no data yet, so ask for one year more
+    current_year = date.today().year
+    ids = [rollup_id(province_id, station_id, year)
+           for year in range(current_year, current_year - num_years_back - 1, -1)]
+
+    try:
+        result = es.mget(index=es_rollup_index,
+                         doc_type=es_rollup_mapping,
+                         body={'ids': ids})
+    except ElasticsearchException as e:
+        logger.warning('Climate rollup not available for station %s (%s): %s',
+                       station_id, province_id, e)
+        return None
+
+    years = [doc['_source'] for doc in result['docs'] if doc.get('found')]
+    if len(years) < num_years_back:
+        # Only the years touched by the daily update may be rolled up yet
+        logger.debug('Climate rollup of station %s (%s) has %d of %d years',
+                     station_id, province_id, len(years), num_years_back)
+        return None
+
+    years = years[:num_years_back]
+
+    return {'by_month': [{'year': year['year'],
+                          'monthly_measures': year['monthly_measures']}
+                         for year in years],
+            'by_day': [{'year': year['year'],
+                        'daily_measures': year['daily_measures']}
+                       for year in years],
+            'last_year': years[0]['last_year']}
+
+
+@error_managed(default_answer={})
+def get_aggregated_climate_measures(station_id, province_id, num_years_back):
+    rollup = get_rollup_climate_measures(station_id, province_id, num_years_back)
+    if rollup is not None:
+        return rollup
+
+    return get_live_aggregated_climate_measures(station_id, province_id, num_years_back)
+
+
+def rollup_document(province_id, station_id, year, aggregations):
+    measures = parse_climate_measures(aggregations)
+    if not measures['by_month']:
+        return None
+
+    return {'IDPROVINCIA': province_id,
+            'IDESTACION': station_id,
+            'year': year,
+            'last_year': measures['last_year'],
+            'monthly_measures': measures['by_month'][0]['monthly_measures'],
+            'daily_measures': measures['by_day'][0]['daily_measures']
+            if measures['by_day'] else []}
+
+
+def rollup_actions(station_years, batch_size):
+    for start in range(0, len(station_years), batch_size):
+        batch = station_years[start:start + batch_size]
+
+        body = []
+        for province_id, station_id, year in batch:
+            body.append({})
+            body.append(climate_measures_query(station_id, province_id, 1, year))
+
+        responses = es.msearch(index=es_index,
+                               doc_type=es_daily_mapping,
+                               body=body)['responses']
+
+        for (province_id, station_id, year), response in zip(batch, responses):
+            if 'error' in response:
+                logger.warning('Error aggregating station %s (%s), year %s: %s',
+                               station_id, province_id, year, response['error'])
+                continue
+
+            document = rollup_document(province_id,
+                                       station_id,
+                                       year,
+                                       response['aggregations'])
+            if document is not None:
+                yield {'_index': es_rollup_index,
+                       '_type': es_rollup_mapping,
+                       '_id': rollup_id(province_id, station_id, year),
+                       '_source': document}
+
+
+@error_managed(inhibit_exception=True)
+def rollup_climate_measures(station_years, batch_size=rollup_batch_size):
+    """
+    Rebuilds the rollup documents of the given (province, station, year)
+    tuples from the daily index
+    """
+    station_years = sorted(set(station_years))
+
+    try:
+        es.indices.refresh(index=es_index)
+
+        stats = elastic_bulk('ROLLUP_CLIMATE',
+                             rollup_actions(station_years, batch_size))
+    except ElasticsearchException as e:
+        raise ElasticException('CLIMATE',
+                               'ElasticSearch error rolling up climate measures',
+                               e)
+
+    logger.info('Climate rollup: %d station-years rebuilt', stats.success)
+
+    return stats
+
+
+def create_climate_rollup_mapping():
+
+    idx_client = IndicesClient(es)
+
+    if not idx_client.exists(index=es_rollup_index):
+        idx_client.create(index=es_rollup_index)
+
+    with open('osc/util/mappings/climate_rollup.json') as mapping_file:
+        mapping = json.load(mapping_file)
+        idx_client.put_mapping(doc_type=es_rollup_mapping,
+                               index=[es_rollup_index],
+                               body=mapping)
@@ -28,3 +28,26 @@ def finish_feed_read(feed_id, success, info=None):
         feed.info = info
 
         feed.save()
+
+
+def get_feed_validators(feed_url):
+    feed = Feed.objects.filter(url=feed_url).order_by('id').first()
+
+    if feed is None:
+        return None, None, None
+
+    return feed.etag, feed.last_modified, feed.content_hash
+
+
+def save_feed_validators(feed_url, etag, last_modified, content_hash=None):
+    feed = Feed.objects.filter(url=feed_url).order_by('id').first()
+
+    if feed is None:
+        now = timezone.now()
+        feed = Feed(url=feed_url, date_launched=now, date_finished=now, update_date=now, success=True)
+
+    feed.etag = etag
+    feed.last_modified = last_modified
+    feed.content_hash = content_hash
+
+    feed.save()
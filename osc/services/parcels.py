@@ -50,36 +50,58 @@ def obtain_parcels_by_cadastral_code(cadastral_code,
                                      retrieve_climate_info=False,
                                      retrieve_soil_info=False,
                                      retrieve_google_info=False):
-    logger.debug('obtain_parcels_by_cadastral_code(%s,%s,%s,%s)',
-                 cadastral_code,
+    return obtain_parcels_by_cadastral_codes([cadastral_code],
+                                             retrieve_public_info,
+                                             retrieve_climate_info,
+                                             retrieve_soil_info,
+                                             retrieve_google_info)
+
+
+def obtain_parcels_by_cadastral_codes(cadastral_codes,
+                                      retrieve_public_info=False,
+                                      retrieve_climate_info=False,
+                                      retrieve_soil_info=False,
+                                      retrieve_google_info=False):
+    logger.debug('obtain_parcels_by_cadastral_codes(%s,%s,%s,%s)',
+                 cadastral_codes,
                  retrieve_public_info,
                  retrieve_climate_info,
                  retrieve_soil_info)
-    parcels = cadastre.get_parcels_by_cadastral_code(cadastral_code,
-                                                     retrieve_public_info,
-                                                     retrieve_google_info)
+    parcels = cadastre.get_parcels_by_cadastral_codes(cadastral_codes,
+                                                      retrieve_public_info,
+                                                      retrieve_google_info)
+
+    reference_points = [(parcel['properties']['reference_point']['lat'],
+                         parcel['properties']['reference_point']['lon'])
+                        for parcel in parcels]
 
     # Add climate info
     if retrieve_climate_info:
-        for parcel in parcels:
-            closest_station = \
-                climate.get_closest_station(
-                    parcel['properties']['reference_point']['lat'],
-                    parcel['properties']['reference_point']['lon'])
+        closest_stations = climate.get_closest_stations(reference_points)
+
+        # Parcels close to each other share the station, and so the climate
+        climate_aggs = {}
+        for parcel, closest_station in zip(parcels, closest_stations):
             parcel['properties']['closest_station'] = closest_station
-            climate_agg = climate.get_aggregated_climate_measures(
-                closest_station['IDESTACION'],
-                closest_station['IDPROVINCIA'],
-                3)
-            parcel['properties']['climate_aggregations'] = climate_agg
+
+            if closest_station:
+                station = (closest_station['IDESTACION'],
+                           closest_station['IDPROVINCIA'])
+                if station not in climate_aggs:
+                    climate_aggs[station] = \
+                        climate.get_aggregated_climate_measures(station[0],
+                                                                station[1],
+                                                                3)
+                parcel['properties']['climate_aggregations'] = \
+                    climate_aggs[station]
+            else:
+                parcel['properties']['climate_aggregations'] = {}
 
     # Add soil info
     if retrieve_soil_info:
-        for parcel in parcels:
-            closest_soil_measure = \
-                soil.get_closest_soil_measure(
-                    parcel['properties']['reference_point']['lat'],
-                    parcel['properties']['reference_point']['lon'])
+        closest_soil_measures = soil.get_closest_soil_measures(reference_points)
+
+        for parcel, closest_soil_measure in zip(parcels, closest_soil_measures):
             parcel['properties']['closest_soil_measure'] = closest_soil_measure
 
     parcels_geojson = {'type': 'FeatureCollection',
@@ -88,11 +110,14 @@ def obtain_parcels_by_cadastral_code(cadastral_code,
     return parcels_geojson
 
 
-def obtain_parcels_by_bbox(lat_min, lon_min, lat_max, lon_max, precision):
+def obtain_parcels_by_bbox(lat_min, lon_min, lat_max, lon_max, precision,
+                           page_size=cadastre.max_elastic_query_size,
+                           search_after=None,
+                           profile='full'):
 
     if precision == 0:
         parcels = cadastre.get_parcels_by_bbox(
-            lat_min, lon_min, lat_max, lon_max)
+            lat_min, lon_min, lat_max, lon_max, page_size, search_after, profile)
 
         # Filter the parcels that are roads, ways, etc.
         # (JLG ATTENTION: To be removed when we have everything in ELASTIC)
@@ -0,0 +1,109 @@
+import json
+import logging
+import time
+
+from elasticsearch import ElasticsearchException
+from elasticsearch.client import IndicesClient
+
+from django.conf import settings
+
+from osc.exceptions import ElasticException
+from osc.util import aggregate_parcel_cells
+from osc.util import elastic_bulk
+from osc.util import error_managed
+from osc.util import es
+from osc.util import invalidate_parcel_buckets
+
+__all__ = ['build_parcel_pyramid',
+           'create_parcel_pyramid_mapping']
+
+logger = logging.getLogger(__name__)
+
+parcel_index = settings.CADASTRE['index']
+pyramid_index = settings.CADASTRE['pyramid.index']
+pyramid_mapping = settings.CADASTRE['pyramid.mapping']
+pyramid_max_precision = settings.CADASTRE['pyramid.max_precision']
+pyramid_depth = settings.CADASTRE['pyramid.depth']
+pyramid_batch_size = settings.CADASTRE['pyramid.batch_size']
+
+
+def pyramid_buckets(max_precision, depth, batch_size):
+    """
+    Yields (precision, bucket) of every level of the pyramid. Each level is
+    aggregated within the cells depth levels above it that hold parcels
+    """
+    parents = {0: ['']}
+    for precision in range(1, max_precision + 1):
+        cells = []
+        level_parents = parents[max(0, precision - depth)]
+
+        for start in range(0, len(level_parents), batch_size):
+            batch = level_parents[start:start + batch_size]
+            for buckets in aggregate_parcel_cells(batch, precision).itervalues():
+                for bucket in buckets:
+                    cells.append(bucket['key'])
+                    yield precision, bucket
+
+        # The cells of the deepest levels are never parents
+        if precision + depth <= max_precision:
+            parents[precision] = sorted(cells)
+
+        logger.info('Parcel pyramid: %d cells of precision %d', len(cells), precision)
+
+
+def pyramid_actions(build, max_precision, depth, batch_size):
+    for precision, bucket in pyramid_buckets(max_precision, depth, batch_size):
+        yield {'_index': pyramid_index,
+               '_type': pyramid_mapping,
+               '_id': bucket['key'],
+               '_source': {'geohash': bucket['key'],
+                           'precision': precision,
+                           'count': bucket['doc_count'],
+                           'area': bucket['area']['value'],
+                           'build': build}}
+
+
+@error_managed(inhibit_exception=True)
+def build_parcel_pyramid(max_precision=pyramid_max_precision,
+                         depth=pyramid_depth,
+                         batch_size=pyramid_batch_size):
+    """
+    Rebuilds the parcel count and area sum of every geohash cell up to
+    max_precision, removing the cells left without parcels
+    """
+    build = int(time.time())
+
+    try:
+        es.indices.refresh(index=parcel_index)
+
+        stats = elastic_bulk('PARCEL_PYRAMID',
+                             pyramid_actions(build, max_precision, depth, batch_size))
+
+        es.indices.refresh(index=pyramid_index)
+        es.delete_by_query(index=pyramid_index,
+                           doc_type=pyramid_mapping,
+                           body={'query': {'bool': {'must_not': {'term': {'build': build}}}}})
+    except ElasticsearchException as e:
+        raise ElasticException('PARCEL',
+                               'ElasticSearch error building the parcel pyramid',
+                               e)
+
+    invalidate_parcel_buckets()
+
+    logger.info('Parcel pyramid: %d cells rebuilt', stats.success)
+
+    return stats
+
+
+def create_parcel_pyramid_mapping():
+
+    idx_client = IndicesClient(es)
+
+    if not idx_client.exists(index=pyramid_index):
+        idx_client.create(index=pyramid_index)
+
+    with open('osc/util/mappings/parcel_pyramid.json') as mapping_file:
+        mapping = json.load(mapping_file)
+        idx_client.put_mapping(doc_type=pyramid_mapping,
+                               index=[pyramid_index],
+                               body=mapping)
@@ -3,44 +3,50 @@
 from elasticsearch import ElasticsearchException
 from osc.exceptions import ElasticException
 from osc.util import error_managed, es
+from osc.util import CachedSpatialIndex, SpatialIndex, geo_point_lat_lon
 
 from django.conf import settings
 
 es_index = settings.SOIL['index']
 es_soil_mapping = settings.SOIL['mapping']
+nearest_ttl = settings.SOIL['nearest.ttl']
 
-@error_managed(default_answer={})
-def get_closest_soil_measure(lat, lon):
+
+def load_soil_measure_index():
+    result = es.search(index=es_index, doc_type=es_soil_mapping, size=10000)
+    soil_measures = [hits['_source'] for hits in result['hits']['hits']]
+
+    return SpatialIndex(soil_measures,
+                        [geo_point_lat_lon(soil_measure['coordinates'])
+                         for soil_measure in soil_measures])
+
+
+soil_measure_index = CachedSpatialIndex('SOIL', load_soil_measure_index, nearest_ttl)
+
+
+@error_managed(default_answer=[])
+def get_closest_soil_measures(lat_lons):
     try:
-        query = {"size": 1,
-                 "sort": [
-                     {
-                         "_geo_distance": {
-                             "coordinates": {
-                                 "lat": lat,
-                                 "lon": lon
-                             },
-                             "order": "asc",
-                             "unit": "km",
-                             "mode": "min",
-                             "distance_type": "sloppy_arc"
-                         }
-                     }
-                 ]
-                 }
-
-        result = es.search(index=es_index, doc_type=es_soil_mapping, body=query)
-
-        soil_measures = [hits['_source'] for hits in result['hits']['hits']]
-        soil_measures_distances = [hits['sort'] for hits in result['hits']['hits']]
-        
+        neighbours = soil_measure_index.query_many(lat_lons)
+    except ElasticsearchException as e:
+        raise ElasticException('SOIL', 'ElasticSearch Error loading soil measures', e)
 
+    closest_soil_measures = []
+    for closest in neighbours:
         closest_soil_measure = {}
 
-        if len(soil_measures) == 1:
-            closest_soil_measure = soil_measures[0]
-            closest_soil_measure['distance_to_parcel'] = soil_measures_distances[0][0]
-        return closest_soil_measure
+        if closest:
+            soil_measure, distance = closest[0]
+            closest_soil_measure = dict(soil_measure)
+            closest_soil_measure['distance_to_parcel'] = distance
 
-    except ElasticsearchException as e:
-        raise ElasticException('SOIL', 'ElasticSearch Error getting closest soil measure', e)
+        closest_soil_measures.append(closest_soil_measure)
+
+    return closest_soil_measures
+
+
+@error_managed(default_answer={})
+def get_closest_soil_measure(lat, lon):
+    closest_soil_measures = get_closest_soil_measures([(lat, lon)])
+
+    return closest_soil_measures[0] if closest_soil_measures else {}
@@ -91,21 +91,30 @@ def update_user_profile(username,
     return user
 
 
-def get_parcels(username, retrieve_public_info=False, retrieve_climate_info=False, retrieve_soil_info=False):
-    
+def get_parcels(username, retrieve_public_info=False, retrieve_climate_info=False, retrieve_soil_info=False,
+                page=1, page_size=None):
+
     if username is not None:
         user = get_user(username)
         user_parcels = UserParcel.objects.filter(user=user)
     else:
         user_parcels = UserParcel.objects.filter()
 
-    parcels = []
-    for user_parcel in user_parcels:
-        parcels += parcel_service.obtain_parcels_by_cadastral_code(user_parcel.cadastral_code,
-                                                                   retrieve_public_info=retrieve_public_info,
-                                                                   retrieve_climate_info=retrieve_climate_info,
-                                                                   retrieve_soil_info=retrieve_soil_info)
-    return parcels
+    cadastral_codes = user_parcels.order_by('cadastral_code') \
+                                  .values_list('cadastral_code', flat=True) \
+                                  .distinct()
+    if page_size is not None:
+        cadastral_codes = cadastral_codes[(page - 1) * page_size:page * page_size]
+
+    cadastral_codes = list(cadastral_codes)
+    if not cadastral_codes:
+        return []
+
+    parcels = parcel_service.obtain_parcels_by_cadastral_codes(cadastral_codes,
+                                                               retrieve_public_info=retrieve_public_info,
+                                                               retrieve_climate_info=retrieve_climate_info,
+                                                               retrieve_soil_info=retrieve_soil_info)
+    return parcels['features']
 
 
 def add_parcel(username, cadastral_code):
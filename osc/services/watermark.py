@@ -0,0 +1,23 @@
+from osc.models import StationWatermark
+from django.utils import timezone
+
+
+def get_station_watermarks():
+    return {(watermark.province_id, watermark.station_id): watermark
+            for watermark in StationWatermark.objects.all()}
+
+
+def advance_station_watermark(province_id, station_id, update_date, last_date=None):
+    watermark, created = StationWatermark.objects.get_or_create(province_id=province_id,
+                                                                station_id=station_id,
+                                                                defaults={'update_date': update_date,
+                                                                          'date_checked': timezone.now()})
+
+    watermark.update_date = max(watermark.update_date, update_date)
+    watermark.date_checked = timezone.now()
+    if last_date is not None and (watermark.last_date is None or last_date > watermark.last_date):
+        watermark.last_date = last_date
+
+    watermark.save()
+
+    return watermark
@@ -7,7 +7,8 @@ from geopy.distance import great_circle
 
 from osc.exceptions import ConnectionError, ElasticException
 
-from osc.util import elastic_bulk_save, error_managed, es
+from osc.util import elastic_bulk, error_managed, es
+from osc.util import CachedSpatialIndex, SpatialIndex, geo_point_lat_lon
 from elasticsearch.client import IndicesClient
 from elasticsearch import ElasticsearchException
 
@@ -64,6 +65,7 @@ cod Internal parameter
 weather_index = settings.WEATHER['index']
 weather_mapping = settings.WEATHER['weather.mapping']
 locations_mapping = settings.WEATHER['locations.mapping']
+nearest_ttl = settings.WEATHER['nearest.ttl']
 
 
 def make_weather_mapping():
@@ -256,58 +258,61 @@ def get_weather_from_locations():
     return weather_list
 
 
+@error_managed(inhibit_exception=True)
 def store_weather(weather_list):
-    chunk_size = settings.ELASTICSEARCH['chunk_size']
+    actions = ({'_index': weather_index,
+                '_type': weather_mapping,
+                '_id': str(time.mktime(r['record']['dt'].timetuple())) + '_' + r['location'],
+                '_parent': r['location'],
+                '_source': r['record']} for r in weather_list)
 
-    for i in range(0, len(weather_list), chunk_size):
-        records = weather_list[i:i + chunk_size]
+    return elastic_bulk('STORE_WEATHER', actions)
 
-        docs = [r['record'] for r in records]
-        ids = [str(time.mktime(r['record']['dt'].timetuple())) + '_' + r['location'] for r in records]
-        parents = [r['location'] for r in records]
 
-        elastic_bulk_save('STORE_WEATHER', weather_index, weather_mapping, docs, ids=ids, parents=parents)
+def load_location_index():
+    locations = get_all_locations()
 
+    return SpatialIndex(locations,
+                        [geo_point_lat_lon(location['coordinates'])
+                         for id_location, location in locations])
+
+
+location_index = CachedSpatialIndex('LOCATIONS', load_location_index, nearest_ttl)
+
+
+@error_managed(default_answer=[])
+def get_closest_locations(lat_lons):
+    lat_lons = list(lat_lons)
 
-@error_managed(default_answer={})
-def get_closest_location(lat, lon):
     try:
-        query = {"size": 1,
-                 "sort": [
-                     {
-                         "_geo_distance": {
-                             "coordinates": {
-                                 "lat": lat,
-                                 "lon": lon
-                             },
-                             "order": "asc",
-                             "unit": "km",
-                             "mode": "min",
-                             "distance_type": "sloppy_arc"
-                         }
-                     }
-                 ]
-                 }
-
-        result = es.search(index=weather_index, doc_type=locations_mapping, body=query)
-
-        locations = [(hits['_id'], hits['_source']) for hits in result['hits']['hits']]
+        neighbours = location_index.query_many(lat_lons)
+    except ElasticsearchException as e:
+        raise ElasticException('locationS', 'ElasticSearch Error loading locations', e)
 
+    closest_locations = []
+    for (lat, lon), closest in zip(lat_lons, neighbours):
         closest_location = {}
         id_location = None
 
-        if len(locations) == 1:
-            id_location, closest_location = locations[0]
+        if closest:
+            (id_location, location), distance = closest[0]
+            closest_location = dict(location)
 
             this_loc = (lat, lon)
             location_loc = (closest_location['coordinates']['lat'], closest_location['coordinates']['lon'])
 
             closest_location['distance_to_parcel'] = great_circle(this_loc, location_loc).kilometers
 
-        return id_location, closest_location
+        closest_locations.append((id_location, closest_location))
 
-    except ElasticsearchException as e:
-        raise ElasticException('locationS', 'ElasticSearch Error getting closest location', e)
+    return closest_locations
+
+
+@error_managed(default_answer=(None, {}))
+def get_closest_location(lat, lon):
+    closest_locations = get_closest_locations([(lat, lon)])
+
+    return closest_locations[0] if closest_locations else (None, {})
 
 
 def get_all_locations():
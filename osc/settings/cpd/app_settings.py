@@ -48,6 +48,10 @@ ELASTICSEARCH = {
     'use_ssl': False,
     'timeout': '60s',
     'retries': 3,
+    'health_ttl': 30,
+    'bulk_max_bytes': 10 * 1024 * 1024,
+    'bulk_max_retries': 3,
+    'bulk_initial_backoff': 2,
     'cluster_agg': {
         "2": {
             "geohash_grid": {
@@ -102,8 +106,16 @@ INFORIEGO = {
     'index': 'inforiego',
     'daily.mapping': 'info_riego_daily',
     'station.mapping': 'info_riego_station',
+    'rollup.index': 'inforiego_rollup',
+    'rollup.mapping': 'info_riego_rollup',
+    'rollup.batch_size': 20,
+    'nearest.ttl': 60 * 60,
     'user': get_secret(secrets, 'inforiego', 'user'),
-    'passwd': get_secret(secrets, 'inforiego', 'passwd')
+    'passwd': get_secret(secrets, 'inforiego', 'passwd'),
+    'concurrency': 4,
+    'requests_per_second': 2,
+    'queue_size': 8,
+    'watermark.min_check_hours': 12
 }
 
 CADASTRE = {
@@ -114,7 +126,33 @@ CADASTRE = {
     'mapping': 'parcel',
     'zone.for.queries': 'EPSG::25830',
     'query.cadastre.when.bbox': False,
-    'max.query.size': 5000
+    'max.query.size': 5000,
+    'public_info.concurrency': 8,
+    'import.download_workers': 2,
+    # None uses every core
+    'import.parse_workers': None,
+    'import.queue_size': 8,
+    # Parcels are only drawn as vector tiles from this zoom on
+    'tiles.min_zoom': 13,
+    'tiles.extent': 4096,
+    'tiles.buffer': 64,
+    # Douglas-Peucker tolerance, in tile units
+    'tiles.simplify_tolerance': 1,
+    'tiles.max_age': 60 * 60,
+    # bbox queries are answered from cached geohash cells of this precision
+    'cache.cell_precision': 6,
+    # Bucket cells are this many geohash levels above the buckets
+    'cache.bucket_cell_depth': 2,
+    # Larger bboxes are queried directly
+    'cache.max_cells': 64,
+    'cache.timeout': 24 * 60 * 60,
+    # Parcel counts and areas per geohash cell, rebuilt after every import
+    'pyramid.index': 'parcels_pyramid',
+    'pyramid.mapping': 'parcel_cell',
+    'pyramid.max_precision': 8,
+    # Levels of cells aggregated in one search
+    'pyramid.depth': 3,
+    'pyramid.batch_size': 20
 }
 
 ITACYL = {
@@ -122,7 +160,12 @@ ITACYL = {
     'ITACYL_FTP': 'ftp.itacyl.es',
     'SIGPAC_PATH': 'cartografia/05_SIGPAC/2017_ETRS89/'
                    + 'Parcelario_SIGPAC_CyL_Municipios',
-    'SIGPAC_FILE_DBF': 'RECFE.dbf'
+    'SIGPAC_FILE_DBF': 'RECFE.dbf',
+    'SIGPAC_FILE_SHP': 'RECFE.shp',
+    'SIGPAC_ZONE': 'EPSG:25830',
+    'ftp.pool_size': 2,
+    'import.workers': 4,
+    'import.queue_size': 4
 }
 
 WEATHER = {
@@ -131,12 +174,14 @@ WEATHER = {
     'locations.mapping': 'locations',
     'owm_token': get_secret(secrets, 'openweathermap', 'token'),
     'owm_chunk_size': 60,
-    'owm_chunk_time': 60
+    'owm_chunk_time': 60,
+    'nearest.ttl': 60 * 60
 }
 
 SOIL = {
     'index': 'soil',
-    'mapping': 'soil'
+    'mapping': 'soil',
+    'nearest.ttl': 60 * 60
 }
 
 SLACK = {
@@ -145,7 +190,8 @@ SLACK = {
 }
 
 WEB = {
-    'url': 'https://opensmartcountry.com'
+    'url': 'https://opensmartcountry.com',
+    'parcels.page_size': 50
 }
 
 AUX_DIRS = {
@@ -153,7 +199,8 @@ AUX_DIRS = {
     'tmp_dir': '/code/tmp/tmp',
     'log_dir': '/code/tmp/logs',
     'errors_dir': '/code/tmp/errors',
-    'dataframes_dir': '/code/tmp/dataframes'
+    'dataframes_dir': '/code/tmp/dataframes',
+    'cache_dir': '/code/tmp/cache'
 }
 
 for dir_name in AUX_DIRS:
@@ -172,6 +219,22 @@ DATABASES = {
      }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/#database-caching
+# Shared through the database, so the parcel cells invalidated by the
+# importers are invalidated for the web server too. The table is created by
+# the migrations
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'osc_cache',
+        'TIMEOUT': CADASTRE['cache.timeout'],
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000
+        }
+    }
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': True,
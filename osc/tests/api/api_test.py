@@ -1,9 +1,13 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 import json
 from jsonschema import validate
 import mock
 from nose.plugins.attrib import attr
 
+from osc.tests.util.tiles_test import read_message
+from osc.util import tile_bounds
+
 
 class APITest(TestCase):
     base_url = '/'
@@ -94,3 +98,134 @@ class ParcelAPITest(TestCase):
         url = '/parcels/{}/'
         response = self.client.get(url.format(cadastralCode))
         self.assertEqual(response.data, self.parcel_by_nationalCadastralReference_response)
+
+
+    def test_get_parcels_with_invalid_page_token_returns_400(self):
+        response = self.client.get('/parcels/', {'page_token': 'not a token'})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('osc.models.parcel.es.search', return_value=parcel_document_by_nationalCadastralReference_response)
+    def test_get_parcels_page_has_next_page_token(self, mock_es):
+        response = self.client.get('/parcels/', {'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('next_page_token', response.data)
+        self.assertEqual(mock_es.call_args[1]['size'], 2)
+
+
+    def test_get_parcels_with_unknown_profile_returns_400(self):
+        response = self.client.get('/parcels/', {'profile': 'everything'})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('osc.models.parcel.es.search', return_value=parcel_document_by_nationalCadastralReference_response)
+    def test_get_parcel_by_cadastral_code_with_profile_filters_source(self, mock_es):
+        self.client.get('/parcels/37284A00600106/', {'profile': 'summary'})
+        self.assertNotIn('geometry', mock_es.call_args[1]['body']['_source']['includes'])
+
+    @mock.patch('osc.views.rest_api.getParcels', return_value={})
+    @mock.patch('osc.views.rest_api.parcel_service.obtain_parcels_by_bbox', return_value=[])
+    def test_get_parcels_by_bbox_default_to_the_same_profile(self, m_obtain, m_get_parcels):
+        self.client.get('/cadastral/parcel/', {'bbox': '40.43,-5.76,40.44,-5.74'})
+        self.client.get('/parcels/', {'bbox': '-5.76,40.43,-5.74,40.44'})
+        self.assertEqual(m_obtain.call_args[0][-1], 'map')
+        self.assertEqual(m_get_parcels.call_args[1]['profile'], 'map')
+
+
+
+@mock.patch('osc.views.rest_api.users_service.get_parcels', return_value=[])
+class OwnedParcelsAPITest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('google_test', 'test@example.com', 'test'))
+
+    def test_owned_parcels_are_not_paginated_by_default(self, m_get_parcels):
+        response = self.client.get('/owned-parcels/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(m_get_parcels.call_args[1], {'page': 1, 'page_size': None})
+
+    def test_owned_parcels_page(self, m_get_parcels):
+        self.client.get('/owned-parcels/', {'page': 2, 'page_size': 10})
+
+        self.assertEqual(m_get_parcels.call_args[1], {'page': 2, 'page_size': 10})
+
+    def test_invalid_page_returns_400(self, m_get_parcels):
+        for params in [{'page': 'abc'}, {'page': 0}, {'page_size': 0}]:
+            response = self.client.get('/owned-parcels/', params)
+            self.assertEqual(response.status_code, 400)
+
+        m_get_parcels.assert_not_called()
+
+    def test_invalid_user_parcels_page_returns_400(self, m_get_parcels):
+        response = self.client.get('/userparcel/query/', {'page_size': -1})
+
+        self.assertEqual(response.status_code, 400)
+        m_get_parcels.assert_not_called()
+
+
+class ParcelTileAPITest(TestCase):
+
+    url = '/parcels/tiles/{}/{}/{}.mvt'
+
+    def parcels_response(self, z, x, y):
+        west, south, east, north = tile_bounds(z, x, y)
+        width, height = east - west, north - south
+        ring = [[west + width * 0.25, south + height * 0.25],
+                [west + width * 0.75, south + height * 0.25],
+                [west + width * 0.75, south + height * 0.75],
+                [west + width * 0.25, south + height * 0.75],
+                [west + width * 0.25, south + height * 0.25]]
+        return {'hits': {'hits': [{'_source': {
+            'geometry': {'type': 'polygon', 'coordinates': [ring]},
+            'properties': {'nationalCadastralReference': '37284A00600106',
+                           'areaValue': 1250,
+                           'sigpacData': {'USO_SIGPAC': 'TA'}}}}]}}
+
+    def test_get_tile_returns_vector_tile(self):
+        with mock.patch('osc.services.cadastre.es.search',
+                        return_value=self.parcels_response(14, 7934, 6158)) as mock_es:
+            response = self.client.get(self.url.format(14, 7934, 6158))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['content-type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('max-age=3600', response['cache-control'])
+        self.assertEqual(mock_es.call_args[1]['body']['_source'],
+                         ['geometry',
+                          'properties.nationalCadastralReference',
+                          'properties.areaValue',
+                          'properties.sigpacData.USO_SIGPAC'])
+
+        layer = read_message(read_message(response.content)[3][0])
+        self.assertEqual(layer[1], ['parcels'])
+        self.assertEqual(len(layer[2]), 1)
+        self.assertIn('37284A00600106', [read_message(value)[1][0]
+                                         for value in layer[4]
+                                         if 1 in read_message(value)])
+
+    @mock.patch('osc.services.cadastre.max_elastic_query_size', 1)
+    def test_get_tile_reads_every_page_of_parcels(self):
+        first_page = self.parcels_response(14, 7934, 6158)
+        first_page['hits']['hits'][0]['sort'] = ['37284A00600106']
+        second_page = self.parcels_response(14, 7934, 6158)
+        second_page['hits']['hits'][0]['sort'] = ['37284A00600107']
+
+        with mock.patch('osc.services.cadastre.es.search',
+                        side_effect=[first_page, second_page, {'hits': {'hits': []}}]) as mock_es:
+            response = self.client.get(self.url.format(14, 7934, 6158))
+
+        self.assertEqual(mock_es.call_count, 3)
+        self.assertEqual(mock_es.call_args[1]['body']['search_after'], ['37284A00600107'])
+        layer = read_message(read_message(response.content)[3][0])
+        self.assertEqual(len(layer[2]), 2)
+
+    @mock.patch('osc.services.cadastre.es.search')
+    def test_get_tile_below_min_zoom_is_empty(self, mock_es):
+        response = self.client.get(self.url.format(10, 495, 384))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        mock_es.assert_not_called()
+
+    def test_get_tile_out_of_range_returns_404(self):
+        response = self.client.get(self.url.format(14, 16384, 0))
+
+        self.assertEqual(response.status_code, 404)
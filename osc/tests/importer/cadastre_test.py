@@ -4,15 +4,52 @@ from django.test import TestCase
 import json
 import mock
 from nose.plugins.attrib import attr
+import os
+import shutil
+import tempfile
+import time
 from unittest import skip
+import zipfile
 
+from django.utils import timezone
+from elasticsearch.serializer import JSONSerializer
+
+from osc.exceptions import CadastreException
 import osc.importer.cadastre as cadastre
+from osc.models import ImportCheckpoint
+from osc.services import get_feed_validators, save_feed_validators
+from osc.util import CachedDownload
 
 
 def mock_update_cadastral_province():
     return None
 
 
+def dying_parse_stage(tasks, results, chunk_size):
+    tasks.get()
+    os._exit(1)
+
+
+download_stage = cadastre.download_stage
+
+
+def late_download_stage(urls, tasks, results, *args):
+    """Sends the downloaded messages after the parsers had time to send theirs"""
+    downloaded = []
+
+    class LateResults(object):
+        def put(self, message):
+            if message[0] == cadastre.PIPELINE_DOWNLOADED:
+                downloaded.append(message)
+            else:
+                results.put(message)
+
+    download_stage(urls, tasks, LateResults(), *args)
+    time.sleep(0.5)
+    for message in downloaded:
+        results.put(message)
+
+
 class mocked_feed(object):
     # TODO(teanocrata): teanocrata - fixture returns dict but code accesses
     # entries like attribute and I dont not how to do this without wrapper
@@ -52,3 +89,241 @@ class InspireImporterTest(TestCase):
         cadastre.update_cadastre_information()
         m_scan_parcels.assert_called_once()
         m_scan_parcels.assert_called_with(m_update_parcel_by_cadastral_code)
+
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    def test_store_parcels_from_gml_streams_parcels_in_chunks(
+            self,
+            m_store_changed_parcels):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+
+        with open(gml_file) as xml_file:
+            cadastre.store_parcels_from_gml(xml_file, chunk_size=1)
+
+        self.assertEqual(m_store_changed_parcels.call_count, 2)
+        parcels = [call[0][0][0] for call in m_store_changed_parcels.call_args_list]
+        self.assertEqual([parcel['properties']['nationalCadastralReference']
+                          for parcel in parcels],
+                         ['37284A00600114', '37284A00600106'])
+        self.assertEqual(parcels[0]['properties']['areaValue'], 10000.0)
+        self.assertEqual(len(parcels[0]['geometry']['coordinates'][0]), 5)
+        self.assertEqual(parcels[0]['bbox']['type'], 'envelope')
+
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_parses_members_in_worker_processes(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+        tmp_dir = tempfile.mkdtemp()
+
+        def download_zip(url, etag, last_modified, content_hash):
+            zip_path = os.path.join(tmp_dir, url.split('/')[-1])
+            with zipfile.ZipFile(zip_path, 'w') as z:
+                z.write(gml_file, 'A.ES.SDGC.CP.37284.cadastralparcel.gml')
+                z.write(gml_file, 'B.ES.SDGC.CP.37284.cadastralparcel.gml')
+            return CachedDownload(zip_path, '"v1"', None, 'hash', True)
+
+        m_download_zip.side_effect = download_zip
+        m_store_changed_parcels.return_value = mock.Mock()
+
+        try:
+            errors = cadastre.import_zip_urls(['http://inspire/37284.zip',
+                                               'http://inspire/37285.zip'],
+                                              download_workers=2,
+                                              parse_workers=2,
+                                              chunk_size=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(errors, {'http://inspire/37284.zip': None,
+                                  'http://inspire/37285.zip': None})
+        # 2 zips x 2 members x 2 parcels, in chunks of 1 parcel
+        self.assertEqual(m_store_changed_parcels.call_count, 8)
+        m_connections.close_all.assert_called_once()
+        self.assertEqual(get_feed_validators('http://inspire/37284.zip'),
+                         ('"v1"', None, 'hash'))
+
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_skips_zips_not_modified(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        m_download_zip.return_value = CachedDownload('/cache/37284.zip',
+                                                     '"v1"', None, 'hash', False)
+
+        errors = cadastre.import_zip_urls(['http://inspire/37284.zip'],
+                                          parse_workers=1)
+
+        self.assertEqual(errors, {'http://inspire/37284.zip': None})
+        m_store_changed_parcels.assert_not_called()
+
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_resumes_from_checkpoints(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+        url = 'http://inspire/37284.zip'
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284.zip')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.write(gml_file, 'A.ES.SDGC.CP.37284.cadastralparcel.gml')
+            z.write(gml_file, 'B.ES.SDGC.CP.37284.cadastralparcel.gml')
+
+        for member, offset, finished in [('A.ES.SDGC.CP.37284.cadastralparcel.gml', 2, True),
+                                         ('B.ES.SDGC.CP.37284.cadastralparcel.gml', 1, False)]:
+            ImportCheckpoint(url=url, content_hash='hash', member=member, offset=offset,
+                             finished=finished, update_date=timezone.now()).save()
+        m_download_zip.return_value = CachedDownload(zip_path, '"v1"', None, 'hash', False)
+        m_store_changed_parcels.return_value = mock.Mock()
+
+        try:
+            errors = cadastre.import_zip_urls([url], parse_workers=1, chunk_size=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(errors, {url: None})
+        # Only the second parcel of the unfinished member is parsed again
+        m_store_changed_parcels.assert_called_once()
+        parcels = m_store_changed_parcels.call_args[0][0]
+        self.assertEqual(parcels[0]['properties']['nationalCadastralReference'],
+                         '37284A00600106')
+        self.assertFalse(ImportCheckpoint.objects.filter(url=url).exists())
+
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.services.cadastre.invalidate_cached_parcels')
+    @mock.patch('osc.services.cadastre.get_parcel_content_hashes', return_value={})
+    @mock.patch('osc.util.elastic.es')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_keeps_checkpoint_of_failed_chunks(
+            self,
+            m_download_zip,
+            m_es,
+            m_get_parcel_content_hashes,
+            m_invalidate_cached_parcels,
+            m_connections):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+        url = 'http://inspire/37284.zip'
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284.zip')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.write(gml_file, 'A.ES.SDGC.CP.37284.cadastralparcel.gml')
+
+        m_download_zip.return_value = CachedDownload(zip_path, '"v1"', None, 'hash', True)
+        m_es.transport.serializer = JSONSerializer()
+        m_es.cluster.health.return_value = {'status': 'green'}
+        # Elastic rejects the parcel of the second chunk
+        m_es.bulk.side_effect = [{'items': [{'update': {'status': 200}}]},
+                                 {'items': [{'update': {'status': 400,
+                                                        'error': 'mapper_parsing_exception'}}]}]
+
+        try:
+            errors = cadastre.import_zip_urls([url], parse_workers=1, chunk_size=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertIsNotNone(errors[url])
+        checkpoint = ImportCheckpoint.objects.get(url=url)
+        self.assertEqual(checkpoint.offset, 1)
+        self.assertFalse(checkpoint.finished)
+
+    @mock.patch('osc.importer.cadastre.PIPELINE_POLL_SECONDS', 0.1)
+    @mock.patch('osc.importer.cadastre.parse_stage', dying_parse_stage)
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_reports_dead_parsers(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+        url = 'http://inspire/37284.zip'
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284.zip')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.write(gml_file, 'A.ES.SDGC.CP.37284.cadastralparcel.gml')
+        m_download_zip.return_value = CachedDownload(zip_path, '"v1"', None, 'hash', True)
+
+        try:
+            errors = cadastre.import_zip_urls([url], parse_workers=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertIsNotNone(errors[url])
+        m_store_changed_parcels.assert_not_called()
+        self.assertFalse(ImportCheckpoint.objects.get(url=url).finished)
+
+    @mock.patch('osc.importer.cadastre.download_stage', late_download_stage)
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip')
+    def test_import_zip_urls_checkpoints_parcels_parsed_before_download_message(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        gml_file = 'osc/tests/importer/fixtures/' \
+                   'A.ES.SDGC.CP.37284.cadastralparcel.gml'
+        url = 'http://inspire/37284.zip'
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284.zip')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.write(gml_file, 'A.ES.SDGC.CP.37284.cadastralparcel.gml')
+
+        m_download_zip.return_value = CachedDownload(zip_path, '"v1"', None, 'hash', True)
+        m_store_changed_parcels.side_effect = [mock.Mock(), None]
+
+        try:
+            errors = cadastre.import_zip_urls([url], parse_workers=1, chunk_size=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertIsNotNone(errors[url])
+        self.assertEqual(ImportCheckpoint.objects.get(url=url).offset, 1)
+
+    @mock.patch('osc.importer.cadastre.update_catastral_municipalities')
+    @mock.patch('osc.importer.cadastre.feedparser')
+    def test_province_not_modified_is_not_updated(
+            self,
+            m_feedparser,
+            m_update_catastral_municipalities):
+        province = mock.Mock(link='http://inspire/37.xml', title='Salamanca')
+        m_feedparser.parse.return_value = mock.Mock(status=304, entries=[])
+        save_feed_validators(province.link, '"v1"', 'Mon, 01 May 2017')
+
+        self.assertTrue(cadastre.update_cadastral_province(province))
+
+        m_feedparser.parse.assert_called_with(province.link,
+                                              etag='"v1"',
+                                              modified='Mon, 01 May 2017')
+        m_update_catastral_municipalities.assert_not_called()
+
+    @mock.patch('osc.importer.cadastre.connections')
+    @mock.patch('osc.importer.cadastre.store_changed_parcels')
+    @mock.patch('osc.importer.cadastre.download_zip',
+                side_effect=CadastreException('Error connecting'))
+    def test_import_zip_urls_reports_failed_downloads(
+            self,
+            m_download_zip,
+            m_store_changed_parcels,
+            m_connections):
+        errors = cadastre.import_zip_urls(['http://inspire/37284.zip'],
+                                          parse_workers=1)
+
+        self.assertIsNotNone(errors['http://inspire/37284.zip'])
+        m_store_changed_parcels.assert_not_called()
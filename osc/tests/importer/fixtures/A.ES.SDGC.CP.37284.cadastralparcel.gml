@@ -0,0 +1,90 @@
+<?xml version="1.0" encoding="utf-8"?>
+<!--Parcelas Catastrales de 37284 SANCHOTELLO-->
+<gml:FeatureCollection gml:id="ES.SDGC.CP" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:gml="http://www.opengis.net/gml/3.2" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:cp="urn:x-inspire:specification:gmlas:CadastralParcels:3.0" xmlns:base="urn:x-inspire:specification:gmlas:BaseTypes:3.2" xsi:schemaLocation="urn:x-inspire:specification:gmlas:CadastralParcels:3.0 http://inspire.ec.europa.eu/schemas/cp/3.0/CadastralParcels.xsd">
+<gml:featureMember>
+<cp:CadastralParcel gml:id="ES.SDGC.CP.37284A00600114">
+<cp:areaValue uom="m2">10000</cp:areaValue>
+<cp:beginLifespanVersion>2009-09-21T00:00:00</cp:beginLifespanVersion>
+<cp:endLifespanVersion xsi:nil="true" nilReason="other:unpopulated"></cp:endLifespanVersion>
+<cp:geometry>
+<gml:MultiSurface gml:id="MultiSurface_ES.SDGC.CP.37284A00600114" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:surfaceMember>
+<gml:Surface gml:id="Surface_ES.SDGC.CP.37284A00600114.1" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:patches>
+<gml:PolygonPatch>
+<gml:exterior>
+<gml:LinearRing>
+<gml:posList srsDimension="2" count="5">270100.0 4500100.0 270200.0 4500100.0 270200.0 4500200.0 270100.0 4500200.0 270100.0 4500100.0</gml:posList>
+</gml:LinearRing>
+</gml:exterior>
+</gml:PolygonPatch>
+</gml:patches>
+</gml:Surface>
+</gml:surfaceMember>
+</gml:MultiSurface>
+</cp:geometry>
+<cp:inspireId>
+<Identifier xmlns="urn:x-inspire:specification:gmlas:BaseTypes:3.2">
+<localId>37284A00600114</localId>
+<namespace>ES.SDGC.CP</namespace>
+</Identifier>
+</cp:inspireId>
+<cp:label>00114</cp:label>
+<cp:nationalCadastralReference>37284A00600114</cp:nationalCadastralReference>
+<cp:referencePoint>
+<gml:Point gml:id="ReferencePoint_ES.SDGC.CP.37284A00600114" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:pos>270150.0 4500150.0</gml:pos>
+</gml:Point>
+</cp:referencePoint>
+<gml:boundedBy>
+<gml:Envelope srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:lowerCorner>270100.0 4500100.0</gml:lowerCorner>
+<gml:upperCorner>270200.0 4500200.0</gml:upperCorner>
+</gml:Envelope>
+</gml:boundedBy>
+</cp:CadastralParcel>
+</gml:featureMember>
+<gml:featureMember>
+<cp:CadastralParcel gml:id="ES.SDGC.CP.37284A00600106">
+<cp:areaValue uom="m2">10001</cp:areaValue>
+<cp:beginLifespanVersion>2009-09-21T00:00:00</cp:beginLifespanVersion>
+<cp:endLifespanVersion xsi:nil="true" nilReason="other:unpopulated"></cp:endLifespanVersion>
+<cp:geometry>
+<gml:MultiSurface gml:id="MultiSurface_ES.SDGC.CP.37284A00600106" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:surfaceMember>
+<gml:Surface gml:id="Surface_ES.SDGC.CP.37284A00600106.1" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:patches>
+<gml:PolygonPatch>
+<gml:exterior>
+<gml:LinearRing>
+<gml:posList srsDimension="2" count="5">270300.0 4500300.0 270400.0 4500300.0 270400.0 4500400.0 270300.0 4500400.0 270300.0 4500300.0</gml:posList>
+</gml:LinearRing>
+</gml:exterior>
+</gml:PolygonPatch>
+</gml:patches>
+</gml:Surface>
+</gml:surfaceMember>
+</gml:MultiSurface>
+</cp:geometry>
+<cp:inspireId>
+<Identifier xmlns="urn:x-inspire:specification:gmlas:BaseTypes:3.2">
+<localId>37284A00600106</localId>
+<namespace>ES.SDGC.CP</namespace>
+</Identifier>
+</cp:inspireId>
+<cp:label>00106</cp:label>
+<cp:nationalCadastralReference>37284A00600106</cp:nationalCadastralReference>
+<cp:referencePoint>
+<gml:Point gml:id="ReferencePoint_ES.SDGC.CP.37284A00600106" srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:pos>270350.0 4500350.0</gml:pos>
+</gml:Point>
+</cp:referencePoint>
+<gml:boundedBy>
+<gml:Envelope srsName="urn:ogc:def:crs:EPSG::25830">
+<gml:lowerCorner>270300.0 4500300.0</gml:lowerCorner>
+<gml:upperCorner>270400.0 4500400.0</gml:upperCorner>
+</gml:Envelope>
+</gml:boundedBy>
+</cp:CadastralParcel>
+</gml:featureMember>
+</gml:FeatureCollection>
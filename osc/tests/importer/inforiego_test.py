@@ -0,0 +1,182 @@
+# coding=utf-8
+
+from datetime import date, datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+import osc.importer.inforiego as inforiego
+from osc.models import StationWatermark
+
+
+def daily_response():
+    return [{u'FECHA': u'01/02/2017',
+             u'IDPROVINCIA': u'37',
+             u'IDESTACION': u'4',
+             u'HORMINHUMMAX': u'2400',
+             u'HORMINHUMMIN': u'530',
+             u'HORMINTEMPMAX': None,
+             u'HORMINTEMPMIN': u'1215',
+             u'HORMINVELMAX': u'5'},
+            {u'FECHA': u'02/02/2017',
+             u'IDPROVINCIA': u'37',
+             u'IDESTACION': u'4',
+             u'HORMINHUMMAX': u'130',
+             u'HORMINHUMMIN': u'2400',
+             u'HORMINTEMPMAX': u'1500',
+             u'HORMINTEMPMIN': u'0',
+             u'HORMINVELMAX': None}]
+
+
+def hourly_response():
+    return [{u'FECHA': u'01/02/2017',
+             u'HORAMIN': hour,
+             u'IDPROVINCIA': u'37',
+             u'IDESTACION': u'4'}
+            for hour in [u'100', u'200']]
+
+
+class InforiegoImporterTest(TestCase):
+
+    def test_daily_actions_normalize_hours_and_build_ids(self):
+        lat_lon = {'lat': 40.9, 'lon': -5.6}
+        actions = list(inforiego.daily_actions(daily_response(), lat_lon, 800))
+
+        self.assertEqual([action['_id'] for action in actions],
+                         [u'01_02_2017_37_4', u'02_02_2017_37_4'])
+        first = actions[0]['_source']
+        self.assertEqual(first['HORMINHUMMAX'], u'0000')
+        self.assertEqual(first['HORMINHUMMIN'], u'0530')
+        self.assertEqual(first['HORMINTEMPMAX'], None)
+        self.assertEqual(first['HORMINVELMAX'], u'0005')
+        self.assertEqual(first['lat_lon'], lat_lon)
+        self.assertEqual(first['altitud'], 800)
+
+    @mock.patch('osc.importer.inforiego.elastic_bulk')
+    @mock.patch('osc.importer.inforiego.get_inforiego_daily_year')
+    def test_insert_hourly_recent_stores_every_hour_of_a_day(
+            self,
+            m_get_inforiego_daily_year,
+            m_elastic_bulk):
+        m_get_inforiego_daily_year.return_value = hourly_response()
+        stored = []
+        m_elastic_bulk.side_effect = \
+            lambda process_name, actions: mock.Mock(success=stored.extend(actions) or len(stored))
+
+        inforiego.insert_inforiego_hourly_recent('37', '4',
+                                                 {'lat': 40.9, 'lon': -5.6},
+                                                 800,
+                                                 '01/02/2017')
+
+        self.assertEqual(m_elastic_bulk.call_args[0][0], 'STORE_INFORIEGO_HOURLY')
+        self.assertEqual([action['_id'] for action in stored],
+                         [u'01_02_2017_0100_37_4', u'01_02_2017_0200_37_4'])
+
+    @mock.patch('osc.importer.inforiego.elastic_bulk')
+    @mock.patch('osc.importer.inforiego.get_inforiego_daily_year')
+    def test_insert_daily_years_stores_each_year_in_one_bulk(
+            self,
+            m_get_inforiego_daily_year,
+            m_elastic_bulk):
+        m_get_inforiego_daily_year.side_effect = \
+            lambda *args, **kwargs: daily_response()
+        m_elastic_bulk.side_effect = \
+            lambda process_name, actions: mock.Mock(success=len(list(actions)))
+
+        inforiego.insert_inforiego_daily_years('37', '4', [2016, 2017],
+                                               {'lat': 40.9, 'lon': -5.6},
+                                               800)
+
+        self.assertEqual(m_elastic_bulk.call_count, 2)
+
+    @mock.patch('osc.importer.inforiego.get_inforiego_daily_year')
+    def test_fetch_inforiego_daily_downloads_every_station_year(
+            self,
+            m_get_inforiego_daily_year):
+        m_get_inforiego_daily_year.side_effect = \
+            lambda provincia, estacion, **kwargs: [estacion, kwargs['anno']]
+        stations = [{'IDPROVINCIA': '37', 'IDESTACION': str(i)}
+                    for i in range(5)]
+        tasks = [inforiego.StationYear(station, year, None)
+                 for station in stations
+                 for year in [2016, 2017]]
+
+        results = list(inforiego.fetch_inforiego_daily(tasks,
+                                                       concurrency=3,
+                                                       requests_per_second=1000,
+                                                       queue_size=2))
+
+        self.assertEqual(len(results), len(tasks))
+        for task, documents, error in results:
+            self.assertIsNone(error)
+            self.assertEqual(documents,
+                             [task.station['IDESTACION'], task.year])
+
+    @mock.patch('osc.importer.inforiego.get_inforiego_daily_year',
+                side_effect=ValueError('No JSON object could be decoded'))
+    def test_fetch_inforiego_daily_reports_download_errors(
+            self,
+            m_get_inforiego_daily_year):
+        tasks = [inforiego.StationYear({'IDPROVINCIA': '37',
+                                        'IDESTACION': '4'}, 2017, None)]
+
+        results = list(inforiego.fetch_inforiego_daily(tasks))
+
+        self.assertIsInstance(results[0][2], ValueError)
+
+
+class InforiegoWatermarkTest(TestCase):
+
+    def setUp(self):
+        self.stations = [{'IDPROVINCIA': '37', 'IDESTACION': '4',
+                          'lat_lon': {'lat': 40.9, 'lon': -5.6}, 'ALTITUD': 800},
+                         {'IDPROVINCIA': '37', 'IDESTACION': '5',
+                          'lat_lon': {'lat': 41.0, 'lon': -5.5}, 'ALTITUD': 790}]
+
+    @mock.patch('osc.importer.inforiego.rollup_climate_measures')
+    @mock.patch('osc.importer.inforiego.store_daily_documents')
+    @mock.patch('osc.importer.inforiego.fetch_inforiego_daily')
+    @mock.patch('osc.importer.inforiego.get_stations_from_elastic')
+    def test_watermark_only_advances_for_stored_stations(
+            self,
+            m_get_stations_from_elastic,
+            m_fetch_inforiego_daily,
+            m_store_daily_documents,
+            m_rollup_climate_measures):
+        m_get_stations_from_elastic.return_value = self.stations
+        m_fetch_inforiego_daily.side_effect = lambda tasks: [
+            (tasks[0], daily_response(), None),
+            (tasks[1], None, ValueError('No JSON object could be decoded'))]
+
+        inforiego.update_all_stations_inforiego_daily('01/01/2017')
+
+        tasks = m_fetch_inforiego_daily.call_args[0][0]
+        self.assertEqual([task.fecha_ultima_modificacion for task in tasks],
+                         ['01/01/2017', '01/01/2017'])
+        watermarks = StationWatermark.objects.all()
+        self.assertEqual(len(watermarks), 1)
+        self.assertEqual(watermarks[0].station_id, '4')
+        self.assertEqual(watermarks[0].last_date, date(2017, 2, 2))
+        m_rollup_climate_measures.assert_called_once_with({('37', '4', 2017)})
+
+    @mock.patch('osc.importer.inforiego.fetch_inforiego_daily', return_value=[])
+    @mock.patch('osc.importer.inforiego.get_stations_from_elastic')
+    def test_stations_are_fetched_since_their_watermark(
+            self,
+            m_get_stations_from_elastic,
+            m_fetch_inforiego_daily):
+        m_get_stations_from_elastic.return_value = self.stations
+        now = timezone.now()
+        StationWatermark(province_id='37', station_id='4',
+                         update_date=now, date_checked=now).save()
+        StationWatermark(province_id='37', station_id='5',
+                         update_date=datetime(2017, 3, 10, tzinfo=timezone.utc),
+                         date_checked=now - timedelta(days=2)).save()
+
+        inforiego.update_all_stations_inforiego_daily('01/01/2017')
+
+        tasks = m_fetch_inforiego_daily.call_args[0][0]
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0].station['IDESTACION'], '5')
+        self.assertEqual(tasks[0].fecha_ultima_modificacion, '09/03/2017')
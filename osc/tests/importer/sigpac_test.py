@@ -4,9 +4,16 @@ from django.test import override_settings
 from django.test import TestCase
 import mock
 import os
+import shapefile
+import shutil
+from StringIO import StringIO
+import struct
+import tempfile
+import zipfile
 
 from osc.exceptions import ItacylException
 import osc.importer.sigpac as sigpac
+from osc.util import downloaded_file
 
 
 class SigpacImporterTest(TestCase):
@@ -33,52 +40,256 @@ class SigpacImporterTest(TestCase):
     @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
     @mock.patch('osc.importer.sigpac.ITACYL_FTP',
                 '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
-    def test_wont_fail_when_updateMunicipality_from_mucipality_zip_url(self):
-        province = '05_Avila'
-        municipality = '05271_Comunidad-Arenas-San-Pedro-Candeleda.zip'
-        sigpac.updateMunicipality(province, municipality)
-        self.assertTrue(True, "shouldn't throw exceptions")
+    @mock.patch('osc.importer.sigpac.updateParcels',
+                side_effect=lambda parcels: list(parcels))
+    def test_wont_fail_when_storeMunicipality_from_mucipality_zip_url(self,
+                                                                      m_updateParcels):
+        task = ('05_Avila', '05271_Comunidad-Arenas-San-Pedro-Candeleda.zip')
+        self.assertTrue(sigpac.storeMunicipality(task, sigpac.downloadMunicipality(*task), None))
 
     @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
     @mock.patch('osc.importer.sigpac.ITACYL_FTP',
                 '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
-    def test_wont_fail_when_updateMunicipality_with_inner_folder(self):
-        province = '37_Salamanca'
-        municipality = '37_901.zip'
-        sigpac.updateMunicipality(province, municipality)
-        self.assertTrue(True, "shouldn't throw exceptions")
+    @mock.patch('osc.importer.sigpac.updateParcels',
+                side_effect=lambda parcels: list(parcels))
+    def test_wont_fail_when_storeMunicipality_with_inner_folder(self,
+                                                                m_updateParcels):
+        task = ('37_Salamanca', '37_901.zip')
+        self.assertTrue(sigpac.storeMunicipality(task, sigpac.downloadMunicipality(*task), None))
 
     @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
     @mock.patch('osc.importer.sigpac.ITACYL_FTP',
                 '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
-    @mock.patch('osc.importer.sigpac.updateParcel')
-    def test_updateMunicipality_calls_updateParcel(self,
-                                                   m_updateParcel):
-        province = '37_Salamanca'
+    @mock.patch('osc.importer.sigpac.update_parcels',
+                side_effect=ItacylException('Error updating parcel'))
+    def test_storeMunicipality_fails_when_updateParcels_fails(self,
+                                                              m_update_parcels):
+        task = ('37_Salamanca', '37284_Sanchotello.zip')
+        zip_path = sigpac.downloadMunicipality(*task)
+
+        self.assertFalse(sigpac.storeMunicipality(task, zip_path, None))
+        self.assertFalse(os.path.exists(zip_path))
+
+    @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
+    @mock.patch('osc.importer.sigpac.ITACYL_FTP',
+                '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
+    @mock.patch('osc.importer.sigpac.updateParcels')
+    def test_storeMunicipality_calls_updateParcels(self,
+                                                   m_updateParcels):
+        task = ('37_Salamanca', '37284_Sanchotello.zip')
+        parcels = []
+        m_updateParcels.side_effect = parcels.extend
+        sigpac.storeMunicipality(task, sigpac.downloadMunicipality(*task), None)
+        m_updateParcels.assert_called_once()
+        self.assertEqual(len(parcels), 4, 'Updates 4 parcels of 10 recintos')
+        properties = parcels[-1]['doc']['properties']
+        self.assertEqual(properties['nationalCadastralReference'], '37284A00100004')
+        self.assertEqual(properties['sigpacData'],
+                         {'ZONA': 0,
+                          'PROVINCIA': 37,
+                          'USO_SIGPAC': 'IM',
+                          'RECINTO': 2,
+                          'PERIMETRO': 50.39169,
+                          'DN_OID': 895882,
+                          'PARCELA': 4,
+                          'POLIGONO': 1,
+                          'COEF_REGAD': 0,
+                          'SUPERFICIE': 121.32291,
+                          'AGREGADO': 0,
+                          'MUNICIPIO': 284})
+        self.assertEqual([recinto['RECINTO'] for recinto in properties['sigpacRecintos']],
+                         [1, 2])
+        self.assertEqual(properties['sigpacUses'],
+                         [{'USO_SIGPAC': 'PS', 'SUPERFICIE': 5889.74006, 'numRecintos': 1},
+                          {'USO_SIGPAC': 'IM', 'SUPERFICIE': 121.32291, 'numRecintos': 1}])
+
+    def test_iterRecords_reads_recinto_geometries(self):
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284_Sanchotello.zip')
+
+        writer = shapefile.Writer(shapefile.POLYGON)
+        for name, field_type, size, decimals in [('PROVINCIA', 'N', 2, 0),
+                                                 ('MUNICIPIO', 'N', 3, 0),
+                                                 ('POLIGONO', 'N', 3, 0),
+                                                 ('PARCELA', 'N', 5, 0),
+                                                 ('RECINTO', 'N', 3, 0),
+                                                 ('SUPERFICIE', 'N', 11, 5),
+                                                 ('USO_SIGPAC', 'C', 2, 0)]:
+            writer.field(name, field_type, size, decimals)
+        # Clockwise outer ring with a counterclockwise hole
+        writer.poly(parts=[[[280000, 4500000], [280000, 4500100],
+                            [280100, 4500100], [280100, 4500000],
+                            [280000, 4500000]],
+                           [[280010, 4500010], [280020, 4500010],
+                            [280020, 4500020], [280010, 4500010]]])
+        writer.record(37, 284, 1, 4, 1, 9950.0, 'TA')
+        writer.null()
+        writer.record(37, 284, 1, 4, 2, 50.0, 'IM')
+
+        shp, shx, dbf = StringIO(), StringIO(), StringIO()
+        writer.saveShp(shp)
+        writer.saveShx(shx)
+        writer.saveDbf(dbf)
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.writestr('37_284/RECFE.shp', shp.getvalue())
+            z.writestr('37_284/RECFE.dbf', dbf.getvalue())
+
+        try:
+            records = list(sigpac.iterRecords(zip_path, '37284_Sanchotello.zip'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(len(records), 2)
+        geometry = records[0].geometry
+        self.assertEqual(geometry['type'], 'Polygon')
+        self.assertEqual(len(geometry['coordinates']), 2)
+        lon, lat = geometry['coordinates'][0][0]
+        self.assertAlmostEqual(lon, -5.6, delta=0.1)
+        self.assertAlmostEqual(lat, 40.6, delta=0.1)
+        self.assertIsNone(records[1].geometry)
+
+        parcel = next(sigpac.createParcelDocuments(records))
+        properties = parcel['doc']['properties']
+        self.assertEqual(properties['sigpacRecintos'][0]['geometry'], geometry)
+        self.assertNotIn('geometry', properties['sigpacRecintos'][1])
+        self.assertEqual([use['USO_SIGPAC'] for use in properties['sigpacUses']],
+                         ['TA', 'IM'])
+
+    def test_iterRecords_skips_deleted_records_with_their_shapes(self):
+        tmp_dir = tempfile.mkdtemp()
+        zip_path = os.path.join(tmp_dir, '37284_Sanchotello.zip')
+
+        writer = shapefile.Writer(shapefile.POLYGON)
+        for name, field_type, size, decimals in [('PROVINCIA', 'N', 2, 0),
+                                                 ('MUNICIPIO', 'N', 3, 0),
+                                                 ('POLIGONO', 'N', 3, 0),
+                                                 ('PARCELA', 'N', 5, 0),
+                                                 ('RECINTO', 'N', 3, 0)]:
+            writer.field(name, field_type, size, decimals)
+        for recinto, x in [(1, 280000), (2, 281000), (3, 282000)]:
+            writer.poly(parts=[[[x, 4500000], [x, 4500100], [x + 100, 4500100],
+                                [x + 100, 4500000], [x, 4500000]]])
+            writer.record(37, 284, 1, 4, recinto)
+
+        shp, dbf = StringIO(), StringIO()
+        writer.saveShp(shp)
+        writer.saveDbf(dbf)
+        # Deletion flag of the second record
+        data = bytearray(dbf.getvalue())
+        header_length, record_length = struct.unpack('<HH', bytes(data[8:12]))
+        data[header_length + record_length] = ord('*')
+        with zipfile.ZipFile(zip_path, 'w') as z:
+            z.writestr('37_284/RECFE.shp', shp.getvalue())
+            z.writestr('37_284/RECFE.dbf', bytes(data))
+
+        try:
+            records = list(sigpac.iterRecords(zip_path, '37284_Sanchotello.zip'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual([record.RECINTO for record in records], [1, 3])
+        third = sigpac.shapeGeometry(shapefile.Reader(shp=StringIO(shp.getvalue())).shape(2))
+        self.assertEqual(records[1].geometry, third)
+
+    def test_createParcelDocuments_yields_each_parcel_once_read(self):
+        def records():
+            yield [895882, 121.3, 50.3, 37, 284, 0, 0, 1, 4, 1, 0, 'PS']
+            yield [895883, 12.3, 5.3, 37, 284, 0, 0, 1, 4, 2, 0, 'IM']
+            yield [895884, 80.1, 40.2, 37, 284, 0, 0, 1, 5, 1, 0, 'TA']
+            raise AssertionError('Records read beyond the next parcel')
+
+        parcel = next(sigpac.createParcelDocuments(records()))
+
+        properties = parcel['doc']['properties']
+        self.assertEqual(properties['nationalCadastralReference'], '37284A00100004')
+        self.assertEqual(len(properties['sigpacRecintos']), 2)
+
+    @mock.patch('osc.importer.sigpac.update_parcels')
+    def test_updateParcels_sends_one_bulk_request(self, m_update_parcels):
+        m_update_parcels.return_value = mock.Mock(failed=0)
+        parcels = list(sigpac.createParcelDocuments(
+            [[895882, 121.3, 50.3, 37, 284, 0, 0, 1, 4, 1, 0, 'PS'],
+             [895883, 12.3, 5.3, 37, 284, 0, 0, 1, 4, 2, 0, 'IM']]))
+
+        sigpac.updateParcels(parcels)
+
+        m_update_parcels.assert_called_once_with(parcels, raise_on_error=False)
+        self.assertEqual(len(parcels), 1)
+        self.assertEqual(parcels[0]['doc']['properties']['sigpacData']['RECINTO'], 2)
+
+    @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
+    @mock.patch('osc.importer.sigpac.ITACYL_FTP',
+                '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
+    def test_fetchMunicipalities_reads_municipalities_in_parallel(self):
+        tasks = [('37_Salamanca', '37284_Sanchotello.zip'),
+                 ('37_Salamanca', '37_901.zip'),
+                 ('37_Salamanca', 'missing.zip')]
+
+        results = dict((task, (zip_path, error)) for task, zip_path, error
+                       in sigpac.fetchMunicipalities(tasks, workers=2, queue_size=1))
+
+        try:
+            self.assertEqual(len(list(sigpac.iterRecords(results[tasks[0]][0],
+                                                         tasks[0][1]))), 10)
+            self.assertEqual(list(sigpac.iterRecords(results[tasks[1]][0],
+                                                     tasks[1][1])), [])
+            self.assertIsNotNone(results[tasks[2]][1])
+        finally:
+            for zip_path, error in results.values():
+                if zip_path is not None:
+                    os.remove(zip_path)
+
+    @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
+    @mock.patch('osc.importer.sigpac.ITACYL_FTP',
+                '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
+    def test_iterRecords_resolves_fields_by_name(self):
         municipality = '37284_Sanchotello.zip'
-        sigpac.updateMunicipality(province, municipality)
-        self.assertTrue(m_updateParcel.call_count == 10, 'Updates 10 parcels')
-        m_updateParcel.assert_called()
-        m_updateParcel.assert_called_with(
-            {'doc':
-                {'properties':
-                    {'nationalCadastralReference': '37284A00100004',
-                     'sigpacData': {'ZONA': 0,
-                                    'PROVINCIA': 37,
-                                    'USO_SIGPAC': 'IM',
-                                    'RECINTO': 2,
-                                    'PERIMETRO': 50.39169,
-                                    'DN_OID': 895882,
-                                    'PARCELA': 4,
-                                    'POLIGONO': 1,
-                                    'COEF_REGAD': 0,
-                                    'SUPERFICIE': 121.32291,
-                                    'AGREGADO': 0,
-                                    'MUNICIPIO': 284}}}})
+        with downloaded_file(sigpac.municipalityUrl('37_Salamanca', municipality),
+                             'TEST') as zip_path:
+            records = sigpac.iterRecords(zip_path, municipality)
+            record = next(records)
+            records.close()
+
+        self.assertEqual(record.POLIGONO, 1)
+        self.assertEqual(record.PARCELA, 1)
+        self.assertEqual(record.USO_SIGPAC, 'PS')
+        self.assertEqual(sigpac.getCadastralReference(record), '37284A00100001')
 
+    @mock.patch('osc.importer.sigpac.updateParcels')
+    @mock.patch('osc.importer.sigpac.fetchMunicipalities')
     @mock.patch('osc.importer.sigpac.getMunicipalities')
+    @mock.patch('osc.importer.sigpac.getProvinces')
+    @mock.patch('osc.importer.sigpac.ITACYL_PROTOCOL', 'file:///')
+    @mock.patch('osc.importer.sigpac.ITACYL_FTP',
+                '{}/osc/tests/importer/fixtures'.format(os.getcwd()))
+    def test_import_sigpac_data_updates_fetched_municipalities(
+            self,
+            m_getProvinces,
+            m_getMunicipalities,
+            m_fetchMunicipalities,
+            m_updateParcels):
+        m_getProvinces.return_value = ['05_Avila', '37_Salamanca']
+        m_getMunicipalities.return_value = ['37284_Sanchotello.zip', '37_901.zip']
+        m_fetchMunicipalities.side_effect = lambda tasks, workers: [
+            (tasks[0], sigpac.downloadMunicipality(*tasks[0]), None),
+            (tasks[1], None, IOError('Connection reset'))]
+
+        sigpac.import_sigpac_data(['37_Salamanca'], workers=3)
+
+        m_getMunicipalities.assert_called_once_with('37_Salamanca')
+        self.assertEqual(m_fetchMunicipalities.call_args[0],
+                         ([('37_Salamanca', '37284_Sanchotello.zip'),
+                           ('37_Salamanca', '37_901.zip')], 3))
+        m_updateParcels.assert_called_once()
+
+    @mock.patch('osc.importer.sigpac.fetchMunicipalities', return_value=[])
+    @mock.patch('osc.importer.sigpac.getMunicipalities', return_value=[])
+    @mock.patch('osc.importer.sigpac.getProvinces',
+                return_value=['05_Avila', '37_Salamanca'])
     def test_import_sigpac_data_call_detMunicipalities(self,
-                                                       m_getMunicipalities):
+                                                       m_getProvinces,
+                                                       m_getMunicipalities,
+                                                       m_fetchMunicipalities):
         provinces = ['37_Salamanca']
         sigpac.import_sigpac_data(provinces)
         m_getMunicipalities.assert_called_with('37_Salamanca')
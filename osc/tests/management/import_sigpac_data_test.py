@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.management import call_command
 from django.test import TestCase
 # from django.core.management.base import CommandError
@@ -6,6 +7,12 @@ import mock
 
 class ImportSigpacDataTest(TestCase):
 
+    def setUp(self):
+        for name in ['build_parcel_pyramid', 'create_parcel_pyramid_mapping']:
+            patcher = mock.patch('osc.management.commands.import_sigpac_data.' + name)
+            setattr(self, 'mock_' + name, patcher.start())
+            self.addCleanup(patcher.stop)
+
     @mock.patch('osc.management.commands.import_sigpac_data.'
                 'import_sigpac_data')
     def test_call_import_sigpac_data(
@@ -22,4 +29,31 @@ class ImportSigpacDataTest(TestCase):
         provinces = ['37_Salamanca', '05_Avila']
         call_command('import_sigpac_data', '--provinces=%s' %
                      ','.join(provinces))
-        mock_import_sigpac_data.assert_called_with(provinces)
+        mock_import_sigpac_data.assert_called_with(
+            provinces,
+            workers=settings.ITACYL['import.workers'])
+
+    @mock.patch('osc.management.commands.import_sigpac_data.'
+                'import_sigpac_data')
+    def test_call_import_sigpac_data_with_workers(
+            self,
+            mock_import_sigpac_data):
+        call_command('import_sigpac_data', '--workers=8')
+        mock_import_sigpac_data.assert_called_with([], workers=8)
+
+    @mock.patch('osc.management.commands.import_sigpac_data.'
+                'import_sigpac_data')
+    def test_call_import_sigpac_data_builds_parcel_pyramid(
+            self,
+            mock_import_sigpac_data):
+        call_command('import_sigpac_data')
+        self.mock_create_parcel_pyramid_mapping.assert_called_once_with()
+        self.mock_build_parcel_pyramid.assert_called_once_with()
+
+    @mock.patch('osc.management.commands.import_sigpac_data.'
+                'import_sigpac_data')
+    def test_call_import_sigpac_data_skipping_pyramid(
+            self,
+            mock_import_sigpac_data):
+        call_command('import_sigpac_data', '--skip_pyramid')
+        self.mock_build_parcel_pyramid.assert_not_called()
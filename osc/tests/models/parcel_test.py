@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase
 import json
 import logging
@@ -6,6 +7,7 @@ from nose.plugins.attrib import attr
 
 from osc.models.parcel import getParcelByNationalCadastralReference
 from osc.models.parcel import getParcels
+from osc.util import PARCEL_PROJECTIONS, decode_page_token, encode_page_token
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +19,15 @@ class ParcelTest(TestCase):
     with open(fixture_file) as data_file:
         get_parcel_by_bbox_response = json.load(data_file)
 
+    def setUp(self):
+        cache.clear()
+
+    def msearch_response(self, body):
+        # Every parcel of the fixture is answered for the first cell
+        cells = len(body) // 2
+        empty = {'hits': {'total': 0, 'hits': []}}
+        return {'responses': [self.get_parcel_by_bbox_response] + [empty] * (cells - 1)}
+
     @mock.patch('osc.models.parcel.es')
     def test_getParcelByNationalCadastralReference_runs_without_errors(self, mock_es):
         mock_es.search.return_value = self.get_parcel_by_bbox_response
@@ -31,7 +42,8 @@ class ParcelTest(TestCase):
     @mock.patch('osc.models.parcel.es')
     def test_getParcel_calls_elastic_once(self, mock_es):
         mock_es.search.return_value = self.get_parcel_by_bbox_response
-        getParcels(bbox='-5.763941,40.435861,-5.746592,40.441145')
+        # Too many cells to be answered from the cache
+        getParcels(bbox='-6.763941,40.435861,-5.746592,41.441145')
         mock_es.search.assert_called_with(
             body={
                 'query':
@@ -43,15 +55,49 @@ class ParcelTest(TestCase):
                             'geo_bounding_box':
                             {
                                 'properties.reference_point':
-                                {'top': '40.441145', 'bottom': '40.435861', 'left': '-5.763941', 'right': '-5.746592'}
+                                {'top': '41.441145', 'bottom': '40.435861', 'left': '-6.763941', 'right': '-5.746592'}
                             }
                         }
                     }
-                }
+                },
+                'sort': [{'properties.nationalCadastralReference': 'asc'}],
+                '_source': PARCEL_PROJECTIONS['map']['_source'],
+                'docvalue_fields': PARCEL_PROJECTIONS['map']['docvalue_fields']
             },
             doc_type='parcel',
             index='parcels',
-            size=5000)
+            size=5001)
+
+    @mock.patch('osc.models.parcel.es')
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_getParcels_by_bbox_searches_cells_of_the_grid(self, mock_cache_es, mock_es):
+        mock_cache_es.msearch.side_effect = lambda body: self.msearch_response(body)
+
+        parcels = getParcels(bbox='-5.74,40.438,-5.73,40.442')
+
+        mock_es.search.assert_not_called()
+        mock_cache_es.msearch.assert_called_once()
+        self.assertEqual(len(parcels['features']), 10)
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_getParcels_by_bbox_filters_parcels_of_the_cells(self, mock_cache_es):
+        mock_cache_es.msearch.side_effect = lambda body: self.msearch_response(body)
+
+        parcels = getParcels(bbox='-5.737,40.438,-5.73,40.442')
+
+        self.assertEqual(sorted(parcel['properties']['nationalCadastralReference']
+                                for parcel in parcels['features']),
+                         ['37284A00600099', '37284A00600103', '37284A00600106',
+                          '37284A00600138', '37284A00600139', '37284A00600140'])
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_getParcels_by_close_bboxes_share_cached_cells(self, mock_cache_es):
+        mock_cache_es.msearch.side_effect = lambda body: self.msearch_response(body)
+
+        getParcels(bbox='-5.74,40.438,-5.73,40.442')
+        getParcels(bbox='-5.739,40.4385,-5.731,40.441')
+
+        mock_cache_es.msearch.assert_called_once()
 
     @mock.patch('osc.models.parcel.es')
     def test_getParcel_with_bbox_info_calls_elastic_once_with_bounds(self, mock_es):
@@ -62,3 +108,88 @@ class ParcelTest(TestCase):
     @attr('elastic_connection')
     def test_getParcels(self):
         logger.debug(getParcels())
+
+    @mock.patch('osc.models.parcel.es')
+    def test_getParcels_searches_after_the_page_token(self, mock_es):
+        mock_es.search.return_value = self.get_parcel_by_bbox_response
+        getParcels(page_size=5, page_token=encode_page_token(['37284A00600089']))
+
+        body = mock_es.search.call_args[1]['body']
+        self.assertEqual(body['search_after'], ['37284A00600089'])
+        self.assertEqual(mock_es.search.call_args[1]['size'], 6)
+
+    @mock.patch('osc.models.parcel.es')
+    def test_getParcels_returns_token_of_the_next_page(self, mock_es):
+        mock_es.search.return_value = self.get_parcel_by_bbox_response
+        parcels = getParcels(page_size=5)
+
+        self.assertEqual(len(parcels['features']), 5)
+        last = parcels['features'][-1]['properties']['nationalCadastralReference']
+        self.assertEqual(decode_page_token(parcels['next_page_token']), [last])
+
+    @mock.patch('osc.models.parcel.es')
+    def test_getParcels_last_page_has_no_token(self, mock_es):
+        mock_es.search.return_value = self.get_parcel_by_bbox_response
+        parcels = getParcels(page_size=10)
+
+        self.assertEqual(len(parcels['features']), 10)
+        self.assertIsNone(parcels['next_page_token'])
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_getParcels_by_bbox_walks_cached_cells_in_pages(self, mock_cache_es):
+        mock_cache_es.msearch.side_effect = lambda body: self.msearch_response(body)
+        bbox = '-5.74,40.438,-5.73,40.442'
+
+        codes = []
+        page_token = None
+        while True:
+            parcels = getParcels(bbox=bbox, page_size=4, page_token=page_token)
+            codes += [parcel['properties']['nationalCadastralReference']
+                      for parcel in parcels['features']]
+            page_token = parcels['next_page_token']
+            if page_token is None:
+                break
+
+        self.assertEqual(codes, sorted(hit['_source']['properties']['nationalCadastralReference']
+                                       for hit in self.get_parcel_by_bbox_response['hits']['hits']))
+        mock_cache_es.msearch.assert_called_once()
+
+    def test_getParcels_with_invalid_page_token_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            getParcels(page_token='not a token')
+
+    @mock.patch('osc.models.parcel.es')
+    def test_getParcels_with_summary_profile_has_no_geometry(self, mock_es):
+        mock_es.search.return_value = {'hits': {'hits': [
+            {'_source': {'properties': {'areaValue': 1250.0}},
+             'fields': {'properties.nationalCadastralReference': ['37284A00600106']}}]}}
+
+        parcels = getParcels(profile='summary')
+
+        self.assertEqual(mock_es.search.call_args[1]['body']['_source'],
+                         PARCEL_PROJECTIONS['summary']['_source'])
+        parcel = parcels['features'][0]
+        self.assertIsNone(parcel['geometry'])
+        self.assertEqual(parcel['properties']['nationalCadastralReference'], '37284A00600106')
+        self.assertEqual(parcel['properties']['areaValue'], 1250.0)
+
+    @mock.patch('osc.models.parcel.es')
+    def test_getParcelByNationalCadastralReference_with_profile(self, mock_es):
+        mock_es.search.return_value = self.get_parcel_by_bbox_response
+        getParcelByNationalCadastralReference(nationalCadastralReference='37284A00600106',
+                                              profile='map')
+
+        body = mock_es.search.call_args[1]['body']
+        self.assertEqual(body['_source'], PARCEL_PROJECTIONS['map']['_source'])
+        self.assertEqual(body['query'],
+                         {'match': {'properties.nationalCadastralReference': '37284A00600106'}})
+
+    def test_getParcels_with_unknown_profile_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            getParcels(bbox='-5.74,40.438,-5.73,40.442', profile='everything')
+
+    @mock.patch('osc.models.parcel.get_cached_parcel_buckets', return_value=[])
+    def test_getParcels_clamps_the_precision_of_buckets(self, m_get_cached_parcel_buckets):
+        getParcels(bbox='-5.74,40.438,-5.73,40.442', precision='40')
+
+        self.assertEqual(m_get_cached_parcel_buckets.call_args[0][4], 12)
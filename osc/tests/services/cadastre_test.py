@@ -4,11 +4,13 @@ from django.test import override_settings
 from django.test import TestCase
 import json
 import mock
+import numpy as np
 from nose.plugins.attrib import attr
 import xml.etree.ElementTree as ET
 
 from osc.exceptions import CadastreException
 import osc.services.cadastre as cadastre
+from osc.util import tile_bounds
 
 fixtures_file = 'osc/tests/services/fixtures/cadastre_fixtures.json'
 
@@ -232,3 +234,129 @@ class CadastreServiceTest(TestCase):
 
         cadastre.get_parcels_by_bbox(min_lat, min_lon, max_lat, max_lon)
         # self.assertTrue(False, 'not implemented yet')
+
+    @mock.patch('osc.services.cadastre.get_inspire_data_by_code')
+    @mock.patch('osc.services.cadastre.es')
+    def test_get_parcels_by_cadastral_codes_in_one_request(
+            self,
+            m_es,
+            m_get_inspire_data_by_code):
+        m_es.mget.return_value = {
+            'docs': [{'_id': '37284A00600114', 'found': True,
+                      '_source': {'properties': {'nationalCadastralReference': '37284A00600114'}}},
+                     {'_id': '37284A00600106', 'found': False}]}
+        m_get_inspire_data_by_code.return_value = \
+            [{'properties': {'nationalCadastralReference': '37284A00600106'}}]
+
+        parcels = cadastre.get_parcels_by_cadastral_codes(
+            ['37284A00600114', '37284A00600106', '37284A00600114'])
+
+        m_es.mget.assert_called_once_with(
+            index=settings.CADASTRE['index'],
+            doc_type=settings.CADASTRE['mapping'],
+            body={'ids': ['37284A00600114', '37284A00600106']})
+        m_get_inspire_data_by_code.assert_called_once_with('37284A00600106')
+        self.assertEqual([parcel['properties']['nationalCadastralReference']
+                          for parcel in parcels],
+                         ['37284A00600114', '37284A00600106'])
+        self.assertEqual(parcels[0]['type'], 'Feature')
+
+    @mock.patch('osc.services.cadastre.elastic_bulk')
+    @mock.patch('osc.services.cadastre.es')
+    def test_store_changed_parcels_only_writes_new_or_changed_parcels(
+            self,
+            m_es,
+            m_elastic_bulk):
+        parcels = [{'geometry': {'type': 'Polygon', 'coordinates': [[[-5.6, 40.9]]]},
+                    'properties': {'nationalCadastralReference': code,
+                                   'areaValue': 100.0}}
+                   for code in ['37284A00600114', '37284A00600106', '37284A00600107']]
+        unchanged_hash = cadastre.parcel_content_hash(parcels[0])
+        m_es.mget.return_value = {
+            'docs': [{'_id': '37284A00600114', 'found': True,
+                      '_source': {'properties': {'contentHash': unchanged_hash}}},
+                     {'_id': '37284A00600106', 'found': True,
+                      '_source': {'properties': {'contentHash': 'old'}}},
+                     {'_id': '37284A00600107', 'found': False}]}
+        m_elastic_bulk.side_effect = lambda process_name, actions: list(actions)
+
+        actions = cadastre.store_changed_parcels(parcels)
+
+        self.assertEqual(m_es.mget.call_args[1]['_source_include'],
+                         'properties.contentHash')
+        self.assertEqual([action['_id'] for action in actions],
+                         ['37284A00600106', '37284A00600107'])
+        self.assertTrue(actions[0]['_source']['doc_as_upsert'])
+        self.assertEqual(actions[0]['_op_type'], 'update')
+
+    @mock.patch('osc.services.cadastre.invalidate_parcel_cells')
+    @mock.patch('osc.services.cadastre.elastic_bulk')
+    def test_store_parcels_streams_parcels_and_invalidates_their_cells(
+            self,
+            m_elastic_bulk,
+            m_invalidate_parcel_cells):
+        parcels = ({'properties': {'nationalCadastralReference': code,
+                                   'reference_point': {'lat': 40.44, 'lon': -5.735}}}
+                   for code in ['37284A00600114', '37284A00600106'])
+
+        def elastic_bulk(process_name, actions):
+            self.assertNotIsInstance(actions, list)
+            return [action['_id'] for action in actions]
+        m_elastic_bulk.side_effect = elastic_bulk
+
+        self.assertEqual(cadastre.store_parcels(parcels), ['37284A00600114', '37284A00600106'])
+        m_invalidate_parcel_cells.assert_called_once_with([{'lat': 40.44, 'lon': -5.735}] * 2)
+
+    def test_parcel_content_hash_ignores_added_properties(self):
+        parcel = {'geometry': {'type': 'Polygon', 'coordinates': [[[-5.6, 40.9]]]},
+                  'properties': {'nationalCadastralReference': '37284A00600114'}}
+        content_hash = cadastre.parcel_content_hash(parcel)
+
+        parcel['properties']['elevation'] = 800
+        self.assertEqual(cadastre.parcel_content_hash(parcel), content_hash)
+
+        parcel['geometry']['coordinates'] = [[[-5.7, 40.9]]]
+        self.assertNotEqual(cadastre.parcel_content_hash(parcel), content_hash)
+
+
+class CoordinateTransformTest(TestCase):
+
+    def test_pos_list_is_converted_in_one_call(self):
+        pos_list = '270100.0 4500100.0 270200.5 4500100.0 270200.5 4500200.25'
+
+        ring = cadastre.utm_2_lonlat_array(cadastre.parse_pos_list(pos_list),
+                                           'EPSG:25830')
+
+        self.assertEqual(len(ring), 3)
+        for (lon, lat), (x, y) in zip(ring, [(270100.0, 4500100.0),
+                                            (270200.5, 4500100.0),
+                                            (270200.5, 4500200.25)]):
+            expected_lat, expected_lon = cadastre.utm_2_latlon(x, y, 'EPSG:25830')
+            self.assertAlmostEqual(lat, expected_lat, places=9)
+            self.assertAlmostEqual(lon, expected_lon, places=9)
+
+    def test_projections_are_cached_by_zone(self):
+        self.assertIs(cadastre.get_projection('EPSG:25830'),
+                      cadastre.get_projection('EPSG:25830'))
+
+
+class TileRingsTest(TestCase):
+
+    def square(self, z, x, y, start, end):
+        west, south, east, north = tile_bounds(z, x, y)
+        left, right = west + (east - west) * start, west + (east - west) * end
+        bottom, top = south + (north - south) * start, south + (north - south) * end
+        return [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+
+    def test_holes_are_dropped_with_their_exterior_ring(self):
+        exterior = self.square(14, 7934, 6158, 0.1, 0.9)
+        hole = self.square(14, 7934, 6158, 0.4, 0.6)
+        geometry = {'type': 'multipolygon',
+                    'coordinates': [[exterior[:3], hole],
+                                    [exterior, hole]]}
+
+        rings = cadastre.tile_rings(geometry, 14, 7934, 6158)
+
+        self.assertEqual(len(rings), 2)
+        self.assertGreater(cadastre.ring_area(np.array(rings[0])), 0)
+        self.assertLess(cadastre.ring_area(np.array(rings[1])), 0)
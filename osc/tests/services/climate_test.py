@@ -1,3 +1,4 @@
+# coding=utf-8
 from django.conf import settings
 from django.test import TestCase
 import json
@@ -17,7 +18,6 @@ class ClimateServiceTest(TestCase):
     elastic_closest_station = \
         climate_fixture['closest_station']['elastic']
     api_closest_station = climate_fixture['closest_station']['api']
-    query_closest_station = climate_fixture['closest_station']['query']
 
     elastic_aggregated_measures = \
         climate_fixture['aggregated_measures']['elastic']
@@ -27,15 +27,17 @@ class ClimateServiceTest(TestCase):
         climate_fixture['aggregated_measures']['query']
 
     def setUp(self):
-        pass
+        elastic.station_index.invalidate()
 
     @mock.patch('osc.services.climate.es')
-    def test_call_elastic_when_get_closest_station(self, mock_es):
+    def test_load_stations_once_when_get_closest_station(self, mock_es):
+        mock_es.search.return_value = self.elastic_closest_station
         elastic.get_closest_station(40.439983, -5.737026)
-        mock_es.search.assert_called_with(
+        elastic.get_closest_station(41.439983, -5.737026)
+        mock_es.search.assert_called_once_with(
             index=settings.INFORIEGO['index'],
             doc_type=settings.INFORIEGO['station.mapping'],
-            body=self.query_closest_station)
+            size=10000)
 
     @mock.patch('osc.services.climate.es')
     def test_get_closest_station(self, mock_es):
@@ -74,6 +76,66 @@ class ClimateServiceTest(TestCase):
             self.api_aggregated_measures,
             elastic.get_aggregated_climate_measures('102', '5', 2))
 
+    @mock.patch('osc.services.climate.es')
+    def test_get_aggregated_measures_from_rollup(self, mock_es):
+        api = self.api_aggregated_measures
+        docs = [{'found': False}]
+        for by_month, by_day in zip(api['by_month'], api['by_day']):
+            docs.append({'found': True,
+                         '_source': {'year': by_month['year'],
+                                     'monthly_measures': by_month['monthly_measures'],
+                                     'daily_measures': by_day['daily_measures'],
+                                     'last_year': api['last_year']}})
+        mock_es.mget.return_value = {'docs': docs}
+
+        self.maxDiff = None
+        self.assertDictEqual(
+            api,
+            elastic.get_aggregated_climate_measures('102', '5', 2))
+        self.assertEqual(len(mock_es.mget.call_args[1]['body']['ids']), 3)
+        mock_es.search.assert_not_called()
+
+    @mock.patch('osc.services.climate.es')
+    def test_get_aggregated_measures_live_when_rollup_misses_years(self, mock_es):
+        api = self.api_aggregated_measures
+        mock_es.mget.return_value = {'docs': [
+            {'found': True,
+             '_source': {'year': api['by_month'][0]['year'],
+                         'monthly_measures': api['by_month'][0]['monthly_measures'],
+                         'daily_measures': api['by_day'][0]['daily_measures'],
+                         'last_year': api['last_year']}},
+            {'found': False},
+            {'found': False}]}
+        mock_es.search.return_value = self.elastic_aggregated_measures
+
+        self.maxDiff = None
+        self.assertDictEqual(
+            api,
+            elastic.get_aggregated_climate_measures('102', '5', 2))
+        mock_es.search.assert_called_once()
+
+    @mock.patch('osc.services.climate.elastic_bulk')
+    @mock.patch('osc.services.climate.es')
+    def test_rollup_climate_measures_stores_one_document_per_station_year(
+            self,
+            mock_es,
+            mock_elastic_bulk):
+        mock_es.msearch.return_value = \
+            {'responses': [self.elastic_aggregated_measures,
+                           {'error': 'index_not_found_exception'}]}
+        mock_elastic_bulk.side_effect = \
+            lambda process_name, actions: mock.Mock(success=len(list(actions)))
+
+        stats = elastic.rollup_climate_measures([('5', '102', 2016),
+                                                 ('5', '103', 2016)])
+
+        self.assertEqual(stats.success, 1)
+        mock_es.indices.refresh.assert_called_once()
+        body = mock_es.msearch.call_args[1]['body']
+        self.assertEqual(len(body), 4)
+        self.assertIn({u'term': {u'AÑO': 2016}},
+                      body[1]['query']['constant_score']['filter']['bool']['must'])
+
     @attr('elastic_connection')
     def test_get_aggregated_measures_from_elastic(self):
         res = elastic.get_aggregated_climate_measures('102', '5', 2)
@@ -25,3 +25,50 @@ class UpdateParcelTest(TestCase):
                           m_cadastre_scan_parcels):
         parcels.scan_parcels(None)
         m_cadastre_scan_parcels.assert_called()
+
+
+def parcel(cadastral_code, lat, lon):
+    return {'type': 'Feature',
+            'properties': {'nationalCadastralReference': cadastral_code,
+                           'reference_point': {'lat': lat, 'lon': lon}}}
+
+
+class ObtainParcelsTest(TestCase):
+
+    @mock.patch('osc.services.parcels.soil.get_closest_soil_measures')
+    @mock.patch('osc.services.parcels.climate.get_aggregated_climate_measures')
+    @mock.patch('osc.services.parcels.climate.get_closest_stations')
+    @mock.patch('osc.services.parcels.cadastre.get_parcels_by_cadastral_codes')
+    def test_obtain_parcels_by_cadastral_codes_enriches_in_bulk(
+            self,
+            m_get_parcels_by_cadastral_codes,
+            m_get_closest_stations,
+            m_get_aggregated_climate_measures,
+            m_get_closest_soil_measures):
+        m_get_parcels_by_cadastral_codes.return_value = \
+            [parcel('37284A00600114', 40.9, -5.6),
+             parcel('37284A00600106', 40.9, -5.6),
+             parcel('05271A00100001', 40.2, -5.3)]
+        m_get_closest_stations.return_value = \
+            [{'IDESTACION': '4', 'IDPROVINCIA': '37'},
+             {'IDESTACION': '4', 'IDPROVINCIA': '37'},
+             {'IDESTACION': '102', 'IDPROVINCIA': '5'}]
+        m_get_aggregated_climate_measures.side_effect = \
+            lambda station, province, years: {'station': station}
+        m_get_closest_soil_measures.return_value = [{}, {}, {}]
+
+        geojson = parcels.obtain_parcels_by_cadastral_codes(
+            ['37284A00600114', '37284A00600106', '05271A00100001'],
+            retrieve_climate_info=True,
+            retrieve_soil_info=True)
+
+        features = geojson['features']
+        self.assertEqual(len(features), 3)
+        m_get_closest_stations.assert_called_once_with(
+            [(40.9, -5.6), (40.9, -5.6), (40.2, -5.3)])
+        self.assertEqual(m_get_aggregated_climate_measures.call_count, 2)
+        self.assertEqual(features[1]['properties']['climate_aggregations'],
+                         {'station': '4'})
+        self.assertEqual(features[2]['properties']['climate_aggregations'],
+                         {'station': '102'})
+        m_get_closest_soil_measures.assert_called_once()
@@ -0,0 +1,63 @@
+from django.core.cache import cache
+from django.test import TestCase
+import mock
+
+import osc.services.pyramid as pyramid
+
+
+def aggregate_children(cells, precision):
+    # Two children in every cell
+    return dict((cell, [{'key': cell + child + 'b' * (precision - len(cell) - 1),
+                         'doc_count': 2,
+                         'area': {'value': 20.0}}
+                        for child in 'ez'])
+                for cell in cells)
+
+
+class ParcelPyramidTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('osc.services.pyramid.aggregate_parcel_cells', side_effect=aggregate_children)
+    def test_levels_are_aggregated_within_parent_cells(self, mock_aggregate):
+        buckets = list(pyramid.pyramid_buckets(max_precision=3, depth=2, batch_size=20))
+
+        self.assertEqual([call[0] for call in mock_aggregate.call_args_list],
+                         [([''], 1), ([''], 2), (['e', 'z'], 3)])
+        self.assertEqual([precision for precision, bucket in buckets],
+                         [1, 1, 2, 2, 3, 3, 3, 3])
+        self.assertEqual(sorted(bucket['key'] for precision, bucket in buckets
+                                if precision == 3),
+                         ['eeb', 'ezb', 'zeb', 'zzb'])
+
+    @mock.patch('osc.services.pyramid.aggregate_parcel_cells', side_effect=aggregate_children)
+    def test_parents_are_searched_in_batches(self, mock_aggregate):
+        list(pyramid.pyramid_buckets(max_precision=2, depth=1, batch_size=1))
+
+        self.assertEqual([call[0] for call in mock_aggregate.call_args_list],
+                         [([''], 1), (['e'], 2), (['z'], 2)])
+
+    @mock.patch('osc.services.pyramid.invalidate_parcel_buckets')
+    @mock.patch('osc.services.pyramid.aggregate_parcel_cells', side_effect=aggregate_children)
+    @mock.patch('osc.services.pyramid.elastic_bulk')
+    @mock.patch('osc.services.pyramid.es')
+    def test_build_stores_cells_and_removes_the_old_ones(self,
+                                                         mock_es,
+                                                         mock_elastic_bulk,
+                                                         mock_aggregate,
+                                                         mock_invalidate):
+        mock_elastic_bulk.side_effect = \
+            lambda process_name, actions: mock.Mock(success=len(list(actions)), actions=actions)
+
+        stats = pyramid.build_parcel_pyramid(max_precision=2, depth=1)
+
+        self.assertEqual(stats.success, 6)
+        actions = list(pyramid.pyramid_actions(1, 1, 1, 20))
+        self.assertEqual(actions[0]['_id'], 'e')
+        self.assertEqual(actions[0]['_source'],
+                         {'geohash': 'e', 'precision': 1, 'count': 2, 'area': 20.0, 'build': 1})
+
+        build = mock_es.delete_by_query.call_args[1]['body']['query']['bool']['must_not']['term']['build']
+        self.assertIsInstance(build, int)
+        mock_invalidate.assert_called_once_with()
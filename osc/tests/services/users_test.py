@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+import mock
+
+from osc.models import UserParcel
+import osc.services.users as users
+
+
+class GetParcelsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('google_test', 'test@example.com', 'test')
+        other = User.objects.create_user('facebook_test', 'other@example.com', 'test')
+        for code in ['37284A00600114', '37284A00600106', '05271A00100001']:
+            UserParcel.objects.create(user=self.user, cadastral_code=code)
+        UserParcel.objects.create(user=other, cadastral_code='37284A00600114')
+
+    @mock.patch('osc.services.users.parcel_service.obtain_parcels_by_cadastral_codes')
+    def test_get_parcels_obtains_all_user_parcels_at_once(
+            self,
+            m_obtain_parcels_by_cadastral_codes):
+        m_obtain_parcels_by_cadastral_codes.return_value = \
+            {'type': 'FeatureCollection', 'features': [{'type': 'Feature'}]}
+
+        parcels = users.get_parcels('google_test', True)
+
+        self.assertEqual(parcels, [{'type': 'Feature'}])
+        m_obtain_parcels_by_cadastral_codes.assert_called_once_with(
+            ['05271A00100001', '37284A00600106', '37284A00600114'],
+            retrieve_public_info=True,
+            retrieve_climate_info=False,
+            retrieve_soil_info=False)
+
+    @mock.patch('osc.services.users.parcel_service.obtain_parcels_by_cadastral_codes')
+    def test_get_parcels_of_every_user_by_page(
+            self,
+            m_obtain_parcels_by_cadastral_codes):
+        m_obtain_parcels_by_cadastral_codes.return_value = \
+            {'type': 'FeatureCollection', 'features': []}
+
+        users.get_parcels(None, page=2, page_size=2)
+
+        self.assertEqual(m_obtain_parcels_by_cadastral_codes.call_args[0][0],
+                         ['37284A00600114'])
+
+    @mock.patch('osc.services.users.parcel_service.obtain_parcels_by_cadastral_codes')
+    def test_get_parcels_past_last_page(
+            self,
+            m_obtain_parcels_by_cadastral_codes):
+        self.assertEqual(users.get_parcels(None, page=3, page_size=2), [])
+        m_obtain_parcels_by_cadastral_codes.assert_not_called()
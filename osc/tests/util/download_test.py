@@ -0,0 +1,91 @@
+from django.test import TestCase
+import mock
+import os
+import tempfile
+
+from osc.exceptions import ConnectionError
+from osc.util import cached_download, download_to_file, downloaded_file
+
+
+def mocked_response(blocks, headers, ok=True, status_code=None):
+    status_code = status_code or (200 if ok else 404)
+    response = mock.Mock(ok=ok, status_code=status_code, headers=headers)
+    response.iter_content.return_value = iter(blocks)
+    return response
+
+
+class DownloadTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+    @mock.patch('osc.util.download.requests.get')
+    def test_streams_url_to_file(self, m_get):
+        m_get.return_value = mocked_response(['abc', 'def'], {'Content-Length': '6'})
+
+        with downloaded_file('http://test/file.zip', 'TEST', dir=self.tmp_dir) as path:
+            with open(path) as downloaded:
+                self.assertEqual(downloaded.read(), 'abcdef')
+
+        self.assertFalse(os.path.exists(path))
+        m_get.assert_called_with('http://test/file.zip', headers=None, stream=True)
+
+    @mock.patch('osc.util.download.requests.get')
+    def test_fails_when_download_is_incomplete(self, m_get):
+        m_get.return_value = mocked_response(['abc'], {'Content-Length': '6'})
+
+        self.assertRaises(ConnectionError,
+                          download_to_file,
+                          'http://test/file.zip', 'TEST', dir=self.tmp_dir)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_downloads_file_urls(self):
+        source = os.path.join(self.tmp_dir, 'source.txt')
+        with open(source, 'w') as source_file:
+            source_file.write('content')
+
+        path = download_to_file('file://' + source, 'TEST', dir=self.tmp_dir)
+
+        with open(path) as downloaded:
+            self.assertEqual(downloaded.read(), 'content')
+
+    @mock.patch('osc.util.download.requests.get')
+    def test_cached_download_sends_validators_of_cached_copy(self, m_get):
+        m_get.return_value = mocked_response(['abc'], {'ETag': '"v1"'})
+
+        first = cached_download('http://test/file.zip', 'TEST', dir=self.tmp_dir)
+
+        self.assertTrue(first.modified)
+        self.assertEqual(first.etag, '"v1"')
+        m_get.assert_called_with('http://test/file.zip', headers={}, stream=True)
+
+        m_get.return_value = mocked_response([], {}, status_code=304)
+
+        second = cached_download('http://test/file.zip', 'TEST',
+                                 etag=first.etag,
+                                 content_hash=first.content_hash,
+                                 dir=self.tmp_dir)
+
+        self.assertFalse(second.modified)
+        self.assertEqual(second.path, first.path)
+        m_get.assert_called_with('http://test/file.zip',
+                                 headers={'If-None-Match': '"v1"'},
+                                 stream=True)
+
+    @mock.patch('osc.util.download.requests.get')
+    def test_cached_download_detects_same_content(self, m_get):
+        m_get.return_value = mocked_response(['abc'], {})
+        first = cached_download('http://test/file.zip', 'TEST', dir=self.tmp_dir)
+
+        m_get.return_value = mocked_response(['abc'], {})
+        second = cached_download('http://test/file.zip', 'TEST',
+                                 content_hash=first.content_hash,
+                                 dir=self.tmp_dir)
+
+        self.assertFalse(second.modified)
+        self.assertEqual(os.listdir(self.tmp_dir), [os.path.basename(first.path)])
@@ -0,0 +1,121 @@
+from django.test import override_settings
+from django.test import TestCase
+import mock
+
+from osc.exceptions import ElasticException
+import osc.util.elastic as elastic
+
+
+def bulk_response(*statuses):
+    return {'errors': any(status >= 300 for status in statuses),
+            'items': [{'index': {'status': status}} for status in statuses]}
+
+
+def actions(num_docs):
+    return ({'_index': 'parcels',
+             '_type': 'parcel',
+             '_id': str(i),
+             '_source': {'value': i}} for i in range(num_docs))
+
+
+@mock.patch('osc.util.elastic.wait_for_yellow_cluster_status')
+@mock.patch('osc.util.elastic.time.sleep')
+@mock.patch('osc.util.elastic.es')
+class ElasticBulkTest(TestCase):
+
+    def setUp(self):
+        self.serializer = elastic.es.transport.serializer
+
+    def test_splits_actions_in_batches_of_max_docs(self, m_es, m_sleep, m_wait):
+        m_es.transport.serializer = self.serializer
+        m_es.bulk.side_effect = [bulk_response(201, 201),
+                                 bulk_response(201, 201),
+                                 bulk_response(201)]
+
+        stats = elastic.elastic_bulk('TEST', actions(5), max_docs=2)
+
+        self.assertEqual(m_es.bulk.call_count, 3)
+        self.assertEqual(stats.success, 5)
+        self.assertEqual(stats.failed, 0)
+
+    def test_splits_actions_in_batches_of_max_bytes(self, m_es, m_sleep, m_wait):
+        m_es.transport.serializer = self.serializer
+        m_es.bulk.side_effect = [bulk_response(201) for _ in range(3)]
+
+        elastic.elastic_bulk('TEST', actions(3), max_docs=100, max_bytes=10)
+
+        self.assertEqual(m_es.bulk.call_count, 3)
+
+    def test_retries_only_rejected_documents(self, m_es, m_sleep, m_wait):
+        m_es.transport.serializer = self.serializer
+        m_es.bulk.side_effect = [bulk_response(201, 429, 201),
+                                 bulk_response(201)]
+
+        stats = elastic.elastic_bulk('TEST', actions(3), max_docs=3)
+
+        retried_body = m_es.bulk.call_args_list[1][1]['body']
+        self.assertEqual(len(retried_body.splitlines()), 2)
+        self.assertIn('"_id":"1"', retried_body.replace(' ', ''))
+        self.assertEqual(stats.success, 3)
+        self.assertEqual(stats.retried, 1)
+        m_sleep.assert_called_once()
+
+    @override_settings(ERROR_HANDLER=['DBErrorHandler'])
+    def test_reports_documents_that_cannot_be_stored(self, m_es, m_sleep, m_wait):
+        m_es.transport.serializer = self.serializer
+        m_es.bulk.return_value = bulk_response(201, 400)
+
+        stats = elastic.elastic_bulk('TEST',
+                                     actions(2),
+                                     raise_on_error=False)
+
+        self.assertEqual(m_es.bulk.call_count, 1)
+        self.assertEqual(stats.success, 1)
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(stats.errors[0]['_id'], '1')
+
+        m_es.bulk.return_value = bulk_response(201, 400)
+        self.assertRaises(ElasticException,
+                          elastic.elastic_bulk,
+                          'TEST',
+                          actions(2))
+
+
+@mock.patch('osc.util.elastic.es')
+class ClusterHealthMonitorTest(TestCase):
+
+    def test_caches_healthy_status_until_ttl_expires(self, m_es):
+        m_es.cluster.health.return_value = {'status': 'yellow'}
+        monitor = elastic.ClusterHealthMonitor(ttl=60)
+
+        monitor.wait('TEST')
+        monitor.wait('TEST')
+        monitor.wait('TEST')
+
+        m_es.cluster.health.assert_called_once()
+        self.assertEqual(monitor.metrics()['cache_hits'], 2)
+        self.assertEqual(monitor.metrics()['held_back'], 0)
+
+    def test_checks_again_when_ttl_expires(self, m_es):
+        m_es.cluster.health.return_value = {'status': 'green'}
+        monitor = elastic.ClusterHealthMonitor(ttl=0)
+
+        monitor.wait('TEST')
+        monitor.wait('TEST')
+
+        self.assertEqual(m_es.cluster.health.call_count, 2)
+
+    def test_holds_writers_back_while_status_is_red(self, m_es):
+        m_es.cluster.health.side_effect = [{'status': 'red'},
+                                           {'status': 'yellow'}]
+        monitor = elastic.ClusterHealthMonitor(ttl=60)
+
+        self.assertEqual(monitor.wait('TEST'), 'yellow')
+        self.assertEqual(m_es.cluster.health.call_count, 2)
+        self.assertEqual(monitor.metrics()['held_back'], 1)
+
+    def test_status_is_not_fresh_before_its_check_time_is_set(self, m_es):
+        monitor = elastic.ClusterHealthMonitor(ttl=60)
+        monitor.status = 'yellow'
+
+        self.assertFalse(monitor.is_fresh())
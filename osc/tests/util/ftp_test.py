@@ -0,0 +1,47 @@
+import ftplib
+from django.test import TestCase
+import mock
+
+from osc.util import FTPPool
+
+
+@mock.patch('osc.util.ftp.ftplib.FTP')
+class FTPPoolTest(TestCase):
+
+    def test_reuses_logged_in_sessions(self, m_FTP):
+        m_FTP.return_value.pwd.return_value = '/'
+        pool = FTPPool('ftp.test', size=2)
+
+        for _ in range(3):
+            with pool.session() as ftp:
+                ftp.nlst()
+
+        m_FTP.assert_called_once_with('ftp.test')
+        m_FTP.return_value.login.assert_called_once()
+        self.assertEqual(m_FTP.return_value.nlst.call_count, 3)
+
+    def test_replaces_sessions_closed_by_the_server(self, m_FTP):
+        closed, renewed = mock.Mock(), mock.Mock()
+        closed.pwd.return_value = '/'
+        closed.cwd.side_effect = ftplib.error_temp('421 Timeout')
+        m_FTP.side_effect = [closed, renewed]
+        pool = FTPPool('ftp.test', size=1)
+
+        with pool.session():
+            pass
+        with pool.session() as ftp:
+            self.assertIs(ftp, renewed)
+
+        closed.close.assert_called_once()
+
+    def test_discards_sessions_that_fail(self, m_FTP):
+        m_FTP.return_value.pwd.return_value = '/'
+        pool = FTPPool('ftp.test', size=1)
+
+        with self.assertRaises(ftplib.error_perm):
+            with pool.session():
+                raise ftplib.error_perm('550 No such directory')
+        with pool.session():
+            pass
+
+        self.assertEqual(m_FTP.call_count, 2)
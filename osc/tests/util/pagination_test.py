@@ -0,0 +1,22 @@
+# coding=utf-8
+from django.test import TestCase
+
+from osc.util import decode_page_token, encode_page_token
+
+
+class PageTokenTest(TestCase):
+
+    def test_token_keeps_the_sort_values(self):
+        token = encode_page_token(['37284A00600106'])
+
+        self.assertEqual(decode_page_token(token), ['37284A00600106'])
+
+    def test_token_is_url_safe(self):
+        token = encode_page_token([u'ñ' * 10, 1.5])
+
+        self.assertRegexpMatches(token, r'^[A-Za-z0-9_=-]+$')
+
+    def test_invalid_tokens_raise_value_error(self):
+        for token in ['not a token', 'e30=', encode_page_token([]), u'ñ']:
+            with self.assertRaises(ValueError):
+                decode_page_token(token)
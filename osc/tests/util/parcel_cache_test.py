@@ -0,0 +1,149 @@
+from django.core.cache import cache
+from django.test import TestCase
+import geohash
+import mock
+
+from osc.services import cadastre
+from osc.util import es, geohash_cells, get_cached_parcel_buckets, get_cached_parcel_documents, \
+    invalidate_parcel_buckets, invalidate_parcel_cells
+from osc.util.parcel_cache import cache_key
+
+
+def buckets_response(body):
+    # Every cell finds the buckets of its neighbours
+    buckets = [{'key': key, 'doc_count': count, 'area': {'value': count * 10.0}}
+               for key, count in [('ez5yj3', 3), ('ez5vkm', 2)]]
+    return {'responses': [{'hits': {'total': 5, 'hits': []},
+                           'aggregations': {'cells': {'buckets': buckets}}}
+                          for _ in range(len(body) // 2)]}
+
+
+class GeohashCellsTest(TestCase):
+
+    def test_cells_cover_the_bbox(self):
+        cells = geohash_cells(-5.74, 40.438, -5.73, 40.442, 6)
+
+        for lat, lon in [(40.438, -5.74), (40.442, -5.73), (40.44, -5.735)]:
+            self.assertIn(geohash.encode(lat, lon, 6), cells)
+
+    def test_cell_of_a_point(self):
+        self.assertEqual(geohash_cells(-5.735, 40.44, -5.735, 40.44, 5),
+                         [geohash.encode(40.44, -5.735, 5)])
+
+    def test_too_many_cells_are_not_listed(self):
+        self.assertIsNone(geohash_cells(-9.3, 36.0, 3.3, 43.8, 6, max_cells=64))
+        self.assertEqual(len(geohash_cells(-5.74, 40.438, -5.73, 40.442, 6, max_cells=64)),
+                         len(geohash_cells(-5.74, 40.438, -5.73, 40.442, 6)))
+
+
+class ParcelCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('osc.util.parcel_cache.pyramid_max_precision', 0)
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_buckets_are_counted_once_in_their_cell(self, mock_es):
+        mock_es.msearch.side_effect = buckets_response
+        west, south, east, north = -5.8, 40.3, -5.7, 40.5
+
+        buckets = get_cached_parcel_buckets(west, south, east, north, 6)
+
+        cells = geohash_cells(west, south, east, north, 4)
+        self.assertEqual(len(mock_es.msearch.call_args[1]['body']), 2 * len(cells))
+        self.assertEqual(sorted(bucket['key'] for bucket in buckets),
+                         ['ez5vkm', 'ez5yj3'])
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_large_bbox_is_not_cached(self, mock_es):
+        self.assertIsNone(get_cached_parcel_buckets(-9.0, 36.0, 3.0, 44.0, 8))
+        mock_es.msearch.assert_not_called()
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_invalidate_removes_cells_of_the_point(self, mock_es):
+        mock_es.msearch.side_effect = buckets_response
+        get_cached_parcel_buckets(-5.8, 40.3, -5.7, 40.5, 6)
+        cell = geohash.encode(40.44, -5.735, 4)
+        self.assertIsNotNone(cache.get(cache_key('buckets.0.6', cell)))
+
+        invalidate_parcel_cells([{'lat': 40.44, 'lon': -5.735}])
+
+        self.assertIsNone(cache.get(cache_key('buckets.0.6', cell)))
+
+    @mock.patch('osc.services.cadastre.invalidate_parcel_cells')
+    @mock.patch('osc.services.cadastre.elastic_bulk')
+    @mock.patch('osc.services.cadastre.es')
+    def test_update_parcels_invalidates_their_cells(self,
+                                                    m_es,
+                                                    m_elastic_bulk,
+                                                    m_invalidate_parcel_cells):
+        m_es.mget.return_value = {
+            'docs': [{'_id': '37284A00600106', 'found': True,
+                      '_source': {'properties': {'reference_point': {'lat': 40.44,
+                                                                     'lon': -5.735}}}},
+                     {'_id': '37284A00600107', 'found': False}]}
+
+        cadastre.update_parcels([{'doc': {'properties': {'nationalCadastralReference': code}}}
+                                 for code in ['37284A00600106', '37284A00600107']])
+
+        self.assertEqual(m_es.mget.call_args[1]['body'],
+                         {'ids': ['37284A00600106', '37284A00600107']})
+        m_invalidate_parcel_cells.assert_called_once_with([{'lat': 40.44, 'lon': -5.735}])
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_buckets_are_read_from_the_pyramid(self, mock_es):
+        mock_es.msearch.return_value = {'responses': [
+            {'hits': {'total': 1, 'hits': [{'_source': {'geohash': 'ez5yj3',
+                                                        'precision': 6,
+                                                        'count': 3,
+                                                        'area': 30.0}}]}}]}
+
+        buckets = get_cached_parcel_buckets(-5.736, 40.44, -5.734, 40.441, 6)
+
+        self.assertEqual(buckets, [{'key': 'ez5yj3', 'doc_count': 3, 'area': {'value': 30.0}}])
+        header, query = mock_es.msearch.call_args[1]['body']
+        self.assertEqual(header['index'], 'parcels_pyramid')
+        self.assertIn({'prefix': {'geohash': 'ez5y'}}, query['query']['bool']['filter'])
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_buckets_are_aggregated_without_pyramid(self, mock_es):
+        mock_es.msearch.side_effect = [{'responses': [{'error': 'index_not_found_exception'}]},
+                                       buckets_response([{}, {}])]
+
+        buckets = get_cached_parcel_buckets(-5.736, 40.44, -5.734, 40.441, 6)
+
+        self.assertEqual([bucket['key'] for bucket in buckets], ['ez5yj3'])
+        header, query = mock_es.msearch.call_args[1]['body']
+        self.assertEqual(header['index'], 'parcels')
+
+    @mock.patch('osc.util.parcel_cache.es')
+    def test_rebuilt_pyramid_invalidates_cached_buckets(self, mock_es):
+        mock_es.msearch.side_effect = buckets_response
+        get_cached_parcel_buckets(-5.736, 40.44, -5.734, 40.441, 9)
+
+        invalidate_parcel_buckets()
+        get_cached_parcel_buckets(-5.736, 40.44, -5.734, 40.441, 9)
+
+        self.assertEqual(mock_es.msearch.call_count, 2)
+
+    @mock.patch('osc.util.parcel_cache.max_elastic_query_size', 1)
+    @mock.patch.object(es, 'search')
+    @mock.patch.object(es, 'msearch')
+    def test_dense_cells_are_read_in_pages(self, m_msearch, m_search):
+        def hit(code):
+            return {'_source': {'properties': {'nationalCadastralReference': code,
+                                               'reference_point': {'lat': 40.4405,
+                                                                   'lon': -5.7355}}},
+                    'sort': [code]}
+        m_msearch.return_value = {'responses': [
+            {'hits': {'total': 2, 'hits': [hit('37284A00600106')]}}]}
+        m_search.side_effect = [{'hits': {'hits': [hit('37284A00600107')]}},
+                                {'hits': {'hits': []}}]
+
+        documents = get_cached_parcel_documents(-5.736, 40.44, -5.735, 40.441)
+
+        self.assertEqual([document['properties']['nationalCadastralReference']
+                          for document in documents],
+                         ['37284A00600106', '37284A00600107'])
+        self.assertEqual(m_search.call_args_list[0][1]['body']['search_after'],
+                         ['37284A00600106'])
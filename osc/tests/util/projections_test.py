@@ -0,0 +1,35 @@
+from django.test import TestCase
+
+from osc.util import parcel_projection, projected_source
+
+
+class ProjectionsTest(TestCase):
+
+    def test_full_projection_reads_the_whole_source(self):
+        self.assertEqual(parcel_projection('full'), {})
+
+    def test_summary_projection_has_no_geometry(self):
+        projection = parcel_projection('summary')
+
+        self.assertNotIn('geometry', projection['_source']['includes'])
+        self.assertIn('geometry', parcel_projection('map')['_source']['includes'])
+
+    def test_projection_is_a_copy(self):
+        parcel_projection('map')['_source']['includes'].append('properties.cadastralData')
+
+        self.assertNotIn('properties.cadastralData',
+                         parcel_projection('map')['_source']['includes'])
+
+    def test_unknown_projection_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            parcel_projection('everything')
+
+    def test_projected_source_merges_doc_value_fields(self):
+        hit = {'_source': {'properties': {'areaValue': 1250.0}},
+               'fields': {'properties.nationalCadastralReference': ['37284A00600106'],
+                          'properties.sigpacData.USO_SIGPAC': ['TA', 'PS']}}
+
+        self.assertEqual(projected_source(hit),
+                         {'properties': {'areaValue': 1250.0,
+                                         'nationalCadastralReference': '37284A00600106',
+                                         'sigpacData': {'USO_SIGPAC': ['TA', 'PS']}}})
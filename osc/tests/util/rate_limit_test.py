@@ -0,0 +1,33 @@
+from django.test import TestCase
+import mock
+
+from osc.util.rate_limit import TokenBucket
+
+
+class TokenBucketTest(TestCase):
+
+    @mock.patch('osc.util.rate_limit.time.sleep')
+    @mock.patch('osc.util.rate_limit.default_timer', return_value=0)
+    def test_consume_does_not_wait_while_there_are_tokens(self,
+                                                          m_default_timer,
+                                                          m_sleep):
+        bucket = TokenBucket(rate=1, capacity=3)
+
+        bucket.consume()
+        bucket.consume()
+        bucket.consume()
+
+        m_sleep.assert_not_called()
+
+    @mock.patch('osc.util.rate_limit.time.sleep')
+    @mock.patch('osc.util.rate_limit.default_timer')
+    def test_consume_waits_for_the_next_token(self,
+                                              m_default_timer,
+                                              m_sleep):
+        m_default_timer.side_effect = [0, 0, 0, 0.5]
+        bucket = TokenBucket(rate=2, capacity=1)
+
+        bucket.consume()
+        bucket.consume()
+
+        m_sleep.assert_called_once_with(0.5)
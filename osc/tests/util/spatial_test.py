@@ -0,0 +1,69 @@
+from django.test import TestCase
+from geopy.distance import great_circle
+import mock
+
+from osc.util import CachedSpatialIndex, SpatialIndex, geo_point_lat_lon
+
+
+class SpatialIndexTest(TestCase):
+
+    def setUp(self):
+        self.points = [(40.96, -5.66),   # Salamanca
+                       (41.65, -4.72),   # Valladolid
+                       (42.60, -5.57),   # Leon
+                       (40.65, -4.70)]   # Avila
+        self.index = SpatialIndex(['SA', 'VA', 'LE', 'AV'], self.points)
+
+    def test_query_returns_closest_item_and_distance(self):
+        closest = self.index.query(40.97, -5.60)
+
+        self.assertEqual(len(closest), 1)
+        item, distance = closest[0]
+        self.assertEqual(item, 'SA')
+        self.assertAlmostEqual(distance,
+                               great_circle((40.97, -5.60), self.points[0]).kilometers,
+                               places=3)
+
+    def test_query_returns_k_closest_sorted_by_distance(self):
+        closest = self.index.query(41.60, -4.80, k=3)
+
+        self.assertEqual([item for item, distance in closest], ['VA', 'SA', 'AV'])
+        distances = [distance for item, distance in closest]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_query_many_answers_every_point(self):
+        closest = self.index.query_many([(42.5, -5.5), (40.6, -4.6), (40.9, -5.7)])
+
+        self.assertEqual([result[0][0] for result in closest], ['LE', 'AV', 'SA'])
+
+    def test_empty_index_has_no_neighbours(self):
+        self.assertEqual(SpatialIndex([], []).query(40.0, -5.0), [])
+
+    def test_geo_point_formats(self):
+        self.assertEqual(geo_point_lat_lon({'lat': 40.5, 'lon': -5.5}), (40.5, -5.5))
+        self.assertEqual(geo_point_lat_lon([-5.5, 40.5]), (40.5, -5.5))
+        self.assertEqual(geo_point_lat_lon('40.5,-5.5'), (40.5, -5.5))
+
+
+class CachedSpatialIndexTest(TestCase):
+
+    def test_loads_index_once_until_invalidated(self):
+        loader = mock.Mock(return_value=SpatialIndex(['SA'], [(40.96, -5.66)]))
+        index = CachedSpatialIndex('TEST', loader, ttl=60)
+
+        index.query(40.0, -5.0)
+        index.query_many([(41.0, -5.0)])
+        self.assertEqual(loader.call_count, 1)
+
+        index.invalidate()
+        index.query(40.0, -5.0)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_reloads_index_when_ttl_expires(self):
+        loader = mock.Mock(return_value=SpatialIndex([], []))
+        index = CachedSpatialIndex('TEST', loader, ttl=0)
+
+        index.query(40.0, -5.0)
+        index.query(40.0, -5.0)
+
+        self.assertEqual(loader.call_count, 2)
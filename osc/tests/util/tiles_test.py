@@ -0,0 +1,121 @@
+from django.test import TestCase
+import numpy as np
+
+from osc.util import clip_ring, encode_tile, lon_lat_to_tile, ring_area, \
+    simplify_ring, tile_bounds
+
+
+def read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = ord(data[position])
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_message(data):
+    """{field: [values]} of a protocol buffer message of varints and bytes"""
+    fields = {}
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        if key & 0x7 == 0:
+            value, position = read_varint(data, position)
+        else:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        fields.setdefault(key >> 3, []).append(value)
+    return fields
+
+
+def read_packed(data):
+    values = []
+    position = 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+
+class TilesTest(TestCase):
+
+    def test_tile_bounds_of_world_tile(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+
+        self.assertAlmostEqual(west, -180.0)
+        self.assertAlmostEqual(east, 180.0)
+        self.assertAlmostEqual(north, 85.0511287798)
+        self.assertAlmostEqual(south, -85.0511287798)
+
+    def test_lon_lat_to_tile_maps_bounds_to_corners(self):
+        west, south, east, north = tile_bounds(14, 7934, 6158)
+
+        points = lon_lat_to_tile([[west, north], [east, south]], 14, 7934, 6158)
+
+        np.testing.assert_allclose(points, [[0, 0], [4096, 4096]], atol=1e-6)
+
+    def test_simplify_ring_removes_points_within_tolerance(self):
+        points = np.array([[0, 0], [5, 0.4], [10, 0], [10, 10], [0, 10], [0, 0]],
+                          dtype=float)
+
+        simplified = simplify_ring(points, 1)
+
+        np.testing.assert_array_equal(simplified,
+                                      [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]])
+
+    def test_simplify_ring_keeps_points_beyond_tolerance(self):
+        points = np.array([[0, 0], [5, 3], [10, 0], [10, 10], [0, 10], [0, 0]],
+                          dtype=float)
+
+        self.assertEqual(len(simplify_ring(points, 1)), 6)
+
+    def test_clip_ring_to_square(self):
+        points = np.array([[-10, -10], [20, -10], [20, 20], [-10, 20]], dtype=float)
+
+        clipped = clip_ring(points, 0, 10)
+
+        self.assertEqual(sorted(map(tuple, clipped)),
+                         [(0, 0), (0, 10), (10, 0), (10, 10)])
+
+    def test_clip_ring_outside_square_is_empty(self):
+        points = np.array([[20, 20], [30, 20], [30, 30]], dtype=float)
+
+        self.assertEqual(len(clip_ring(points, 0, 10)), 0)
+
+    def test_ring_area_sign_follows_orientation(self):
+        points = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)
+
+        self.assertEqual(ring_area(points), 100)
+        self.assertEqual(ring_area(points[::-1]), -100)
+
+
+class MVTTest(TestCase):
+
+    def test_encode_tile_layer_and_feature(self):
+        tile = encode_tile({'parcels': [{'rings': [[(1, 1), (3, 1), (3, 3)]],
+                                         'properties': {'use': 'TA', 'area': 2}}]},
+                           extent=4096)
+
+        layers = read_message(tile)[3]
+        self.assertEqual(len(layers), 1)
+
+        layer = read_message(layers[0])
+        self.assertEqual(layer[15], [2])
+        self.assertEqual(layer[1], ['parcels'])
+        self.assertEqual(layer[5], [4096])
+        self.assertEqual(layer[3], ['area', 'use'])
+        self.assertEqual(read_message(layer[4][0]), {5: [2]})
+        self.assertEqual(read_message(layer[4][1]), {1: ['TA']})
+
+        feature = read_message(layer[2][0])
+        self.assertEqual(feature[3], [3])
+        self.assertEqual(read_packed(feature[2][0]), [0, 0, 1, 1])
+        # MoveTo(1, 1), LineTo (2, 0) (0, 2), ClosePath, zigzag encoded deltas
+        self.assertEqual(read_packed(feature[4][0]), [9, 2, 2, 18, 4, 0, 0, 4, 15])
+
+    def test_encode_empty_tile(self):
+        self.assertEqual(encode_tile({}), b'')
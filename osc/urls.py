@@ -40,6 +40,10 @@ urlpatterns = [
     url(r'^auth-update-user', auth.UpdateUser.as_view()),
     url(r'^auth-login', rf_views.obtain_auth_token),
 
+    # Vector tiles
+    url(r'^parcels/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$',
+        rest_api.ParcelTile.as_view(), name='parcel_tiles'),
+
     # Rest framework
     url(r'^$', rest_api.OpenSmartCountryApiView.as_view()),
     url(r'^', include(router.urls)),
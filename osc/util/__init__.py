@@ -3,3 +3,12 @@ from .elastic import *
 from .misc import *
 from .xml import *
 from .timer import *
+from .rate_limit import *
+from .spatial import *
+from .download import *
+from .ftp import *
+from .tiles import *
+from .mvt import *
+from .parcel_cache import *
+from .pagination import *
+from .projections import *
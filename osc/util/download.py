@@ -0,0 +1,177 @@
+from collections import namedtuple
+from contextlib import closing, contextmanager
+import hashlib
+import logging
+import os
+import tempfile
+from urllib import urlopen
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from osc.exceptions import ConnectionError
+
+from django.conf import settings
+
+__all__ = ['CachedDownload',
+           'cached_download',
+           'download_to_file',
+           'downloaded_file',
+           'make_session']
+
+logger = logging.getLogger(__name__)
+
+tmp_dir = settings.AUX_DIRS['tmp_dir']
+cache_dir = settings.AUX_DIRS['cache_dir']
+
+BLOCK_SIZE = 64 * 1024
+
+# A download kept in the cache dir, with the validators to check it again.
+# modified is False when the content is the same as the one validated before
+CachedDownload = namedtuple('CachedDownload',
+                            ['path', 'etag', 'last_modified', 'content_hash', 'modified'])
+
+
+def make_session(pool_size):
+    """HTTP session keeping alive up to pool_size connections per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def is_http(url):
+    return url.startswith('http://') or url.startswith('https://')
+
+
+def open_url(url, service, headers=None, session=None):
+    """
+    Returns (connection, blocks, expected size, response headers) of url.
+    blocks is None when the server answers the content is not modified.
+    HTTP urls are requested through session, to reuse its connections
+    """
+    if is_http(url):
+        response = (session or requests).get(url, headers=headers, stream=True)
+        if response.status_code == 304:
+            return closing(response), None, None, response.headers
+
+        if not response.ok:
+            raise ConnectionError(service,
+                                  'Error connecting to ' + url +
+                                  '. Status code: ' + str(response.status_code))
+
+        content_length = response.headers.get('Content-Length')
+        if 'Content-Encoding' in response.headers:
+            # Content-Length is the size of the encoded body
+            content_length = None
+
+        return closing(response), response.iter_content(BLOCK_SIZE), \
+            content_length, response.headers
+
+    conn = urlopen(url)
+    return closing(conn), iter(lambda: conn.read(BLOCK_SIZE), ''), \
+        conn.info().getheader('Content-Length'), {}
+
+
+def write_blocks(url, service, blocks, content_length, dir, suffix=''):
+    """Writes blocks to a temporary file, returns (path, sha1 of the content)"""
+    content_hash = hashlib.sha1()
+
+    with tempfile.NamedTemporaryFile(dir=dir,
+                                     suffix=suffix,
+                                     delete=False) as tmp_file:
+        try:
+            for block in blocks:
+                tmp_file.write(block)
+                content_hash.update(block)
+        except Exception as e:
+            tmp_file.close()
+            os.remove(tmp_file.name)
+            raise ConnectionError(service,
+                                  'Error downloading ' + url,
+                                  cause=e)
+
+    size = os.path.getsize(tmp_file.name)
+    if content_length is not None and size != int(content_length):
+        os.remove(tmp_file.name)
+        raise ConnectionError(service,
+                              'Incomplete download of ' + url,
+                              actionable_info='{} of {} bytes'.format(size, content_length))
+
+    logger.debug('Downloaded %s: %d bytes', url, size)
+
+    return tmp_file.name, content_hash.hexdigest()
+
+
+def download_to_file(url, service, suffix='', dir=tmp_dir, session=None):
+    """
+    Streams url to a temporary file in dir and returns its path. The size
+    written is checked against the Content-Length announced, if any.
+    """
+    connection, blocks, content_length, headers = \
+        open_url(url, service, session=session)
+
+    with connection:
+        if blocks is None:
+            raise ConnectionError(service, 'Unexpected not modified answer for ' + url)
+
+        path, content_hash = write_blocks(url, service, blocks, content_length, dir, suffix)
+
+    return path
+
+
+@contextmanager
+def downloaded_file(url, service, suffix='', dir=tmp_dir, session=None):
+    """Path of url downloaded to a temporary file, removed on exit"""
+    path = download_to_file(url, service, suffix, dir, session)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+
+def cached_download(url,
+                    service,
+                    etag=None,
+                    last_modified=None,
+                    content_hash=None,
+                    suffix='',
+                    dir=cache_dir):
+    """
+    Downloads url into the cache dir, unless the copy already there is still
+    valid for the server: the request is conditional on the etag and
+    last_modified validators of the previous download.
+    """
+    path = os.path.join(dir, hashlib.sha1(url).hexdigest() + suffix)
+
+    headers = {}
+    if os.path.exists(path) and is_http(url):
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+    connection, blocks, content_length, response_headers = \
+        open_url(url, service, headers)
+
+    with connection:
+        if blocks is None:
+            logger.debug('Not modified: %s', url)
+            return CachedDownload(path, etag, last_modified, content_hash, False)
+
+        tmp_path, new_content_hash = write_blocks(url,
+                                                  service,
+                                                  blocks,
+                                                  content_length,
+                                                  dir,
+                                                  suffix)
+
+    # Replace the cached copy only once the download is complete
+    os.rename(tmp_path, path)
+
+    return CachedDownload(path,
+                          response_headers.get('ETag'),
+                          response_headers.get('Last-Modified'),
+                          new_content_hash,
+                          new_content_hash != content_hash)
@@ -5,55 +5,307 @@ import elasticsearch.helpers as es_helpers
 from elasticsearch import TransportError
 import itertools
 import logging
+import threading
+import time
+from timeit import default_timer
 
 from osc.exceptions import ElasticException
 from osc.util import error_managed
-from osc.util import timer
 
 
 logger = logging.getLogger(__name__)
 
 __all__ = ['wait_for_yellow_cluster_status',
+           'ClusterHealthMonitor',
+           'cluster_health',
+           'BulkStats',
+           'elastic_bulk',
            'elastic_bulk_update',
            'elastic_bulk_save',
            'elastic_index',
            'elastic_update',
+           'elastic_search_after',
            'es']
 
 timeout = settings.ELASTICSEARCH['timeout']
 
+chunk_size = settings.ELASTICSEARCH['chunk_size']
+bulk_max_bytes = settings.ELASTICSEARCH['bulk_max_bytes']
+bulk_max_retries = settings.ELASTICSEARCH['bulk_max_retries']
+bulk_initial_backoff = settings.ELASTICSEARCH['bulk_initial_backoff']
+
+# Bulk item statuses worth sending again: the cluster is overloaded or
+# temporarily unavailable. Any other error (mapping, parsing, missing
+# document...) will fail again, so it is reported straight away.
+RETRYABLE_STATUS = (429, 502, 503, 504)
+
 # Elastic Search
 es = Elasticsearch([settings.ELASTICSEARCH['host']],
                    port=settings.ELASTICSEARCH['port'],
                    use_ssl=settings.ELASTICSEARCH['use_ssl'])
 
 
+class ClusterHealthMonitor(object):
+    """Remembers the last cluster status for `ttl` seconds.
+
+    Writers only ask Elastic for the cluster health when the cached status
+    has expired or was red, instead of paying an extra round trip before
+    every write. `held_back` counts the writers that had to wait for the
+    cluster to leave the red status (or to answer at all), and
+    `held_back_time` the seconds they spent waiting.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.status = None
+        self.checked_at = None
+        # Held while asking Elastic, so only one writer checks at a time
+        self.lock = threading.Lock()
+        # Guards the status and the metrics, never held while asking Elastic
+        self.state_lock = threading.Lock()
+
+        self.checks = 0
+        self.cache_hits = 0
+        self.held_back = 0
+        self.held_back_time = 0.0
+
+    def fresh_status(self):
+        """The cached status when it is healthy and younger than ttl, else None"""
+        with self.state_lock:
+            status, checked_at = self.status, self.checked_at
+        if status in ('green', 'yellow') and checked_at is not None \
+                and default_timer() - checked_at < self.ttl:
+            return status
+        return None
+
+    def is_fresh(self):
+        return self.fresh_status() is not None
+
+    def invalidate(self):
+        with self.state_lock:
+            self.status = None
+
+    def record(self, status):
+        with self.state_lock:
+            self.checked_at = default_timer()
+            self.status = status
+
+    def count(self, metric, value=1):
+        with self.state_lock:
+            setattr(self, metric, getattr(self, metric) + value)
+
+    def wait(self, process_name):
+        status = self.fresh_status()
+        if status:
+            self.count('cache_hits')
+            return status
+
+        with self.lock:
+            # Another writer may have refreshed it while we were waiting
+            status = self.fresh_status()
+            if status:
+                self.count('cache_hits')
+                return status
+
+            start = default_timer()
+            with self.state_lock:
+                held_back = self.status == 'red'
+            try:
+                for retry in itertools.count():
+                    try:
+                        self.count('checks')
+                        cluster_status = es.cluster.health(
+                            wait_for_status='yellow',
+                            timeout=timeout)
+                        logger.debug('Cluster status: %s',
+                                     cluster_status['status'])
+                        status = cluster_status['status']
+                        self.record(status)
+                        if status != 'red':
+                            return status
+                        raise Exception('Red status')
+                    except TransportError as e:
+                        held_back = True
+                        if retry > settings.ELASTICSEARCH['retries']:
+                            raise ElasticException(
+                                process_name,
+                                'Error connecting to elastic',
+                                cause=str(e))
+                    except Exception as e:
+                        held_back = True
+                        if retry > settings.ELASTICSEARCH['retries']:
+                            raise ElasticException(
+                                process_name,
+                                'Error waiting for yellow status',
+                                cause=str(e))
+            finally:
+                if held_back:
+                    with self.state_lock:
+                        self.held_back += 1
+                        self.held_back_time += default_timer() - start
+
+    def metrics(self):
+        with self.state_lock:
+            return {'status': self.status,
+                    'checks': self.checks,
+                    'cache_hits': self.cache_hits,
+                    'held_back': self.held_back,
+                    'held_back_time': self.held_back_time}
+
+
+cluster_health = ClusterHealthMonitor(settings.ELASTICSEARCH['health_ttl'])
+
+
 @error_managed()
 def wait_for_yellow_cluster_status(process_name):
     logger.debug('Check cluster status, waiting for yellow or green status...')
-    for retry in itertools.count():
-        with timer.elapsed_timer() as elapsed:
-            if elapsed() < timeout:
-                try:
-                    cluster_status = es.cluster.health(
-                        wait_for_status='yellow',
-                        timeout=timeout)
-                    logger.debug('Cluster status: %s',
-                                 cluster_status['status'])
-                    if cluster_status['status'] != 'red':
-                        break
-                    raise Exception('Red status')
-                except TransportError as e:
-                    if retry > settings.ELASTICSEARCH['retries']:
-                        raise ElasticException(process_name,
-                                               'Error connecting to elastic',
-                                               cause=str(e))
-                except Exception as e:
-                    if retry > settings.ELASTICSEARCH['retries']:
-                        raise ElasticException(
-                            process_name,
-                            'Error waiting for yellow status',
-                            cause=str(e))
+    return cluster_health.wait(process_name)
+
+
+class BulkStats(object):
+    """Outcome of an `elastic_bulk` run.
+
+    Only the first `max_errors` failures are kept, so that a long import
+    going wrong does not pile up every rejected document in memory.
+    """
+
+    max_errors = 10
+
+    def __init__(self):
+        self.success = 0
+        self.failed = 0
+        self.retried = 0
+        self.errors = []
+
+    def add_failure(self, action, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'_id': action.get('_id'),
+                                'error': error})
+
+    def __repr__(self):
+        return 'BulkStats(success={}, failed={}, retried={})'.format(
+            self.success, self.failed, self.retried)
+
+
+def _chunk_actions(actions, max_docs, max_bytes):
+    """Split a stream of actions into batches by number of docs and size.
+
+    Each batch item keeps the original action next to its serialized bulk
+    lines, so that a failed document can be sent again on its own.
+    """
+    serializer = es.transport.serializer
+
+    chunk = []
+    size = 0
+    for action in actions:
+        meta, source = es_helpers.expand_action(action)
+        lines = [serializer.dumps(meta)]
+        if source is not None:
+            lines.append(serializer.dumps(source))
+        action_size = sum(len(line) + 1 for line in lines)
+
+        if chunk and (len(chunk) >= max_docs
+                      or size + action_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append((action, lines))
+        size += action_size
+
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(process_name, chunk, stats, max_retries, initial_backoff):
+    for attempt in itertools.count():
+        pending = []
+        try:
+            body = '\n'.join(line for _, lines in chunk for line in lines)
+            response = es.bulk(body=body + '\n')
+        except TransportError as e:
+            # The whole request failed, every document is still pending
+            if attempt >= max_retries:
+                for action, _ in chunk:
+                    stats.add_failure(action, str(e))
+                return
+            pending = chunk
+        else:
+            for (action, lines), item in zip(chunk, response['items']):
+                result = next(iter(item.values()))
+                status = result.get('status', 500)
+                if 200 <= status < 300:
+                    stats.success += 1
+                elif status in RETRYABLE_STATUS and attempt < max_retries:
+                    pending.append((action, lines))
+                else:
+                    stats.add_failure(action, result.get('error', status))
+
+        if not pending:
+            return
+
+        # The cluster is struggling, make the next batch check its health
+        cluster_health.invalidate()
+        backoff = initial_backoff * 2 ** attempt
+        logger.warning('%s: retrying %d documents in %s seconds',
+                       process_name, len(pending), backoff)
+        stats.retried += len(pending)
+        time.sleep(backoff)
+        chunk = pending
+
+
+@error_managed()
+def elastic_bulk(process_name,
+                 actions,
+                 max_docs=chunk_size,
+                 max_bytes=bulk_max_bytes,
+                 max_retries=bulk_max_retries,
+                 initial_backoff=bulk_initial_backoff,
+                 raise_on_error=True):
+    """Stream any iterable of bulk actions into Elastic.
+
+    Actions are consumed lazily and sent in batches of at most `max_docs`
+    documents and `max_bytes` bytes, so only one batch is held in memory.
+    Documents rejected because the cluster is overloaded are retried on
+    their own with exponential backoff; the rest of the batch is not sent
+    again.
+
+    :return: a `BulkStats` with the number of stored and failed documents
+    """
+    stats = BulkStats()
+
+    for chunk in _chunk_actions(actions, max_docs, max_bytes):
+        wait_for_yellow_cluster_status(process_name)
+        _send_chunk(process_name, chunk, stats, max_retries, initial_backoff)
+
+    logger.info('%s: %d documents stored, %d failed (%d retries)',
+                process_name, stats.success, stats.failed, stats.retried)
+
+    if stats.failed and raise_on_error:
+        raise ElasticException(process_name,
+                               'Error saving {} documents to Elastic'
+                               .format(stats.failed),
+                               cause=str(stats.errors[0]['error']),
+                               actionable_info=str(stats.errors))
+
+    return stats
+
+
+def bulk_actions(op_type, index, doc_type, records, ids=None, parents=None):
+    ids = ids if ids is not None else itertools.repeat(None)
+    parents = parents if parents is not None else itertools.repeat(None)
+
+    for record, idx, parent in itertools.izip(records, ids, parents):
+        action = {'_op_type': op_type,
+                  '_index': index,
+                  '_type': doc_type,
+                  '_source': record}
+        if idx is not None:
+            action['_id'] = idx
+        if parent is not None:
+            action['_parent'] = parent
+        yield action
 
 
 @error_managed()
@@ -61,33 +313,9 @@ def elastic_bulk_update(process_name,
                         index,
                         doc_type,
                         records,
-                        ids=None,
-                        retry=True):
-    try:
-        if ids is None:
-            ids = [None] * len(records)
-
-        wait_for_yellow_cluster_status(process_name)
-        es_helpers.bulk(es,
-                        ({'_op_type': 'update',
-                          '_index': index,
-                          '_id': idx,
-                          '_type': doc_type,
-                          '_source': r} for (r, idx) in zip(records, ids)))
-    except Exception as e:
-        for (r, idx) in zip(records, ids):
-            if retry:
-                elastic_bulk_update(process_name,
-                                    index,
-                                    doc_type,
-                                    [r],
-                                    [idx],
-                                    retry=False)
-            else:
-                raise ElasticException(process_name,
-                                       'Error saving to Elastic',
-                                       cause=str(e),
-                                       actionable_info=str(r))
+                        ids=None):
+    return elastic_bulk(process_name,
+                        bulk_actions('update', index, doc_type, records, ids))
 
 
 @error_managed(inhibit_exception=True)
@@ -96,38 +324,14 @@ def elastic_bulk_save(process_name,
                       doc_type,
                       records,
                       ids=None,
-                      parents=None,
-                      retry=True):
-    try:
-        if ids is None:
-            ids = [None] * len(records)
-
-        if parents is None:
-            parents = [None] * len(records)
-
-        wait_for_yellow_cluster_status(process_name)
-        es_helpers.bulk(es,
-                        ({'_index': index,
-                          '_id': idx,
-                          '_parent': parent,
-                          '_type': doc_type,
-                          '_source': r} for (r, idx, parent) in zip(records,
-                                                                    ids,
-                                                                    parents)))
-    except Exception as e:
-        for (r, idx) in zip(records, ids):
-            if retry:
-                elastic_bulk_save(process_name,
-                                  index,
-                                  doc_type,
-                                  [r],
-                                  [idx],
-                                  retry=False)
-            else:
-                raise ElasticException(process_name,
-                                       'Error saving to Elastic',
-                                       actionable_info=str(r),
-                                       cause=str(e))
+                      parents=None):
+    return elastic_bulk(process_name,
+                        bulk_actions('index',
+                                     index,
+                                     doc_type,
+                                     records,
+                                     ids,
+                                     parents))
 
 
 @error_managed()
@@ -152,3 +356,20 @@ def elastic_update(process_name, index, doc_type, record, id):
                                'Error updating {} in Elastic'.format(id),
                                actionable_info=str(record),
                                cause=str(e))
+
+
+def elastic_search_after(index, doc_type, body, sort, size):
+    """Yields every hit of the search, reading pages of at most size hits.
+
+    Pages are sorted by `sort`, which must be unique per document, and each
+    one starts after the sort values of the last hit of the previous page.
+    """
+    body = dict(body, sort=sort)
+    while True:
+        hits = es.search(index=index, doc_type=doc_type, body=body, size=size)['hits']['hits']
+        for hit in hits:
+            yield hit
+
+        if len(hits) < size:
+            return
+        body = dict(body, search_after=hits[-1]['sort'])
@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+import ftplib
+import logging
+import Queue
+import threading
+
+__all__ = ['FTPPool']
+
+logger = logging.getLogger(__name__)
+
+
+class FTPPool(object):
+    """Thread safe pool of logged in FTP sessions to a host.
+
+    Sessions are opened on demand, up to `size`, and reused afterwards.
+    `session` blocks the calling thread until a session is free. A session
+    that fails or that the server has closed is replaced by a new one.
+    """
+
+    def __init__(self, host, size=2, user='', passwd=''):
+        self.host = host
+        self.size = size
+        self.user = user
+        self.passwd = passwd
+        self.home = None
+        self._idle = Queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        ftp = ftplib.FTP(self.host)
+        ftp.login(self.user, self.passwd)
+        if self.home is None:
+            self.home = ftp.pwd()
+        logger.debug('FTP session opened to %s', self.host)
+        return ftp
+
+    def _acquire(self):
+        with self._lock:
+            can_open = self._idle.empty() and self._opened < self.size
+            if can_open:
+                self._opened += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                self._discard(None)
+                raise
+
+        ftp = self._idle.get()
+        try:
+            ftp.cwd(self.home)
+            return ftp
+        except ftplib.all_errors:
+            # Closed by the server while idle
+            self._discard(ftp)
+            return self._acquire()
+
+    def _discard(self, ftp):
+        with self._lock:
+            self._opened -= 1
+        if ftp is not None:
+            ftp.close()
+
+    @contextmanager
+    def session(self):
+        """A logged in session in the home directory"""
+        ftp = self._acquire()
+        try:
+            yield ftp
+        except Exception:
+            self._discard(ftp)
+            raise
+        else:
+            self._idle.put(ftp)
+
+    def close(self):
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                pass
+            self._discard(ftp)
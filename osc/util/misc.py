@@ -19,3 +19,33 @@ def num(s):
 
 def contains_any(text, text_list):
     return len([t for t in text_list if t.lower() in text.lower()]) >= 1
+
+
+class ForwardReader(object):
+    """
+    Read only file object over a stream that cannot seek, like a zip member.
+    Seeks are only allowed forward, skipping the data in between, which is
+    enough for readers that go through a file sequentially
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence != 0 or offset < self.position:
+            raise IOError('Only forward seeks are allowed')
+
+        while self.position < offset:
+            if not self.read(min(self.block_size, offset - self.position)):
+                break
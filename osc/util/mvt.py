@@ -0,0 +1,130 @@
+import struct
+
+__all__ = ['encode_tile', 'MVT_CONTENT_TYPE']
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+# Protocol buffer wire types
+VARINT = 0
+LENGTH_DELIMITED = 2
+FIXED64 = 1
+
+# Geometry types and commands of the Mapbox Vector Tile specification 2.1
+POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+
+def varint(value):
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def key(field, wire_type):
+    return varint(field << 3 | wire_type)
+
+
+def varint_field(field, value):
+    return key(field, VARINT) + varint(value)
+
+
+def bytes_field(field, data):
+    return key(field, LENGTH_DELIMITED) + varint(len(data)) + data
+
+
+def packed_field(field, values):
+    return bytes_field(field, b''.join(varint(value) for value in values))
+
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, (int, long)):
+        return varint_field(6, zigzag(value)) if value < 0 else varint_field(5, value)
+    if isinstance(value, float):
+        return key(3, FIXED64) + struct.pack('<d', value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return bytes_field(1, str(value))
+
+
+def command(command_id, count):
+    return command_id & 0x7 | count << 3
+
+
+def encode_polygon(rings):
+    """
+    Geometry commands of a polygon or multipolygon given as rings of integer
+    tile coordinates, not closed, with exterior rings of positive area
+    """
+    commands = []
+    cursor_x = cursor_y = 0
+    for ring in rings:
+        x, y = ring[0]
+        commands += [command(MOVE_TO, 1), zigzag(x - cursor_x), zigzag(y - cursor_y)]
+        cursor_x, cursor_y = x, y
+
+        commands.append(command(LINE_TO, len(ring) - 1))
+        for x, y in ring[1:]:
+            commands += [zigzag(x - cursor_x), zigzag(y - cursor_y)]
+            cursor_x, cursor_y = x, y
+
+        commands.append(command(CLOSE_PATH, 1))
+
+    return commands
+
+
+def encode_layer(name, features, extent):
+    keys = {}
+    values = {}
+    encoded_features = []
+
+    for feature in features:
+        tags = []
+        for tag_key, tag_value in sorted(feature.get('properties', {}).items()):
+            if tag_value is None:
+                continue
+            tags.append(keys.setdefault(tag_key, len(keys)))
+            tags.append(values.setdefault((type(tag_value), tag_value), len(values)))
+
+        data = b''
+        if feature.get('id') is not None:
+            data += varint_field(1, feature['id'])
+        if tags:
+            data += packed_field(2, tags)
+        data += varint_field(3, POLYGON)
+        data += packed_field(4, encode_polygon(feature['rings']))
+
+        encoded_features.append(data)
+
+    layer = varint_field(15, 2) + bytes_field(1, name.encode('utf-8'))
+    for data in encoded_features:
+        layer += bytes_field(2, data)
+    for tag_key in sorted(keys, key=keys.get):
+        layer += bytes_field(3, tag_key.encode('utf-8'))
+    for tag_value in sorted(values, key=values.get):
+        layer += bytes_field(4, encode_value(tag_value[1]))
+    layer += varint_field(5, extent)
+
+    return layer
+
+
+def encode_tile(layers, extent=4096):
+    """
+    Encodes a Mapbox Vector Tile of polygon layers, given as a dict of
+    {name: [{'id': ..., 'properties': {...}, 'rings': [...]}]}
+    """
+    return b''.join(bytes_field(3, encode_layer(name, features, extent))
+                    for name, features in sorted(layers.items()))
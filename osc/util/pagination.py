@@ -0,0 +1,23 @@
+import base64
+import json
+
+__all__ = ['encode_page_token', 'decode_page_token']
+
+
+def encode_page_token(search_after):
+    """Opaque token of the sort values of the last hit of a page"""
+    return base64.urlsafe_b64encode(json.dumps(search_after,
+                                               separators=(',', ':')))
+
+
+def decode_page_token(token):
+    """Sort values to search after, ValueError if the token is not valid"""
+    try:
+        search_after = json.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise ValueError('Invalid page token: {}'.format(token))
+
+    if not isinstance(search_after, list) or not search_after:
+        raise ValueError('Invalid page token: {}'.format(token))
+
+    return search_after
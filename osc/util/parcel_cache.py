@@ -0,0 +1,337 @@
+import itertools
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+import geohash
+
+from osc.exceptions import ElasticException
+from osc.util.elastic import elastic_search_after
+from osc.util.elastic import es
+from osc.util.projections import PARCEL_PROJECTIONS
+from osc.util.projections import parcel_projection
+from osc.util.projections import projected_source
+from osc.util.spatial import geo_point_lat_lon
+
+__all__ = ['geohash_cells',
+           'aggregate_parcel_cells',
+           'get_cached_parcel_documents',
+           'get_cached_parcel_buckets',
+           'invalidate_parcel_cells',
+           'invalidate_parcel_buckets']
+
+logger = logging.getLogger(__name__)
+
+parcel_index = settings.CADASTRE['index']
+parcel_mapping = settings.CADASTRE['mapping']
+max_elastic_query_size = settings.CADASTRE['max.query.size']
+
+cell_precision = settings.CADASTRE['cache.cell_precision']
+bucket_cell_depth = settings.CADASTRE['cache.bucket_cell_depth']
+max_cells = settings.CADASTRE['cache.max_cells']
+cache_timeout = settings.CADASTRE['cache.timeout']
+
+pyramid_index = settings.CADASTRE['pyramid.index']
+pyramid_mapping = settings.CADASTRE['pyramid.mapping']
+pyramid_max_precision = settings.CADASTRE['pyramid.max_precision']
+
+MAX_GEOHASH_PRECISION = 12
+
+# Cadastral references are unique, so they can be paged with search_after
+PARCEL_SORT = [{'properties.nationalCadastralReference': 'asc'}]
+
+
+def geohash_cells(west, south, east, north, precision, max_cells=None):
+    """
+    Geohashes of the cells of the given precision covering the bbox, None
+    when they would be more than max_cells
+    """
+    south, north = max(south, -90.0), min(north, 90.0)
+    box = geohash.bbox(geohash.encode(south, west, precision))
+    lat_step = box['n'] - box['s']
+    lon_step = box['e'] - box['w']
+
+    rows = int((north - box['s']) // lat_step) + 1
+    columns = int((east - box['w']) // lon_step) + 1
+    if max_cells is not None and rows * columns > max_cells:
+        return None
+
+    cells = set()
+    for row in range(rows):
+        lat = min(box['s'] + (row + 0.5) * lat_step, 90.0)
+        for column in range(columns):
+            lon = box['w'] + (column + 0.5) * lon_step
+            cells.add(geohash.encode(lat, lon, precision))
+
+    return sorted(cells)
+
+
+def bucket_precision_of_cells(precision):
+    """
+    Cells of the buckets of the given precision hold up to
+    32 ** bucket_cell_depth buckets
+    """
+    return max(1, precision - bucket_cell_depth)
+
+
+def cell_filter(cell):
+    if not cell:
+        return {"match_all": {}}
+
+    box = geohash.bbox(cell)
+    return {
+        "geo_bounding_box": {
+            "properties.reference_point": {
+                "top": box['n'],
+                "left": box['w'],
+                "bottom": box['s'],
+                "right": box['e']
+            }
+        }
+    }
+
+
+def multi_search(cells, index, doc_type, queries):
+    """Responses of one query per cell in a single multi search request"""
+    request = []
+    for query in queries:
+        request.append({'index': index, 'type': doc_type})
+        request.append(query)
+
+    return zip(cells, es.msearch(body=request)['responses'])
+
+
+def cell_query(cell):
+    return {'bool': {'filter': cell_filter(cell)}}
+
+
+def search_cells(cells, body):
+    """The parcels of every cell searched with body"""
+    results = multi_search(cells,
+                           parcel_index,
+                           parcel_mapping,
+                           [dict(body, query=cell_query(cell)) for cell in cells])
+
+    for cell, response in results:
+        if 'error' in response:
+            raise ElasticException('PARCEL',
+                                   'Error searching parcels of cell ' + cell,
+                                   cause=response['error'])
+
+    return results
+
+
+def load_documents(profile):
+    def load(cells):
+        projection = parcel_projection(profile)
+        results = search_cells(cells, dict(projection,
+                                           size=max_elastic_query_size,
+                                           sort=PARCEL_SORT))
+
+        documents = {}
+        for cell, response in results:
+            hits = response['hits']['hits']
+            if response['hits']['total'] > max_elastic_query_size:
+                # Dense cells are read page by page after their first page
+                logger.debug('Paging %d parcels of cell %s', response['hits']['total'], cell)
+                hits = itertools.chain(hits, elastic_search_after(
+                    parcel_index,
+                    parcel_mapping,
+                    dict(projection, query=cell_query(cell), search_after=hits[-1]['sort']),
+                    PARCEL_SORT,
+                    max_elastic_query_size))
+
+            documents[cell] = [projected_source(hit) for hit in hits]
+
+        return documents
+
+    return load
+
+
+def aggregate_parcel_cells(cells, precision):
+    """
+    {cell: geohash_grid buckets of the given precision} of cells of the same
+    precision, '' being the whole world. Every bucket is in one cell only
+    """
+    size = 32 ** (precision - len(cells[0]))
+    body = {
+        'size': 0,
+        'aggs': {
+            'cells': {
+                'geohash_grid': {
+                    'field': 'properties.reference_point',
+                    'precision': precision,
+                    'size': size,
+                    'shard_size': size
+                },
+                'aggs': {
+                    'area': {
+                        'sum': {
+                            'field': 'properties.areaValue'
+                        }
+                    }
+                }
+            }
+        }
+    }
+    results = search_cells(cells, body)
+
+    # Points on the edge of a cell are found by its neighbours too
+    return dict((cell, [{'key': bucket['key'],
+                         'doc_count': bucket['doc_count'],
+                         'area': {'value': bucket['area']['value']}}
+                        for bucket in response['aggregations']['cells']['buckets']
+                        if bucket['key'].startswith(cell)])
+                for cell, response in results)
+
+
+def read_pyramid_cells(cells, precision):
+    """
+    {cell: buckets of the given precision} read by prefix from the geohash
+    pyramid, None when the pyramid is not available
+    """
+    size = 32 ** (precision - len(cells[0]))
+    queries = [{'size': size,
+                'query': {
+                    'bool': {
+                        'filter': [
+                            {'term': {'precision': precision}},
+                            {'prefix': {'geohash': cell}}]}}}
+               for cell in cells]
+
+    results = multi_search(cells, pyramid_index, pyramid_mapping, queries)
+
+    for cell, response in results:
+        if 'error' in response:
+            logger.warning('Parcel pyramid not available: %s', response['error'])
+            return None
+
+    return dict((cell, [{'key': hit['_source']['geohash'],
+                         'doc_count': hit['_source']['count'],
+                         'area': {'value': hit['_source']['area']}}
+                        for hit in response['hits']['hits']])
+                for cell, response in results)
+
+
+def load_buckets(precision):
+    def load(cells):
+        if precision <= pyramid_max_precision:
+            buckets = read_pyramid_cells(cells, precision)
+            if buckets is not None:
+                return buckets
+
+        return aggregate_parcel_cells(cells, precision)
+
+    return load
+
+
+def cache_key(kind, cell):
+    return '{}:{}:{}'.format(parcel_index, kind, cell)
+
+
+def buckets_version():
+    """Version of the cached buckets, changed on every rebuild of the pyramid"""
+    return cache.get(cache_key('buckets', 'version'), 0)
+
+
+def buckets_kind(version, precision):
+    return 'buckets.{}.{}'.format(version, precision)
+
+
+def cached_cells(kind, cells, load):
+    """{cell: value} read from the cache, loading and caching the missing cells"""
+    keys = dict((cell, cache_key(kind, cell)) for cell in cells)
+    cached = cache.get_many(keys.values())
+
+    values = dict((cell, cached[key]) for cell, key in keys.items() if key in cached)
+    missing = [cell for cell in cells if cell not in values]
+    logger.debug('%s cells: %d cached, %d loaded', kind, len(values), len(missing))
+
+    if missing:
+        loaded = load(missing)
+        cache.set_many(dict((keys[cell], value) for cell, value in loaded.items()),
+                       cache_timeout)
+        values.update(loaded)
+
+    return values
+
+
+def in_bbox(parcel, west, south, east, north):
+    try:
+        lat, lon = geo_point_lat_lon(parcel['properties']['reference_point'])
+    except (KeyError, TypeError):
+        return False
+    return south <= lat <= north and west <= lon <= east
+
+
+def get_cached_parcel_documents(west, south, east, north,
+                                size=max_elastic_query_size,
+                                search_after=None,
+                                profile='full'):
+    """
+    Up to size parcel documents with their reference point in the bbox,
+    sorted by cadastral reference after the one of search_after, with the
+    fields of the projection profile. They are assembled from the cached
+    cells of the grid, None when the bbox spans too many cells
+    """
+    cells = geohash_cells(west, south, east, north, cell_precision, max_cells)
+    if cells is None:
+        return None
+
+    documents = {}
+    kind = 'docs.{}'.format(profile)
+    for cell_documents in cached_cells(kind, cells, load_documents(profile)).itervalues():
+        for document in cell_documents:
+            code = document['properties'].get('nationalCadastralReference')
+            if (search_after is None or code > search_after[0]) and \
+                    in_bbox(document, west, south, east, north):
+                documents[code] = document
+
+    return [documents[key] for key in sorted(documents)[:size]]
+
+
+def get_cached_parcel_buckets(west, south, east, north, precision):
+    """
+    geohash_grid buckets of the given precision that intersect the bbox,
+    assembled from the cached cells of the grid, or None when the bbox spans
+    too many cells
+    """
+    cells = geohash_cells(west, south, east, north,
+                          bucket_precision_of_cells(precision), max_cells)
+    if cells is None:
+        return None
+
+    buckets = []
+    kind = buckets_kind(buckets_version(), precision)
+    for cell_buckets in cached_cells(kind, cells, load_buckets(precision)).itervalues():
+        for bucket in cell_buckets:
+            box = geohash.bbox(bucket['key'])
+            if box['s'] <= north and box['n'] >= south and \
+                    box['w'] <= east and box['e'] >= west:
+                buckets.append(bucket)
+
+    return buckets
+
+
+def invalidate_parcel_cells(reference_points):
+    """Removes from the cache every cell containing one of the reference points"""
+    version = buckets_version()
+    keys = set()
+    for reference_point in reference_points:
+        lat, lon = geo_point_lat_lon(reference_point)
+        code = geohash.encode(lat, lon, MAX_GEOHASH_PRECISION)
+
+        for profile in PARCEL_PROJECTIONS:
+            keys.add(cache_key('docs.{}'.format(profile), code[:cell_precision]))
+        for precision in range(1, MAX_GEOHASH_PRECISION + 1):
+            keys.add(cache_key(buckets_kind(version, precision),
+                               code[:bucket_precision_of_cells(precision)]))
+
+    if keys:
+        cache.delete_many(list(keys))
+
+
+def invalidate_parcel_buckets():
+    """Removes from the cache the buckets of every cell"""
+    key = cache_key('buckets', 'version')
+    cache.set(key, cache.get(key, 0) + 1, None)
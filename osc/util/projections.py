@@ -0,0 +1,66 @@
+import copy
+
+__all__ = ['PARCEL_PROJECTIONS',
+           'PARCEL_LIST_PROFILE',
+           'parcel_projection',
+           'projected_source']
+
+# Properties of the parcel documents kept by the API
+PARCEL_SUMMARY_PROPERTIES = ['properties.areaValue',
+                             'properties.elevation',
+                             'properties.reference_point',
+                             'properties.cadastralData.bico.bi.ldt',
+                             'properties.cadastralData.control.cucons',
+                             'properties.cadastralData.bico.lspr.spr.dspr.dcc',
+                             'properties.sigpacData.POLIGONO',
+                             'properties.sigpacData.PARCELA',
+                             'properties.sigpacData.MUNICIPIO',
+                             'properties.sigpacData.PROVINCIA',
+                             'properties.sigpacData.USO_SIGPAC',
+                             'properties.sigpacUses']
+
+# Keywords are read from their doc values instead of the _source
+PARCEL_DOCVALUE_FIELDS = ['properties.nationalCadastralReference']
+
+# Search parameters of each projection profile of the parcel documents
+PARCEL_PROJECTIONS = {
+    'full': {},
+    'map': {
+        '_source': {
+            'includes': ['geometry'] + PARCEL_SUMMARY_PROPERTIES
+        },
+        'docvalue_fields': PARCEL_DOCVALUE_FIELDS
+    },
+    'summary': {
+        '_source': {
+            'includes': PARCEL_SUMMARY_PROPERTIES
+        },
+        'docvalue_fields': PARCEL_DOCVALUE_FIELDS
+    }
+}
+
+# Projection profile of the parcel listings of a bbox when none is asked
+PARCEL_LIST_PROFILE = 'map'
+
+
+def parcel_projection(profile):
+    """Search parameters of a projection profile, ValueError if it is unknown"""
+    if profile not in PARCEL_PROJECTIONS:
+        raise ValueError('Unknown projection profile: {}. Valid ones: {}'
+                         .format(profile, ', '.join(sorted(PARCEL_PROJECTIONS))))
+
+    return copy.deepcopy(PARCEL_PROJECTIONS[profile])
+
+
+def projected_source(hit):
+    """_source of a search hit with its doc value fields merged into it"""
+    source = hit.get('_source', {})
+
+    for name, values in hit.get('fields', {}).items():
+        parent = source
+        keys = name.split('.')
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[keys[-1]] = values[0] if len(values) == 1 else values
+
+    return source
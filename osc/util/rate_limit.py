@@ -0,0 +1,37 @@
+import threading
+import time
+from timeit import default_timer
+
+__all__ = ['TokenBucket']
+
+
+class TokenBucket(object):
+    """Thread safe token bucket.
+
+    Allows `rate` operations per second on average, with bursts of up to
+    `capacity` operations. `consume` blocks the calling thread until a
+    token is available.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = default_timer()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        while True:
+            with self.lock:
+                now = default_timer()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(wait)
@@ -0,0 +1,132 @@
+import logging
+import threading
+from timeit import default_timer
+
+import numpy as np
+
+__all__ = ['SpatialIndex', 'CachedSpatialIndex', 'geo_point_lat_lon']
+
+logger = logging.getLogger(__name__)
+
+# Same mean earth radius used by geopy's great_circle
+EARTH_RADIUS_KM = 6372.795
+
+# Number of queries compared at once against every point of the index
+QUERY_BLOCK_SIZE = 1024
+
+
+def geo_point_lat_lon(value):
+    """
+    Returns (lat, lon) of an Elasticsearch geo_point given as an object,
+    a [lon, lat] array or a "lat,lon" string
+    """
+    if isinstance(value, dict):
+        return float(value['lat']), float(value['lon'])
+    if isinstance(value, (list, tuple)):
+        return float(value[1]), float(value[0])
+
+    lat, lon = value.split(',')
+    return float(lat), float(lon)
+
+
+def to_unit_vectors(lat_lons):
+    lat_lons = np.radians(np.asarray(lat_lons, dtype=float).reshape(-1, 2))
+    lat, lon = lat_lons[:, 0], lat_lons[:, 1]
+
+    return np.column_stack((np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)))
+
+
+class SpatialIndex(object):
+    """
+    Nearest neighbour index of a small set of points. Points are kept as
+    unit vectors, so the closest points are the ones with the greatest dot
+    product and queries are answered with one vectorized product.
+    """
+
+    def __init__(self, items, lat_lons):
+        self.items = list(items)
+        self.points = to_unit_vectors(lat_lons) if self.items \
+            else np.empty((0, 3))
+
+    def __len__(self):
+        return len(self.items)
+
+    def query(self, lat, lon, k=1):
+        """Returns the k closest [(item, distance_km)] to (lat, lon)"""
+        return self.query_many([(lat, lon)], k)[0]
+
+    def query_many(self, lat_lons, k=1):
+        """Returns the k closest [(item, distance_km)] to every (lat, lon)"""
+        lat_lons = list(lat_lons)
+        if not lat_lons:
+            return []
+        if not self.items:
+            return [[] for _ in lat_lons]
+
+        k = min(k, len(self.items))
+        queries = to_unit_vectors(lat_lons)
+
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            dots = np.clip(queries[start:start + QUERY_BLOCK_SIZE].dot(self.points.T),
+                           -1.0, 1.0)
+
+            if k < len(self.items):
+                closest = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            else:
+                closest = np.tile(np.arange(len(self.items)), (len(dots), 1))
+
+            for row, candidates in zip(dots, closest):
+                candidates = candidates[np.argsort(-row[candidates])]
+                distances = np.arccos(row[candidates]) * EARTH_RADIUS_KM
+                results.append([(self.items[i], float(distance))
+                                for i, distance in zip(candidates, distances)])
+
+        return results
+
+
+class CachedSpatialIndex(object):
+    """
+    Process-local SpatialIndex built by loader and rebuilt once it is older
+    than ttl seconds or after invalidate(). Points imported by another
+    process, like a management command, are only seen once the ttl expires
+    """
+
+    def __init__(self, name, loader, ttl):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self._index = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._index is not None and \
+            default_timer() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._loaded_at = None
+
+    def get(self):
+        with self._lock:
+            if not self.is_fresh():
+                start = default_timer()
+                self._index = self.loader()
+                self._loaded_at = default_timer()
+
+                logger.info('Spatial index %s loaded: %d points in %.2f s',
+                            self.name,
+                            len(self._index),
+                            self._loaded_at - start)
+
+            return self._index
+
+    def query(self, lat, lon, k=1):
+        return self.get().query(lat, lon, k)
+
+    def query_many(self, lat_lons, k=1):
+        return self.get().query_many(lat_lons, k)
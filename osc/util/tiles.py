@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+
+__all__ = ['tile_bounds',
+           'lon_lat_to_tile',
+           'simplify_ring',
+           'clip_ring',
+           'ring_area']
+
+# Web mercator latitude limit, where the map is square
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_bounds(z, x, y):
+    """Returns (west, south, east, north) of a XYZ tile in degrees"""
+    n = 2.0 ** z
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)
+
+
+def lon_lat_to_tile(lon_lats, z, x, y, extent=4096):
+    """
+    Converts an array of [lon, lat] rows into the coordinates of the tile,
+    from (0, 0) in its north west corner to (extent, extent)
+    """
+    lon_lats = np.asarray(lon_lats, dtype=float).reshape(-1, 2)
+    lat = np.radians(np.clip(lon_lats[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    n = 2.0 ** z
+
+    tile_x = (lon_lats[:, 0] + 180.0) / 360.0 * n
+    tile_y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * n
+
+    return np.column_stack(((tile_x - x) * extent, (tile_y - y) * extent))
+
+
+def simplify_ring(points, tolerance):
+    """Douglas-Peucker simplification of an array of points"""
+    if len(points) < 3 or tolerance <= 0:
+        return points
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        segment = points[end] - points[start]
+        inner = points[start + 1:end] - points[start]
+        length = math.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return points[keep]
+
+
+def clip_ring(points, min_value, max_value):
+    """Sutherland-Hodgman clipping of a closed ring to a square"""
+    def clip(points, axis, value, inside):
+        if not len(points):
+            return points
+
+        clipped = []
+        previous = points[-1]
+        for point in points:
+            if inside(point[axis], value):
+                if not inside(previous[axis], value):
+                    clipped.append(intersection(previous, point, axis, value))
+                clipped.append(point)
+            elif inside(previous[axis], value):
+                clipped.append(intersection(previous, point, axis, value))
+            previous = point
+
+        return np.array(clipped).reshape(-1, 2)
+
+    def intersection(a, b, axis, value):
+        t = (value - a[axis]) / (b[axis] - a[axis])
+        return a + t * (b - a)
+
+    def above(coordinate, value):
+        return coordinate >= value
+
+    def below(coordinate, value):
+        return coordinate <= value
+
+    for axis in (0, 1):
+        points = clip(points, axis, min_value, above)
+        points = clip(points, axis, max_value, below)
+
+    return points
+
+
+def ring_area(points):
+    """Signed area of a ring by the shoelace formula"""
+    x, y = points[:, 0], points[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2.0
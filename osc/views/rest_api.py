@@ -3,10 +3,15 @@ from osc.models.parcel import getParcelByNationalCadastralReference
 from osc.models.parcel import getParcels
 from osc.models import UserParcel
 from osc.serializers import UserParcelSerializer
+import osc.services.cadastre as cadastre_service
 import osc.services.crop as crop_service
 import osc.services.google as google_service
 import osc.services.parcels as parcel_service
 import osc.services.users as users_service
+from osc.util import MVT_CONTENT_TYPE
+from osc.util import decode_page_token
+from osc.util import PARCEL_LIST_PROFILE
+from osc.util import parcel_projection
 
 from rest_framework import generics
 from rest_framework.parsers import JSONParser
@@ -17,6 +22,32 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework import viewsets
 
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+parcels_page_size = settings.WEB['parcels.page_size']
+tiles_max_age = settings.CADASTRE['tiles.max_age']
+max_elastic_query_size = settings.CADASTRE['max.query.size']
+
+
+def get_page_params(request):
+    """
+    (page, page_size) asked by the request, page_size is None when neither
+    of them is sent so the whole list is returned
+    """
+    if 'page' not in request.query_params and \
+            'page_size' not in request.query_params:
+        return 1, None
+
+    page = int(request.query_params.get('page', 1))
+    page_size = int(request.query_params.get('page_size', parcels_page_size))
+
+    if page < 1 or page_size < 1:
+        raise ValueError('page and page_size should be positive')
+
+    return page, page_size
+
 
 class GoogleElevationList(generics.RetrieveAPIView):
     """Obtain elevations from google from google"""
@@ -40,7 +71,10 @@ class GoogleElevationList(generics.RetrieveAPIView):
 
 
 class ParcelList(APIView):
-    """Obtain parcels with associated information"""
+    """
+    Obtain parcels with associated information. The parcels of a bbox take
+    the same profile query parameter as /parcels/
+    """
 
     def get(self, request):
         try:
@@ -73,13 +107,28 @@ class ParcelList(APIView):
                 else:
                     precision = 0
 
+                page_size = int(request.query_params.get('page_size',
+                                                         max_elastic_query_size))
+                page_token = request.query_params.get('page_token', None)
+                search_after = decode_page_token(page_token) \
+                    if page_token is not None else None
+                profile = request.query_params.get('profile',
+                                                   PARCEL_LIST_PROFILE)
+                # Unknown profiles are a bad request, not a service error
+                parcel_projection(profile)
+
                 parcels = parcel_service.obtain_parcels_by_bbox(lat_min,
                                                                 lon_min,
                                                                 lat_max,
                                                                 lon_max,
-                                                                precision)
+                                                                precision,
+                                                                page_size,
+                                                                search_after,
+                                                                profile)
 
             return Response(parcels)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except OSCException as e:
             message = '%s: %s - %s' % (type(e), e.message, e.cause)
             return Response({'error': message})
@@ -143,11 +192,14 @@ class UserParcelsList(APIView):
             request.query_params.get('retrieve_soil_info', None)
 
         try:
+            page, page_size = get_page_params(request)
             parcels = users_service.get_parcels(
                 username,
                 retrieve_public_info_param == 'True',
                 retrieve_climate_info_param == 'True',
-                retrieve_soil_info_param == 'True')
+                retrieve_soil_info_param == 'True',
+                page=page,
+                page_size=page_size)
 
             return Response(parcels, status=status.HTTP_200_OK)
         except Exception as e:
@@ -202,12 +254,19 @@ class OwnedParcels(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, format=None):
+        try:
+            page, page_size = get_page_params(request)
+        except ValueError as e:
+            return Response({'msg': e.message},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         return Response(
             data={'parcels': users_service.get_parcels(None,
                                                        True,
                                                        False,
-                                                       False)},
+                                                       False,
+                                                       page=page,
+                                                       page_size=page_size)},
             status=status.HTTP_200_OK)
 
 
@@ -261,9 +320,41 @@ class ParcelViewSet(viewsets.ViewSet):
             <td>Agreggregates parcels and group it into buckets that represent cells ins a grid, can have a choice of presision between 1 and 12.</td>
             <td>?bbox=-5.763941,40.435861,-5.746592,40.441145&precission=5</td>
         </tr>
+        <tr>
+            <td>page_size</td>
+            <td>20, 5000 with bbox</td>
+            <td>Number of parcels of the page, sorted by cadastral reference. Up to 5000.</td>
+            <td>?bbox=-5.763941,40.435861,-5.746592,40.441145&page_size=100</td>
+        </tr>
+        <tr>
+            <td>page_token</td>
+            <td>None</td>
+            <td>Token of the next page, given as next_page_token in the previous page. It is null in the last page.</td>
+            <td>?bbox=-5.763941,40.435861,-5.746592,40.441145&page_size=100&page_token=WyIzNzI4NEEwMDYwMDEwNiJd</td>
+        </tr>
+        <tr>
+            <td>profile</td>
+            <td>map</td>
+            <td>Fields read for every parcel: full, map (geometry and the properties shown) or summary (map without geometry, which is null).</td>
+            <td>?bbox=-5.763941,40.435861,-5.746592,40.441145&profile=summary</td>
+        </tr>
     </table>
     ### Show parcel
         GET /parcels/{cadastralReference}
+    <table class="table table-condensed">
+        <tr>
+            <th>Query Parameter</th>
+            <th>Default</th>
+            <th>Description</th>
+            <th>Example</th>
+        </tr>
+        <tr>
+            <td>profile</td>
+            <td>full</td>
+            <td>Fields read of the parcel: full, map or summary.</td>
+            <td>?profile=summary</td>
+        </tr>
+    </table>
 
     [osc]: https://opensmartcountry.com/ "Open Smart Country"
     [geojson]: http://geojson.org/ "GeoJSON Home Page"
@@ -274,11 +365,26 @@ class ParcelViewSet(viewsets.ViewSet):
     def list(self, request):
         bbox = request.query_params.get('bbox', None)
         precision = request.query_params.get('precision', None)
-        return Response(getParcels(request=request, bbox=bbox, precision=precision))
+        page_token = request.query_params.get('page_token', None)
+        profile = request.query_params.get('profile', PARCEL_LIST_PROFILE)
+        try:
+            page_size = request.query_params.get('page_size', None)
+            page_size = int(page_size) if page_size is not None else None
+            parcels = getParcels(request=request,
+                                 bbox=bbox,
+                                 precision=precision,
+                                 page_size=page_size,
+                                 page_token=page_token,
+                                 profile=profile)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(parcels)
 
     def retrieve(self, request, pk=""):
+        profile = request.query_params.get('profile', 'full')
         try:
-            parcel = getParcelByNationalCadastralReference(nationalCadastralReference=pk)
+            parcel = getParcelByNationalCadastralReference(nationalCadastralReference=pk,
+                                                           profile=profile)
         except KeyError:
             return Response(status=status.HTTP_404_NOT_FOUND)
         except ValueError:
@@ -286,6 +392,33 @@ class ParcelViewSet(viewsets.ViewSet):
         return Response(parcel)
 
 
+class ParcelTile(APIView):
+    """Parcels as [Mapbox Vector Tiles][mvt], in a layer named parcels.
+
+    Polygons are clipped to the tile and simplified for its zoom level.
+    Tiles below zoom 13 are empty.
+
+    ### Get tile
+        GET /parcels/tiles/{z}/{x}/{y}.mvt
+
+    [mvt]: https://github.com/mapbox/vector-tile-spec "Vector Tile Specification"
+    """
+
+    def perform_content_negotiation(self, request, force=False):
+        # Map clients ask for protobuf, which no renderer offers
+        return super(ParcelTile, self).perform_content_negotiation(request, force=True)
+
+    def get(self, request, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if x >= 2 ** z or y >= 2 ** z:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        response = HttpResponse(cadastre_service.get_parcels_tile(z, x, y),
+                                content_type=MVT_CONTENT_TYPE)
+        patch_cache_control(response, public=True, max_age=tiles_max_age)
+        return response
+
+
 class OpenSmartCountryApiView(APIView):
     """Welcome to the OSC API. This is the entry point for the API used by
     [Open Smart Country][osc], so almost everything the web ui is able to do